@@ -0,0 +1,166 @@
+"""
+Nightly batch diary generation.
+
+Finds every user who chatted on a given day and generates their diary ahead of
+time, so the calendar page doesn't trigger LLM calls during user sessions.
+
+Usage:
+    python batch_diaries.py                      # yesterday
+    python batch_diaries.py --date 2026-10-17 --concurrency 8 --rate 60
+
+Progress is checkpointed to a JSON file after every diary, so a rerun with the
+same date only processes the users that are still missing.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, timedelta
+from typing import List, Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from config.openai_config import close_async_client
+from config.supabase_client import close_db_executor, db_call
+from routes.diary import admin_supabase, after_cursor, generate_and_save_diary, _day_bounds
+from utils.llm_scheduler import PRIORITY_BATCH, llm_scheduler
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("batch_diaries")
+
+
+class RateLimiter:
+    """
+    Spaces out calls so no more than ``per_minute`` start in any minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+            self._next_time = max(now, self._next_time) + self.interval
+
+
+async def find_users_with_chats(day: date, page_size: int = 1000) -> List[str]:
+    """
+    Return the UUIDs of users with Chat rows on the given day, in first-chat order.
+    """
+    start, end = _day_bounds(day)
+    users = {}
+    cursor = None
+    while True:
+        query = (admin_supabase.table("Chat")
+                 .select("id, uuid, created_at")
+                 .lt("created_at", end))
+        query = after_cursor(query, start, cursor)
+        chat_response = await db_call(
+            lambda: query.order("created_at,id").limit(page_size).execute()
+        )
+        for row in chat_response.data:
+            users.setdefault(row["uuid"], None)
+        if len(chat_response.data) < page_size:
+            return list(users)
+        cursor = (chat_response.data[-1]["created_at"], chat_response.data[-1]["id"])
+
+
+def load_checkpoint(path: str, day: date) -> Set[str]:
+    """
+    Return the UUIDs already completed for the day.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("date") != day.isoformat():
+        logger.warning(f"Ignoring checkpoint {path} for another date ({checkpoint.get('date')})")
+        return set()
+    return set(checkpoint.get("completed", []))
+
+
+def save_checkpoint(path: str, day: date, completed: Set[str], failed: Set[str]) -> None:
+    # Write to a temp file and rename so a crash never leaves a truncated checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"date": day.isoformat(), "completed": sorted(completed), "failed": sorted(failed)}, f)
+    os.replace(tmp_path, path)
+
+
+async def run(day: date, concurrency: int, rate: float, checkpoint_path: str) -> int:
+    """
+    Generate diaries for every user who chatted on ``day``.
+
+    Returns:
+        int: Number of users whose diary failed
+    """
+    users = await find_users_with_chats(day)
+    completed = load_checkpoint(checkpoint_path, day)
+    pending = [user_uuid for user_uuid in users if user_uuid not in completed]
+    logger.info(f"{len(users)} users chatted on {day.isoformat()}, {len(pending)} diaries to generate")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    failed: Set[str] = set()
+
+    async def generate_one(user_uuid: str) -> None:
+        async with semaphore:
+            await limiter.wait()
+            try:
+                _, emotion = await generate_and_save_diary(
+                    user_uuid, day, raise_errors=True, priority=PRIORITY_BATCH
+                )
+                completed.add(user_uuid)
+                failed.discard(user_uuid)
+                logger.info(f"Generated diary for {user_uuid} ({emotion})")
+            except Exception as e:
+                failed.add(user_uuid)
+                logger.error(f"Failed to generate diary for {user_uuid}: {str(e)}")
+            save_checkpoint(checkpoint_path, day, completed, failed)
+
+    start_time = time.time()
+    try:
+        await asyncio.gather(*(generate_one(user_uuid) for user_uuid in pending))
+    finally:
+        await close_async_client()
+        close_db_executor()
+    logger.info(
+        f"Finished in {time.time() - start_time:.1f} seconds: "
+        f"{len(pending) - len(failed)} generated, {len(failed)} failed"
+    )
+    batch_stats = llm_scheduler.stats()["priorities"]["batch"]
+    logger.info(
+        f"LLM queue wait: avg {batch_stats['avg_wait']:.2f} seconds, max {batch_stats['max_wait']:.2f} seconds"
+    )
+    return len(failed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate diaries for every user who chatted on a given day.")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today() - timedelta(days=1),
+                        help="Day to generate diaries for (YYYY-MM-DD, default: yesterday)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_DIARY_CONCURRENCY", "4")),
+                        help="Maximum diaries generated at the same time")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("BATCH_DIARY_RATE_PER_MINUTE", "60")),
+                        help="Maximum diaries started per minute (0 for no limit)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: diary_checkpoint_<date>.json)")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or f"diary_checkpoint_{args.date.isoformat()}.json"
+    failures = asyncio.run(run(args.date, args.concurrency, args.rate, checkpoint_path))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Load test and latency-regression check for the API.
+
+Drives main.app in-process through httpx's ASGI transport, with the local
+PostgREST stand-in (SUPABASE_BACKEND=local) and the local LLM backend
+(LLM_BACKEND=local), so it runs offline and without credentials. Set
+either variable yourself to point a run at the real services instead.
+
+Seeded users are onboarded (animal assigned) and have today's chats stored.
+A closed loop of --concurrency workers then sends a weighted mix of:
+
+    chat            POST /chat with an emotion, regular exchange
+    chat_fourth     POST /chat for a user on their 4th message (animal assignment)
+    user            GET  /user/{uuid}
+    diary_dates     GET  /diary/dates/{uuid}
+    diary_generate  POST /diary/generate/{uuid}
+
+and reports throughput and p50/p95/p99 latency per scenario, plus the
+event-loop lag and the number of calls that blocked the loop (utils/loop_monitor.py).
+
+Usage:
+    python benchmarks/load_test.py                       # run and compare with the baseline
+    python benchmarks/load_test.py --save-baseline       # run and store the results as the baseline
+    python benchmarks/load_test.py --requests 2000 --concurrency 64 --output results.json
+
+The run exits with status 1 when a scenario's p95/p99 latency grows, or its
+throughput drops, by more than --tolerance against the baseline (latency
+changes under --min-delta-ms are ignored as noise), or its error rate rises;
+and when loop-lag p99 regresses the same way or more calls block the loop.
+Baselines depend on the machine; save one before comparing on a new one.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import uuid as uuid_lib
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Offline stand-ins unless the environment says otherwise. The local LLM has
+# no provider quota, so the scheduler's rate limits are lifted too; set
+# LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE to benchmark under them.
+os.environ.setdefault("SUPABASE_BACKEND", "local")
+os.environ.setdefault("LLM_BACKEND", "local")
+# Loop lag and blocking calls are part of the regression check
+os.environ.setdefault("LOOP_DIAGNOSTICS", "true")
+if os.environ["LLM_BACKEND"] == "local":
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+
+import httpx
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_test.json")
+
+MESSAGES = [
+    "I failed my exam today and I don't know how to tell my parents.",
+    "I finally got the internship I applied for!",
+    "My roommate ate my food again without asking.",
+    "I have a presentation tomorrow and I can't stop thinking about it.",
+    "Nothing much happened today, just classes.",
+    "My best friend is moving to another city next month.",
+]
+EMOTIONS = ["happy", "sad", "angry", "anxious", "neutral"]
+
+# Scenario weights of the default mix
+MIX = {
+    "chat": 50,
+    "chat_fourth": 10,
+    "user": 20,
+    "diary_dates": 15,
+    "diary_generate": 5,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of ``values`` (0 <= p <= 100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, users: int, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.users = [str(uuid_lib.UUID(int=rng.getrandbits(128))).upper() for _ in range(users)]
+        self.latencies: Dict[str, List[float]] = {name: [] for name in MIX}
+        self.errors: Dict[str, int] = {name: 0 for name in MIX}
+
+    def _new_user_row(self, user_uuid: str, onboarded: bool) -> dict:
+        return {
+            "uuid": user_uuid,
+            "nickname": "bench",
+            "animal_type": "dog" if onboarded else None,
+            "animal_emotion": "neutral" if onboarded else None,
+            "animal_level": 1,
+            "points": 0,
+            "is_notified": False,
+        }
+
+    def seed(self) -> None:
+        from config.supabase_client import supabase
+        from routes.chat import MAX_EXCHANGES, conversation_store
+
+        now = datetime.now(timezone.utc)
+        chats = []
+        for user_uuid in self.users:
+            for i in range(8):
+                chats.append({
+                    "uuid": user_uuid,
+                    "user_input": self.rng.choice(MESSAGES),
+                    "chat_output": "That sounds like a lot. How did it make you feel?",
+                    "created_at": (now - timedelta(minutes=8 - i)).isoformat(),
+                })
+            # Onboarded users are past the animal assignment message
+            for _ in range(MAX_EXCHANGES):
+                conversation_store.increment_count(user_uuid)
+        supabase.table("User").insert([self._new_user_row(u, True) for u in self.users]).execute()
+        supabase.table("Chat").insert(chats).execute()
+
+    def new_fourth_message_user(self) -> str:
+        """
+        Create a user whose next /chat is their 4th message.
+        """
+        from config.supabase_client import supabase
+        from routes.chat import MAX_EXCHANGES, conversation_store
+
+        user_uuid = str(uuid_lib.UUID(int=self.rng.getrandbits(128))).upper()
+        supabase.table("User").insert(self._new_user_row(user_uuid, False)).execute()
+        for i in range(MAX_EXCHANGES - 1):
+            conversation_store.increment_count(user_uuid)
+            conversation_store.append_message(user_uuid, "user", MESSAGES[i])
+            conversation_store.append_message(user_uuid, "assistant", "Tell me more about that.")
+        return user_uuid
+
+    async def _chat(self) -> httpx.Response:
+        return await self.client.post("/chat", json={
+            "message": self.rng.choice(MESSAGES),
+            "uuid": self.rng.choice(self.users),
+            "emotion": self.rng.choice(EMOTIONS),
+        })
+
+    async def _chat_fourth(self) -> httpx.Response:
+        user_uuid = await asyncio.to_thread(self.new_fourth_message_user)
+        return await self.client.post("/chat", json={
+            "message": self.rng.choice(MESSAGES),
+            "uuid": user_uuid,
+            "emotion": self.rng.choice(EMOTIONS),
+        })
+
+    async def _user(self) -> httpx.Response:
+        return await self.client.get(f"/user/{self.rng.choice(self.users)}")
+
+    async def _diary_dates(self) -> httpx.Response:
+        return await self.client.get(f"/diary/dates/{self.rng.choice(self.users)}")
+
+    async def _diary_generate(self) -> httpx.Response:
+        return await self.client.post(f"/diary/generate/{self.rng.choice(self.users)}")
+
+    def scenarios(self) -> Dict[str, Callable[[], Awaitable[httpx.Response]]]:
+        return {
+            "chat": self._chat,
+            "chat_fourth": self._chat_fourth,
+            "user": self._user,
+            "diary_dates": self._diary_dates,
+            "diary_generate": self._diary_generate,
+        }
+
+    async def run(self, requests: int, concurrency: int, seed: int = 0) -> float:
+        scenarios = self.scenarios()
+        names = list(MIX)
+        # Own RNG for the plan, so the mix doesn't depend on request interleaving
+        plan = random.Random(seed).choices(names, weights=[MIX[name] for name in names], k=requests)
+        queue: asyncio.Queue = asyncio.Queue()
+        for name in plan:
+            queue.put_nowait(name)
+
+        async def worker() -> None:
+            while not queue.empty():
+                name = queue.get_nowait()
+                start_time = time.perf_counter()
+                try:
+                    response = await scenarios[name]()
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                self.latencies[name].append(time.perf_counter() - start_time)
+                if failed:
+                    self.errors[name] += 1
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start_time
+
+    def results(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for name, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            results[name] = {
+                "requests": len(latencies),
+                "error_rate": round(self.errors[name] / len(latencies), 4),
+                "throughput": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+            }
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        results["total"] = {
+            "requests": len(everything),
+            "error_rate": round(sum(self.errors.values()) / len(everything), 4),
+            "throughput": round(len(everything) / elapsed, 2),
+            "p50_ms": round(percentile(everything, 50) * 1000, 1),
+            "p95_ms": round(percentile(everything, 95) * 1000, 1),
+            "p99_ms": round(percentile(everything, 99) * 1000, 1),
+            "mean_ms": round(statistics.mean(everything) * 1000, 1),
+        }
+        return results
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'scenario':<16}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, stats in results.items():
+        if name == "loop":
+            continue
+        print(
+            f"{name:<16}{stats['requests']:>9}{stats['error_rate']:>8.1%}{stats['throughput']:>9.1f}"
+            f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+        )
+    loop = results.get("loop")
+    if loop:
+        print(
+            f"\nLoop lag: p50 {loop['p50_ms']:.1f}ms, p95 {loop['p95_ms']:.1f}ms, p99 {loop['p99_ms']:.1f}ms, "
+            f"max {loop['max_ms']:.1f}ms; {loop['blocked']} blocking calls"
+        )
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+    min_delta_ms: float
+) -> List[str]:
+    """
+    Return a description of every regression against the baseline.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None or name == "loop":
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            limit = max(base[metric] * (1 + tolerance), base[metric] + min_delta_ms)
+            if current[metric] > limit:
+                regressions.append(f"{name} {metric}: {current[metric]:.1f} > {limit:.1f} (baseline {base[metric]:.1f})")
+        floor = base["throughput"] * (1 - tolerance)
+        if current["throughput"] < floor:
+            regressions.append(
+                f"{name} throughput: {current['throughput']:.1f} < {floor:.1f} (baseline {base['throughput']:.1f})"
+            )
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name} error_rate: {current['error_rate']:.1%} (baseline {base['error_rate']:.1%})")
+
+    base, current = baseline.get("loop"), results.get("loop")
+    if base and current:
+        limit = max(base["p99_ms"] * (1 + tolerance), base["p99_ms"] + min_delta_ms)
+        if current["p99_ms"] > limit:
+            regressions.append(f"loop lag p99_ms: {current['p99_ms']:.1f} > {limit:.1f} (baseline {base['p99_ms']:.1f})")
+        if current["blocked"] > base["blocked"]:
+            regressions.append(f"loop blocking calls: {current['blocked']} (baseline {base['blocked']})")
+    return regressions
+
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    import main
+    from utils.loop_monitor import LOOP_DIAGNOSTICS, loop_monitor
+
+    app = main.app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60.0) as client:
+            load_test = LoadTest(client, args.users, random.Random(args.seed))
+            await asyncio.to_thread(load_test.seed)
+            if args.warmup:
+                await load_test.run(args.warmup, args.concurrency, args.seed + 1)
+                load_test.latencies = {name: [] for name in MIX}
+                load_test.errors = {name: 0 for name in MIX}
+                loop_monitor.reset()
+            elapsed = await load_test.run(args.requests, args.concurrency, args.seed)
+            loop_stats = loop_monitor.stats()
+
+    results = load_test.results(elapsed)
+    if LOOP_DIAGNOSTICS:
+        results["loop"] = loop_stats
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the API and check for latency regressions.")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests (default: 500)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients (default: 16)")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests sent first (default: 50)")
+    parser.add_argument("--users", type=int, default=50, help="Seeded users (default: 50)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the request mix (default: 0)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative regression of p95/p99 and throughput (default: 0.25)")
+    parser.add_argument("--min-delta-ms", type=float, default=25.0,
+                        help="Latency increases below this are never regressions (default: 25)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's info and warning logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    results = asyncio.run(run_load_test(args))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
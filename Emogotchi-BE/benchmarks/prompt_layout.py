@@ -0,0 +1,160 @@
+"""
+Compare the old and new therapist prompt layouts.
+
+The old layout formatted the mood and the user's message into the system
+prompt (twice: DEFAULT_PROMPT and SCORING_PROMPT), so every request had a
+unique system prompt. The new layout (config/prompts.py) sends a static,
+versioned system prefix and puts the mood and message in the user turn.
+
+Usage:
+    python benchmarks/prompt_layout.py                 # token counts only
+    python benchmarks/prompt_layout.py --live 20       # also time 20 real calls per layout
+
+Token counts use tiktoken when it is installed and the ~4 characters/token
+estimate otherwise. "Shared prefix" is how many leading tokens every request
+of a layout has in common, i.e. what a provider-side prefix cache could reuse.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from config.prompts import THERAPIST_REPLY
+from utils.history import estimate_tokens
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+except ImportError:
+    tiktoken = None
+
+    def count_tokens(text: str) -> int:
+        return estimate_tokens(text)
+
+# The therapist prompt as it was before config/prompts.py
+LEGACY_DEFAULT_PROMPT = """I want to use you as my therapist right now. From this point on, you're the counselor, and your role is to understand and heal my emotions as much as possible. The emotion I'm currently feeling is {emotion}, which is one of the following: HAPPY, SAD, ANGRY, ANXIOUS, CALM, EXCITED, SLEEPY, or NEUTRAL.
+And based on the message saying "Why are you feeling {emotion}?" the user said "{message}".
+Use this information to guide your responses, but don't mention what I just explained—just act like the therapist right away. And says like a human don't be repetitive."""
+
+LEGACY_SCORING_PROMPT = """User response: "{message}".
+
+Admin instruction:
+Based on the user's response, generate your own therapeutic reply. Then, evaluate the user's emotional state on a scale from 0 to 4, where 0 indicates complete emotional distress and 5 indicates emotional stability.
+
+0 = Severely distressed / Harmful content
+1 = Anxious / Worried
+2 = Sad / Depressed
+3 = Angry / Frustrated / Irritable
+4 = Positive / Hopeful / Grateful
+
+Consider factors like emotional depth, vulnerability, thoughtfulness, and engagement.
+
+Format your output as follows: gpt: {{your_response}} points: {{int}}"""
+
+SAMPLES = [
+    ("sad", "I failed my exam today and I don't know how to tell my parents."),
+    ("happy", "I finally got the internship I applied for!"),
+    ("angry", "My roommate ate my food again without asking."),
+    ("anxious", "I have a presentation tomorrow and I can't stop thinking about it."),
+    ("neutral", "Nothing much happened today, just classes."),
+    ("sad", "My best friend is moving to another city next month."),
+    ("anxious", "I keep waking up at 3am and can't fall back asleep."),
+    ("happy", "We won the basketball game in the last second!"),
+]
+
+
+def legacy_messages(emotion: str, message: str) -> List[Dict[str, str]]:
+    system_prompt = LEGACY_DEFAULT_PROMPT.format(emotion=emotion.upper(), message=message)
+    system_prompt += "\n\n" + LEGACY_SCORING_PROMPT.format(message=message)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": message}
+    ]
+
+
+def template_messages(emotion: str, message: str) -> List[Dict[str, str]]:
+    return THERAPIST_REPLY.build(emotion=emotion.upper(), message=message)
+
+
+LAYOUTS: Dict[str, Callable[[str, str], List[Dict[str, str]]]] = {
+    "legacy": legacy_messages,
+    THERAPIST_REPLY.key: template_messages
+}
+
+
+def _serialize(messages: List[Dict[str, str]]) -> str:
+    return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+
+def shared_prefix_tokens(requests: List[List[Dict[str, str]]]) -> int:
+    serialized = [_serialize(messages) for messages in requests]
+    prefix = os.path.commonprefix(serialized)
+    return count_tokens(prefix)
+
+
+def offline_report() -> None:
+    print(f"Token counter: {'tiktoken' if tiktoken else 'estimate (len/4)'}")
+    print(f"{'layout':<22}{'avg prompt tokens':>18}{'shared prefix':>15}{'unique tokens':>15}")
+    for name, build in LAYOUTS.items():
+        requests = [build(emotion, message) for emotion, message in SAMPLES]
+        tokens = [sum(count_tokens(m["content"]) for m in messages) for messages in requests]
+        average = statistics.mean(tokens)
+        prefix = shared_prefix_tokens(requests)
+        print(f"{name:<22}{average:>18.1f}{prefix:>15}{average - prefix:>15.1f}")
+
+
+async def live_report(calls: int) -> None:
+    from config.openai_config import async_client, close_async_client
+
+    print(f"\nLive: {calls} calls per layout")
+    print(f"{'layout':<22}{'p50 latency':>12}{'mean latency':>14}{'prompt tokens':>15}{'cached tokens':>15}")
+    try:
+        for name, build in LAYOUTS.items():
+            latencies, prompt_tokens, cached_tokens = [], [], []
+            for i in range(calls):
+                emotion, message = SAMPLES[i % len(SAMPLES)]
+                start_time = time.perf_counter()
+                response = await async_client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=build(emotion, message),
+                    max_tokens=150,
+                    temperature=0.7
+                )
+                latencies.append(time.perf_counter() - start_time)
+                prompt_tokens.append(response.usage.prompt_tokens)
+                details = getattr(response.usage, "prompt_tokens_details", None)
+                cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", 0)
+                cached_tokens.append(cached or 0)
+            print(
+                f"{name:<22}{statistics.median(latencies):>11.2f}s{statistics.mean(latencies):>13.2f}s"
+                f"{statistics.mean(prompt_tokens):>15.1f}{statistics.mean(cached_tokens):>15.1f}"
+            )
+    finally:
+        await close_async_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the old and new therapist prompt layouts.")
+    parser.add_argument("--live", type=int, default=0, metavar="N",
+                        help="Also time N real OpenAI calls per layout (uses OPENAI_API_KEY)")
+    args = parser.parse_args()
+
+    offline_report()
+    if args.live:
+        asyncio.run(live_report(args.live))
+
+
+if __name__ == "__main__":
+    main()
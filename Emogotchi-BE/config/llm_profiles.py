@@ -0,0 +1,122 @@
+"""
+Per-task LLM settings.
+
+Every LLM call names a profile (chat_reply, admin_analysis, animal_selection,
+combined_analysis or diary) that sets its model, token cap, temperature,
+stop sequences and timeout. The defaults below can be overridden without code
+changes by pointing LLM_PROFILES_PATH at a JSON file such as:
+
+    {
+        "animal_selection": {"model": "gpt-4o-mini", "max_tokens": 3},
+        "diary": {"timeout": 45}
+    }
+
+Fields left out of the file keep their defaults.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LLMProfile(BaseModel):
+    name: str
+    model: str = "gpt-3.5-turbo"
+    max_tokens: int = 150
+    temperature: float = 0.7
+    timeout: Optional[float] = 5.0
+    stop: Optional[List[str]] = None
+
+
+DEFAULT_PROFILES = {
+    "chat_reply": LLMProfile(name="chat_reply", max_tokens=150, timeout=5.0),
+    "admin_analysis": LLMProfile(name="admin_analysis", max_tokens=200, timeout=5.0),
+    # One-word classification: short, greedy and cut at the first line break
+    "animal_selection": LLMProfile(name="animal_selection", max_tokens=5, temperature=0.0, timeout=3.0, stop=["\n"]),
+    "combined_analysis": LLMProfile(name="combined_analysis", max_tokens=250, timeout=5.0),
+    "diary": LLMProfile(name="diary", max_tokens=500, timeout=30.0)
+}
+
+
+def load_profiles(path: Optional[str] = None) -> Dict[str, LLMProfile]:
+    """
+    Return the default profiles with the overrides from a JSON file applied.
+
+    Args:
+        path (str, optional): JSON file mapping profile names to field overrides
+
+    Returns:
+        Dict[str, LLMProfile]: Profiles by name
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    if not path:
+        return profiles
+
+    with open(path) as f:
+        overrides = json.load(f)
+    for name, fields in overrides.items():
+        base = profiles.get(name, LLMProfile(name=name))
+        profiles[name] = LLMProfile(**{**base.model_dump(), **fields, "name": name})
+    logger.info(f"Loaded LLM profile overrides for {', '.join(overrides)} from {path}")
+    return profiles
+
+
+profiles = load_profiles(os.getenv("LLM_PROFILES_PATH"))
+
+
+def get_profile(name: str) -> LLMProfile:
+    return profiles[name]
+
+
+class ProfileStats:
+    """
+    Calls, errors, latency and token totals per profile.
+    """
+
+    def __init__(self):
+        self._profiles: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> Dict[str, float]:
+        stats = self._profiles.get(name)
+        if stats is None:
+            stats = {
+                "calls": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0
+            }
+            self._profiles[name] = stats
+        return stats
+
+    def record(self, name: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            stats = self._get(name)
+            stats["calls"] += 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+
+    def record_error(self, name: str) -> None:
+        with self._lock:
+            self._get(name)["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    **stats,
+                    "avg_latency": stats["total_latency"] / stats["calls"] if stats["calls"] else 0.0,
+                    "avg_completion_tokens": stats["completion_tokens"] / stats["calls"] if stats["calls"] else 0.0
+                }
+                for name, stats in self._profiles.items()
+            }
+
+
+profile_stats = ProfileStats()
@@ -1,11 +1,23 @@
-from openai import OpenAI
+from openai import APITimeoutError, OpenAI, AsyncOpenAI
+import httpx
 import os
 from dotenv import load_dotenv
-from models.schemas import CharacterType, EmotionType
+from models.schemas import CharacterType, CombinedAnalysis, EmotionType
 import logging
 from openai.types.chat import ChatCompletion
 import time
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
+from config.llm_profiles import LLMProfile, get_profile, profile_stats
+from config.prompts import (
+    ADMIN_ANALYSIS, ANIMAL_SELECTION, COMBINED_ANALYSIS, THERAPIST_REPLY, PromptTemplate, prompt_stats
+)
+from utils.history import estimate_tokens, trim_to_token_budget
+from utils.cassette import AsyncCassetteTransport, CassetteTransport, cassette
+from utils.circuit_breaker import get_breaker
+from utils.llm_cache import LLMResponseCache, llm_cache
+from utils.llm import create_llm_backend
+from utils.llm_scheduler import PRIORITY_CHAT, llm_scheduler
+from utils.metrics import llm_errors, llm_fallbacks, llm_request_duration, llm_timeouts, llm_tokens
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -14,29 +26,140 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Connection pool settings for the shared async client
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "500"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "100"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
 
-# Default therapist prompt template
-DEFAULT_PROMPT = """I want to use you as my therapist right now. From this point on, you're the counselor, and your role is to understand and heal my emotions as much as possible. The emotion I'm currently feeling is {emotion}, which is one of the following: HAPPY, SAD, ANGRY, ANXIOUS, CALM, EXCITED, SLEEPY, or NEUTRAL. 
-And based on the message saying "Why are you feeling {emotion}?" the user said "{message}".
-Use this information to guide your responses, but don't mention what I just explained—just act like the therapist right away. And says like a human don't be repetitive."""
+# Upper bound on the estimated tokens of history sent with an admin analysis
+ADMIN_HISTORY_TOKEN_BUDGET = int(os.getenv("ADMIN_HISTORY_TOKEN_BUDGET", "1500"))
 
-# Scoring prompt for determining points
-SCORING_PROMPT = """User response: "{message}".
+# How long an interactive chat call may queue for an LLM slot before falling back
+CHAT_MAX_QUEUE_WAIT = float(os.getenv("LLM_CHAT_MAX_QUEUE_WAIT_SECONDS", "2"))
 
-Admin instruction:
-Based on the user's response, generate your own therapeutic reply. Then, evaluate the user's emotional state on a scale from 0 to 4, where 0 indicates complete emotional distress and 5 indicates emotional stability.
+# The local backend and cassette replay never call OpenAI, so they don't need a real key
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or (
+    "local-backend" if os.getenv("LLM_BACKEND", "openai").lower() == "local"
+    else "cassette-replay" if cassette is not None and cassette.mode == "replay" else None
+)
 
-0 = Severely distressed / Harmful content
-1 = Anxious / Worried
-2 = Sad / Depressed
-3 = Angry / Frustrated / Irritable 
-4 = Positive / Hopeful / Grateful 
+# Initialize OpenAI client (recording/replaying through the cassette if one is active)
+if cassette is not None:
+    client = OpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.Client(transport=CassetteTransport(cassette), timeout=httpx.Timeout(60.0, connect=5.0))
+    )
+else:
+    client = OpenAI(api_key=OPENAI_API_KEY)
 
-Consider factors like emotional depth, vulnerability, thoughtfulness, and engagement.
+# Initialize the async OpenAI client on a single pooled httpx client so every
+# request handler in the worker reuses the same keep-alive connections
+async_transport = httpx.AsyncHTTPTransport(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    )
+)
+if cassette is not None:
+    async_transport = AsyncCassetteTransport(cassette, async_transport)
+async_http_client = httpx.AsyncClient(
+    transport=async_transport,
+    timeout=httpx.Timeout(60.0, connect=5.0)
+)
+async_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=async_http_client
+)
 
-Format your output as follows: gpt: {{your_response}} points: {{int}}"""
+# Backend every completion goes through (selected by LLM_BACKEND)
+llm_backend = create_llm_backend(client, async_client)
+
+def _select_template(
+    is_animal_selection: bool = False,
+    is_admin_analysis: bool = False,
+    conversation_history: Optional[List[Dict[str, str]]] = None
+) -> PromptTemplate:
+    """
+    Pick the prompt template of a get_ai_response call.
+    """
+    if is_admin_analysis and conversation_history:
+        return ADMIN_ANALYSIS
+    if is_animal_selection:
+        return ANIMAL_SELECTION
+    # Regular conversations use the therapist prompt with scoring
+    return THERAPIST_REPLY
+
+def _profile_name(is_animal_selection: bool = False, is_admin_analysis: bool = False) -> str:
+    """
+    Pick the LLM profile (and circuit breaker) of a get_ai_response call.
+    """
+    if is_admin_analysis:
+        return "admin_analysis"
+    if is_animal_selection:
+        return "animal_selection"
+    return "chat_reply"
+
+def _record_metrics(call_type: str, seconds: float, prompt_tokens: int, completion_tokens: int) -> None:
+    llm_request_duration.observe(seconds, call_type=call_type)
+    llm_tokens.inc(prompt_tokens, call_type=call_type, kind="prompt")
+    llm_tokens.inc(completion_tokens, call_type=call_type, kind="completion")
+
+def _record_error_metrics(call_type: str, error: Exception) -> None:
+    if isinstance(error, (TimeoutError, APITimeoutError)):
+        llm_timeouts.inc(call_type=call_type)
+    else:
+        llm_errors.inc(call_type=call_type)
+
+def _build_messages(
+    message: str,
+    current_mood: Optional[str] = None,
+    is_animal_selection: bool = False,
+    is_admin_analysis: bool = False,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    admin_prompt: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """
+    Build the chat messages for a get_ai_response call.
+
+    Returns:
+        List[Dict]: Messages to send to the chat completions API
+    """
+    template = _select_template(is_animal_selection, is_admin_analysis, conversation_history)
+
+    if template is ADMIN_ANALYSIS:
+        # Include the most recent conversation history that fits the budget
+        messages = template.build(
+            history=trim_to_token_budget(conversation_history, ADMIN_HISTORY_TOKEN_BUDGET),
+            message=message
+        )
+        if admin_prompt:
+            # Caller-supplied admin prompt replaces the template's prefix
+            messages[0]["content"] = admin_prompt
+        return messages
+
+    if template is THERAPIST_REPLY:
+        # The mood goes in the user turn so the system prefix is identical for everyone
+        return template.build(emotion=(current_mood or "neutral").upper(), message=message)
+    return template.build(message=message)
+
+def _fallback_response(
+    current_mood: Optional[str] = None,
+    is_animal_selection: bool = False,
+    is_admin_analysis: bool = False
+) -> str:
+    """
+    Return the canned response used when the OpenAI call fails.
+    """
+    llm_fallbacks.inc(call_type=_profile_name(is_animal_selection, is_admin_analysis))
+    if is_admin_analysis:
+        return "emotion: neutral, animal: dog"  # Default fallback analysis
+    elif is_animal_selection:
+        return "dog"  # Default fallback animal
+    else:
+        if not current_mood:
+            current_mood = "neutral"
+        return f"I understand you're feeling {current_mood}. How can I help you today?"
 
 def get_ai_response(
     message: str, 
@@ -63,76 +186,268 @@ def get_ai_response(
         str: AI's response
     """
     try:
-        # Admin analysis of conversation
-        if is_admin_analysis and conversation_history:
-            # Use the admin prompt passed from chat.py
-            system_prompt = admin_prompt
-            
-        # Create the system prompt based on the scenario
-        elif is_animal_selection:
-            system_prompt = """You are an animal matching expert. 
-Based on the conversation history, you need to match the user with the most suitable animal type.
-Choose from: tiger, penguin, hamster, pig, or dog.
-Respond with ONLY the animal name in lowercase, nothing else."""
-        else:
-            # For regular conversations, use the therapist prompt with scoring
-            if not current_mood:
-                current_mood = "neutral"
-                
-            if not character_type:
-                character_type = "friendly pet"
-                
-            # Substitute values into the default prompt and add scoring
-            system_prompt = DEFAULT_PROMPT.format(
-                emotion=current_mood.upper(),
-                message=message
-            )
-            
-            # Add the scoring prompt to get points in the response
-            system_prompt += "\n\n" + SCORING_PROMPT.format(message=message)
-            logger.info(f"Using scoring prompt to get points in the response")
-
-        # Create the messages for the API call
-        if is_admin_analysis and conversation_history:
-            # Include the conversation history for analysis
-            messages = [
-                {"role": "system", "content": system_prompt},
-                *conversation_history,
-                {"role": "user", "content": message}
-            ]
-        else:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ]
-
-        # Call OpenAI API with timeout
-        start_time = time.time()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=200 if is_admin_analysis else 150,  # Fixed the incomplete line
-            temperature=0.7,
-            timeout=5  # 5 second timeout
+        messages = _build_messages(
+            message=message,
+            current_mood=current_mood,
+            is_animal_selection=is_animal_selection,
+            is_admin_analysis=is_admin_analysis,
+            conversation_history=conversation_history,
+            admin_prompt=admin_prompt
         )
+
+        # Call OpenAI API with the profile's model, limits and timeout
+        profile = get_profile(_profile_name(is_animal_selection, is_admin_analysis))
+        start_time = time.time()
+        try:
+            completion = llm_backend.complete_sync(profile, messages)
+        except Exception as e:
+            _record_error_metrics(profile.name, e)
+            raise
         end_time = time.time()
         logger.info(f"OpenAI response time: {end_time - start_time:.2f} seconds")
+        usage = completion.usage
+        _record_metrics(
+            profile.name,
+            end_time - start_time,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0
+        )
+        prompt_stats.record_usage(
+            _select_template(is_animal_selection, is_admin_analysis, conversation_history).key, completion.usage
+        )
 
         # Extract and return the response
-        ai_response = response.choices[0].message.content
+        ai_response = completion.text
         logger.info(f"OpenAI response: {ai_response}")
         return ai_response
 
     except Exception as e:
         logger.error(f"Error getting AI response: {str(e)}")
         # Return a fallback response based on the scenario
-        if is_admin_analysis:
-            return "emotion: neutral, animal: dog"  # Default fallback analysis
-        elif is_animal_selection:
-            return "dog"  # Default fallback animalfd
-        else:
-            if not character_type:
-                character_type = "friendly pet"
-            if not current_mood:
-                current_mood = "neutral"
-            return f"I understand you're feeling {current_mood}. How can I help you today?"     
\ No newline at end of file
+        return _fallback_response(current_mood, is_animal_selection, is_admin_analysis)
+
+def _llm_slot(messages: List[Dict[str, str]], max_tokens: int, priority: int):
+    # Charge the tokens-per-minute bucket with the prompt estimate plus the completion cap
+    tokens = sum(estimate_tokens(message["content"] or "") for message in messages) + max_tokens
+    max_wait = CHAT_MAX_QUEUE_WAIT if priority == PRIORITY_CHAT else None
+    return llm_scheduler.slot(priority=priority, tokens=tokens, max_wait=max_wait)
+
+async def _complete(
+    profile: LLMProfile,
+    messages: List[Dict[str, str]],
+    priority: int,
+    response_format: Optional[Dict[str, str]] = None,
+    template: Optional[str] = None,
+    call_type: Optional[str] = None
+) -> str:
+    call_type = call_type or profile.name
+    breaker = get_breaker(call_type)
+    # Fail fast while open, then queue; the breaker (and its hedge) only times
+    # the upstream call, so local queueing can't trip it or take a second slot
+    breaker.check()
+    async with _llm_slot(messages, profile.max_tokens, priority):
+        start_time = time.time()
+        try:
+            completion = await breaker.call(lambda: llm_backend.complete(profile, messages, response_format))
+        except Exception as e:
+            profile_stats.record_error(profile.name)
+            _record_error_metrics(call_type, e)
+            raise
+        end_time = time.time()
+        logger.info(f"OpenAI response time: {end_time - start_time:.2f} seconds")
+        usage = completion.usage
+        prompt_tokens = usage.prompt_tokens if usage else 0
+        completion_tokens = usage.completion_tokens if usage else 0
+        profile_stats.record(profile.name, end_time - start_time, prompt_tokens, completion_tokens)
+        _record_metrics(call_type, end_time - start_time, prompt_tokens, completion_tokens)
+        if template:
+            prompt_stats.record_usage(template, usage)
+
+        ai_response = completion.text
+        logger.info(f"OpenAI response: {ai_response}")
+        return ai_response
+
+async def create_chat_completion(
+    messages: List[Dict[str, str]],
+    profile: str = "chat_reply",
+    use_cache: bool = False,
+    priority: int = PRIORITY_CHAT,
+    call_type: Optional[str] = None,
+    response_format: Optional[Dict[str, str]] = None,
+    template: Optional[str] = None
+) -> str:
+    """
+    Run a chat completion on the LLM backend, admitted through
+    the LLM scheduler and guarded by the circuit breaker of its call type.
+
+    Args:
+        messages (List[Dict]): Messages to send to the model
+        profile (str): LLM profile with the model, token cap, temperature, stop sequences and timeout
+        use_cache (bool): Serve identical requests from the LLM response cache
+        priority (int): Scheduler priority (PRIORITY_CHAT, PRIORITY_DIARY or PRIORITY_BATCH)
+        call_type (str, optional): Circuit breaker and metrics label to use (chat_reply,
+            admin_analysis, animal_selection or diary), the profile's name by default
+        response_format (Dict, optional): e.g. {"type": "json_object"} for JSON mode
+        template (str, optional): Prompt template key the token usage is counted under
+
+    Returns:
+        str: Content of the first choice
+
+    Raises:
+        CircuitOpenError: If the call type's circuit is open
+    """
+    settings = get_profile(profile)
+    call_type = call_type or profile
+
+    def create():
+        return _complete(settings, messages, priority, response_format, template, call_type)
+
+    if use_cache:
+        key = LLMResponseCache.make_key(settings.model, messages, settings.max_tokens, settings.temperature)
+        if response_format:
+            key += ":" + response_format.get("type", "")
+        return await llm_cache.get_or_create(key, create)
+    return await create()
+
+async def get_ai_response_async(
+    message: str,
+    character_type: Optional[str] = None,
+    current_mood: Optional[str] = None,
+    is_animal_selection: bool = False,
+    is_admin_analysis: bool = False,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    admin_prompt: Optional[str] = None,
+    use_cache: bool = False
+) -> str:
+    """
+    Async variant of get_ai_response that awaits the shared AsyncOpenAI client
+    instead of holding an executor thread for the whole call.
+
+    Takes the same arguments and returns the same fallbacks as get_ai_response.
+    Call sites whose inputs repeat can pass use_cache=True to reuse the answer
+    of an identical earlier call. While the call type's circuit is open the
+    fallback is returned without calling OpenAI.
+    """
+    try:
+        messages = _build_messages(
+            message=message,
+            current_mood=current_mood,
+            is_animal_selection=is_animal_selection,
+            is_admin_analysis=is_admin_analysis,
+            conversation_history=conversation_history,
+            admin_prompt=admin_prompt
+        )
+        return await create_chat_completion(
+            messages,
+            profile=_profile_name(is_animal_selection, is_admin_analysis),
+            use_cache=use_cache,
+            template=_select_template(is_animal_selection, is_admin_analysis, conversation_history).key
+        )
+    except Exception as e:
+        logger.error(f"Error getting AI response: {str(e)}")
+        # Return a fallback response based on the scenario
+        return _fallback_response(current_mood, is_animal_selection, is_admin_analysis)
+
+async def get_combined_response_async(
+    conversation_history: List[Dict[str, str]],
+    current_mood: Optional[str] = None
+) -> CombinedAnalysis:
+    """
+    Get the therapist reply, points and emotion/animal analysis in one
+    JSON-mode completion.
+
+    Args:
+        conversation_history (List[Dict]): The conversation, ending with the latest user message
+        current_mood (str, optional): Emotion the user selected, if any
+
+    Returns:
+        CombinedAnalysis: The validated reply, points, emotion and animal
+
+    Raises:
+        Exception: If the call fails or the output doesn't validate; unlike
+        get_ai_response_async there is no canned fallback, so the caller can
+        switch to the two-call path
+    """
+    messages = COMBINED_ANALYSIS.build(history=conversation_history)
+    if current_mood:
+        # Appended after the conversation so the prefix stays static
+        messages.append({"role": "system", "content": f"Note: the user selected the emotion {current_mood.upper()}."})
+    ai_response = await create_chat_completion(
+        messages,
+        profile="combined_analysis",
+        call_type="admin_analysis",
+        response_format={"type": "json_object"},
+        template=COMBINED_ANALYSIS.key
+    )
+    return CombinedAnalysis.model_validate_json(ai_response)
+
+async def close_async_client() -> None:
+    """
+    Close the pooled connections of the shared async client.
+    """
+    await llm_backend.close()
+
+async def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    profile: str = "chat_reply",
+    priority: int = PRIORITY_CHAT,
+    template: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion from the LLM backend using an LLM profile. The scheduler slot is held until the stream ends, and the whole
+    stream, from the time the slot is granted, counts as one call for the profile's circuit breaker. Streams carry
+    no usage block, so token stats are estimated from the text.
+
+    Yields:
+        str: Content deltas as they arrive
+    """
+    settings = get_profile(profile)
+    breaker = get_breaker(profile)
+    breaker.check()
+    async with _llm_slot(messages, settings.max_tokens, priority), breaker.guard():
+        start_time = time.time()
+        first_token_time = None
+        completion_parts = []
+        try:
+            async for delta in llm_backend.stream(settings, messages):
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    logger.info(f"OpenAI time to first token: {first_token_time - start_time:.2f} seconds")
+                completion_parts.append(delta)
+                yield delta
+        except Exception as e:
+            profile_stats.record_error(settings.name)
+            _record_error_metrics(profile, e)
+            raise
+        end_time = time.time()
+        logger.info(f"OpenAI stream time: {end_time - start_time:.2f} seconds")
+        prompt_tokens = sum(estimate_tokens(message["content"] or "") for message in messages)
+        completion_tokens = estimate_tokens("".join(completion_parts))
+        profile_stats.record(settings.name, end_time - start_time, prompt_tokens, completion_tokens)
+        _record_metrics(profile, end_time - start_time, prompt_tokens, completion_tokens)
+        if template:
+            prompt_stats.record(template, prompt_tokens, completion_tokens)
+
+async def stream_ai_response(
+    message: str,
+    character_type: Optional[str] = None,
+    current_mood: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the therapist reply (``gpt: ... points: N``) for a regular chat message.
+
+    Falls back to the canned reply if the call fails before any text arrived.
+
+    Yields:
+        str: Raw content deltas, including the trailing points suffix
+    """
+    produced = False
+    try:
+        messages = _build_messages(message=message, current_mood=current_mood)
+        async for delta in stream_chat_completion(messages, profile="chat_reply", template=THERAPIST_REPLY.key):
+            produced = True
+            yield delta
+    except Exception as e:
+        logger.error(f"Error streaming AI response: {str(e)}")
+        if not produced:
+            yield _fallback_response(current_mood)
@@ -0,0 +1,178 @@
+"""
+Prompt templates for every LLM call.
+
+Each template is a static, versioned system prefix followed by the dynamic
+part of the call (conversation history and/or a user turn). Nothing
+request-specific goes into the system prompt, so every call of a template
+shares the same prefix and the user's message is sent only once.
+
+Bump a template's version whenever its text changes; token stats and LLM
+cache keys are then kept apart from the previous wording.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+from utils.history import estimate_tokens
+
+
+class PromptTemplate:
+    """
+    A static system prefix plus an optional ``str.format`` user turn.
+    """
+
+    def __init__(self, name: str, version: int, system: str, user: Optional[str] = "{message}"):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.user = user
+        self._system_message = {"role": "system", "content": system}
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    @property
+    def prefix_tokens(self) -> int:
+        """
+        Estimated tokens of the static system prefix shared by every call.
+        """
+        return estimate_tokens(self.system)
+
+    def build(self, history: Optional[List[Dict[str, str]]] = None, **values: Any) -> List[Dict[str, str]]:
+        """
+        Build the messages: system prefix, then history, then the user turn.
+        """
+        messages = [dict(self._system_message)]
+        if history:
+            messages.extend(history)
+        if self.user is not None:
+            messages.append({"role": "user", "content": self.user.format(**values)})
+        return messages
+
+
+# Therapist reply with points. The mood and the message only appear in the
+# user turn; the reply format stays "gpt: ... points: N" for the parsers.
+THERAPIST_REPLY = PromptTemplate(
+    "therapist_reply",
+    2,
+    system="""I want to use you as my therapist. From this point on, you're the counselor, and your role is to understand and heal my emotions as much as possible. My message tells you the emotion I'm currently feeling, which is one of the following: HAPPY, SAD, ANGRY, ANXIOUS, CALM, EXCITED, SLEEPY, or NEUTRAL, and what I answered when asked "Why are you feeling that way?".
+Use this information to guide your responses, but don't mention what I just explained—just act like the therapist right away. And says like a human don't be repetitive.
+
+Admin instruction:
+Based on the user's response, generate your own therapeutic reply. Then, evaluate the user's emotional state on a scale from 0 to 4, where 0 indicates complete emotional distress and 5 indicates emotional stability.
+
+0 = Severely distressed / Harmful content
+1 = Anxious / Worried
+2 = Sad / Depressed
+3 = Angry / Frustrated / Irritable
+4 = Positive / Hopeful / Grateful
+
+Consider factors like emotional depth, vulnerability, thoughtfulness, and engagement.
+
+Format your output as follows: gpt: {your_response} points: {int}""",
+    user="""Emotion: {emotion}
+User response: "{message}\""""
+)
+
+# Admin emotion/animal analysis, sent before the conversation history
+ADMIN_ANALYSIS = PromptTemplate(
+    "admin_analysis",
+    1,
+    system="""This is the admin. Based on the conversation you just had with the user, please identify the user's true emotion by selecting one from the following categories: HAPPY, SAD, ANGRY, ANXIOUS, or NEUTRAL. Then, choose one animal that corresponds to that emotion from the following list: tiger, penguin, hamster, pig, or dog. Please respond in the following format: emotion: {emotion}, animal: {animal}."""
+)
+
+ANIMAL_SELECTION = PromptTemplate(
+    "animal_selection",
+    1,
+    system="""You are an animal matching expert.
+Based on the conversation history, you need to match the user with the most suitable animal type.
+Choose from: tiger, penguin, hamster, pig, or dog.
+Respond with ONLY the animal name in lowercase, nothing else."""
+)
+
+# Single JSON-mode call for the onboarding analysis message. The conversation
+# follows the prefix; the selected mood, if any, is appended as a last note.
+COMBINED_ANALYSIS = PromptTemplate(
+    "combined_analysis",
+    2,
+    system="""You are the user's therapist. Below is your conversation with the user so far, ending with the user's latest message.
+
+Do two things:
+1. Write your therapeutic reply to the latest message. Talk like a human and don't be repetitive. Then evaluate the user's emotional state from 0 to 5 (0 = severely distressed / harmful content, 1 = anxious / worried, 2 = sad / depressed, 3 = angry / frustrated / irritable, 4 = positive / hopeful / grateful, 5 = emotionally stable).
+2. As the admin, identify the user's true emotion by selecting one of: happy, sad, angry, anxious, neutral. Then choose one animal that corresponds to that emotion from: tiger, penguin, hamster, pig, dog. If a note says which emotion the user selected, reply with that emotion in mind.
+
+Respond with only a JSON object in this format: {"reply": "<your reply>", "points": <int>, "emotion": "<emotion>", "animal": "<animal>"}""",
+    user=None
+)
+
+# Prompt templates - your teammate can modify these
+DIARY = PromptTemplate(
+    "diary",
+    1,
+    system="""From now on, you are a writer who writes diaries on behalf of the user. Below is the conversation that took place over one day between the counselor (ChatGPT) and the user.
+Based on this conversation, please write a diary (in a human-generated style), and by reading the diary, select the dominant emotion that governs the user among HAPPY, SAD, ANGRY, ANXIOUS, CALM, EXCITED, or NEUTRAL.
+Return the result in the following format:
+diary: {generate_diary}
+emotion: {emotion}""",
+    user="""Here are my conversations with my AI pet companion for today:
+
+{chat_log}
+
+Please write my diary entry based on these conversations and identify my dominant emotion."""
+)
+
+TEMPLATES = {
+    template.name: template
+    for template in (THERAPIST_REPLY, ADMIN_ANALYSIS, ANIMAL_SELECTION, COMBINED_ANALYSIS, DIARY)
+}
+
+
+class PromptTokenStats:
+    """
+    Prompt/completion token totals per template version.
+
+    ``cached_tokens`` counts prompt tokens the provider reported as served
+    from its prefix cache (0 when the response doesn't say).
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, template_key: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> None:
+        with self._lock:
+            stats = self._templates.setdefault(
+                template_key, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+            )
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def record_usage(self, template_key: str, usage: Any) -> None:
+        """
+        Record the ``usage`` block of a chat completion response.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            cached_tokens = details.get("cached_tokens") or 0
+        else:
+            cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        self.record(template_key, usage.prompt_tokens, usage.completion_tokens, cached_tokens)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                key: {
+                    **stats,
+                    "avg_prompt_tokens": stats["prompt_tokens"] / stats["calls"],
+                    "avg_completion_tokens": stats["completion_tokens"] / stats["calls"],
+                    "cached_ratio": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+                }
+                for key, stats in self._templates.items()
+            }
+
+
+prompt_stats = PromptTokenStats()
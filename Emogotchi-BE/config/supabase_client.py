@@ -1,7 +1,15 @@
 from supabase import create_client
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import httpx
 import logging
+from typing import Any, Callable, Optional, TypeVar
+from utils.cassette import CassetteTransport, cassette
+from utils.local_postgrest import local_postgrest
+from utils.metrics import instrument_postgrest_session
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,17 +18,91 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# supabase-py is synchronous, so calls run on a dedicated, bounded thread pool
+# (not the loop's default executor) with a timeout covering queueing and the
+# round trip. A slow database then delays only the requests waiting on it.
+SUPABASE_MAX_WORKERS = int(os.getenv("SUPABASE_MAX_WORKERS", "32"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "10"))
+
+T = TypeVar("T")
+
+# "local" serves PostgREST from the in-memory stand-in instead of Supabase
+SUPABASE_BACKEND = os.getenv("SUPABASE_BACKEND", "supabase").lower()
+if SUPABASE_BACKEND == "local":
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    # Any JWT-shaped key passes the client's format check
+    os.environ.setdefault("SUPABASE_KEY", "local.backend")
+
 # Log environment variables (without exposing sensitive data)
 logger.info("Supabase URL: %s", os.getenv("SUPABASE_URL"))
 logger.info("Supabase Key exists: %s", bool(os.getenv("SUPABASE_KEY")))
 
+
+def install_transports(client) -> None:
+    """
+    Route a Supabase client's PostgREST requests to the local stand-in
+    (SUPABASE_BACKEND=local) and/or through the cassette (CASSETTE_MODE),
+    and record their latency per table and operation for /metrics.
+
+    postgrest-py has no transport option, so the transport of its httpx
+    session is swapped in place.
+    """
+    session = client.postgrest.session
+    # Don't let a worker thread hang on a request db_call has given up on
+    session.timeout = httpx.Timeout(SUPABASE_TIMEOUT)
+    instrument_postgrest_session(session)
+    if SUPABASE_BACKEND == "local":
+        session._transport = local_postgrest
+    if cassette is not None:
+        session._transport = CassetteTransport(cassette, session._transport)
+
+
 # Initialize Supabase client
 try:
     supabase = create_client(
         supabase_url=os.getenv("SUPABASE_URL"),
         supabase_key=os.getenv("SUPABASE_KEY")
     )
+    install_transports(supabase)
     logger.info("Supabase client initialized successfully")
 except Exception as e:
     logger.error("Failed to initialize Supabase client: %s", str(e))
-    raise 
\ No newline at end of file
+    raise
+
+
+db_executor = ThreadPoolExecutor(max_workers=SUPABASE_MAX_WORKERS, thread_name_prefix="supabase")
+
+
+class DatabaseTimeout(TimeoutError):
+    """
+    Raised by db_call when a Supabase call doesn't finish in time.
+    """
+
+
+async def db_call(fn: Callable[..., T], *args: Any, timeout: Optional[float] = None) -> T:
+    """
+    Run a blocking Supabase call on the database thread pool.
+
+    Args:
+        fn: The call, e.g. ``lambda: supabase.table("User").select("*").execute()``
+        *args: Positional arguments for ``fn``
+        timeout (float, optional): Seconds to wait, including time queued for a
+            worker thread (defaults to SUPABASE_TIMEOUT_SECONDS)
+
+    Raises:
+        DatabaseTimeout: If the call didn't finish in time
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(db_executor, functools.partial(fn, *args))
+    timeout = SUPABASE_TIMEOUT if timeout is None else timeout
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise DatabaseTimeout(f"Supabase call exceeded {timeout} seconds") from None
+
+
+def close_db_executor() -> None:
+    """
+    Stop the database thread pool without waiting for abandoned calls.
+    """
+    db_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,10 @@
+import os
+
+# Tests run offline against the local stand-ins unless the environment says otherwise
+os.environ.setdefault("SUPABASE_BACKEND", "local")
+os.environ.setdefault("SUPABASE_LOCAL_LATENCY_MS", "0")
+os.environ.setdefault("LLM_BACKEND", "local")
+os.environ.setdefault("CONVERSATION_STORE", "memory")
+
+# Manual script that posts to a running server
+collect_ignore = ["test_chat.py"]
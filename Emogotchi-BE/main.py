@@ -1,8 +1,23 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from routes import user, chat, onboarding, diary
+from config.llm_profiles import profile_stats
+from config.prompts import TEMPLATES, prompt_stats
+from config.openai_config import close_async_client
+from config.supabase_client import close_db_executor
+from utils.circuit_breaker import OPEN, breakers
+from utils.llm_cache import llm_cache
+from utils.llm_scheduler import llm_scheduler
+from utils.loop_monitor import LOOP_DIAGNOSTICS, LoopDiagnosticsMiddleware, loop_monitor
+from utils.metrics import MetricsMiddleware, registry
+from utils.request_profiler import PROFILE_SECRET, ProfilingMiddleware, request_profiler
+from utils.timing import ServerTimingMiddleware, span_exporter, stage_stats
+from utils.user_cache import user_cache
+from utils.write_queue import background_writer, batching_writer
+import asyncio
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -23,12 +38,146 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Opt-in diagnostics: event-loop lag percentiles and stacks of blocking calls,
+# plus the recent request traces and per-stage timing kept by utils/timing.py
+if LOOP_DIAGNOSTICS:
+    app.add_middleware(LoopDiagnosticsMiddleware, monitor=loop_monitor)
+
+    @app.get("/diagnostics/loop", include_in_schema=False)
+    async def loop_diagnostics():
+        return {**loop_monitor.stats(), "recent_blocks": loop_monitor.reports()}
+
+    @app.get("/diagnostics/traces", include_in_schema=False)
+    async def trace_diagnostics(name: Optional[str] = None, limit: int = 100):
+        return {"stages": stage_stats.snapshot(), "traces": span_exporter.traces(name, limit)}
+
+# Request counts and latency per route, served at /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Stage breakdown of timed requests, including error responses
+app.add_middleware(ServerTimingMiddleware)
+
+# Sizes of in-process state, read at scrape time
+registry.gauge("conversation_users", "Users with conversation state", chat.conversation_store.user_count)
+registry.gauge(
+    "conversation_messages", "Messages held in conversation histories", chat.conversation_store.message_count
+)
+registry.gauge("user_cache_entries", "Rows in the user cache", lambda: user_cache.stats()["size"])
+registry.counter_callback("user_cache_hits_total", "User cache lookups served from the cache", lambda: user_cache.stats()["hits"])
+registry.counter_callback("user_cache_misses_total", "User cache lookups that went to Supabase", lambda: user_cache.stats()["misses"])
+registry.gauge("llm_cache_entries", "Responses in the LLM response cache", lambda: llm_cache.stats()["size"])
+registry.counter_callback("llm_cache_hits_total", "LLM calls answered from the response cache", lambda: llm_cache.stats()["hits"])
+registry.counter_callback(
+    "llm_cache_shared_total", "LLM calls that shared the result of an identical in-flight call", lambda: llm_cache.stats()["shared"]
+)
+registry.counter_callback("llm_cache_misses_total", "LLM calls that went to the backend", lambda: llm_cache.stats()["misses"])
+registry.gauge(
+    "llm_cache_hit_ratio", "Share of cacheable LLM calls served without calling the backend", lambda: llm_cache.stats()["hit_rate"]
+)
+registry.gauge("llm_scheduler_queued", "LLM calls waiting for a slot, by priority", llm_scheduler.queued, ("priority",))
+registry.gauge("llm_scheduler_in_flight", "LLM calls holding a scheduler slot", lambda: llm_scheduler.in_flight)
+registry.counter_callback(
+    "llm_scheduler_timeouts_total",
+    "LLM calls that gave up waiting for a scheduler slot, by priority",
+    lambda: {name: stats["timed_out"] for name, stats in llm_scheduler.stats()["priorities"].items()},
+    ("priority",)
+)
+registry.gauge("background_write_queue_depth", "Writes queued for the background writer", background_writer.depth)
+registry.gauge("batching_writer_pending", "Rows waiting for the next batched flush", batching_writer.pending)
+registry.gauge(
+    "batching_writer_oldest_pending_seconds", "Age of the oldest write waiting for the next batched flush",
+    batching_writer.oldest_pending_age
+)
+registry.gauge(
+    "circuit_breaker_open",
+    "1 while the call type's circuit breaker is open",
+    lambda: {name: int(breaker.state == OPEN) for name, breaker in breakers.items()},
+    ("call_type",)
+)
+
+# Per-profile totals kept by profile_stats
+def _profile_field(field: str):
+    return lambda: {name: stats[field] for name, stats in profile_stats.snapshot().items()}
+
+registry.counter_callback("llm_profile_calls_total", "Completed LLM calls per profile", _profile_field("calls"), ("profile",))
+registry.counter_callback("llm_profile_errors_total", "Failed LLM calls per profile", _profile_field("errors"), ("profile",))
+registry.counter_callback(
+    "llm_profile_latency_seconds_total", "Total latency of completed LLM calls per profile",
+    _profile_field("total_latency"), ("profile",)
+)
+registry.gauge(
+    "llm_profile_latency_max_seconds", "Slowest completed LLM call per profile", _profile_field("max_latency"), ("profile",)
+)
+registry.counter_callback(
+    "llm_profile_tokens_total",
+    "LLM tokens per profile and kind (prompt or completion)",
+    lambda: {
+        (name, kind): stats[f"{kind}_tokens"]
+        for name, stats in profile_stats.snapshot().items()
+        for kind in ("prompt", "completion")
+    },
+    ("profile", "kind")
+)
+
+# Per-template token totals kept by prompt_stats, next to each template's static prefix
+registry.gauge(
+    "llm_prompt_prefix_tokens",
+    "Estimated tokens of each prompt template's static system prefix",
+    lambda: {template.key: template.prefix_tokens for template in TEMPLATES.values()},
+    ("template",)
+)
+registry.counter_callback(
+    "llm_prompt_calls_total",
+    "LLM calls per prompt template version",
+    lambda: {key: stats["calls"] for key, stats in prompt_stats.snapshot().items()},
+    ("template",)
+)
+registry.counter_callback(
+    "llm_prompt_tokens_total",
+    "LLM tokens per prompt template version and kind (prompt, completion, or cached prompt tokens)",
+    lambda: {
+        (key, kind): stats[f"{kind}_tokens"]
+        for key, stats in prompt_stats.snapshot().items()
+        for kind in ("prompt", "completion", "cached")
+    },
+    ("template", "kind")
+)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Off the loop: state gauges may query the SQLite conversation store
+    body = await asyncio.to_thread(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+# Opt-in per-request sampling profiler, only installed when a secret is configured
+if PROFILE_SECRET:
+    app.add_middleware(ProfilingMiddleware, profiler=request_profiler, secret=PROFILE_SECRET)
+
 # Include routers
 app.include_router(onboarding.router, tags=["Onboarding"])
 app.include_router(user.router, tags=["User Management"])
 app.include_router(chat.router, tags=["Chat"])
 app.include_router(diary.router)
 
+# Start the background Supabase writers
+@app.on_event("startup")
+async def startup_event():
+    background_writer.start()
+    batching_writer.start()
+    if LOOP_DIAGNOSTICS:
+        loop_monitor.start()
+
+# Flush pending writes, then release pooled OpenAI connections and the database threads
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batching_writer.stop()
+    await background_writer.stop()
+    await close_async_client()
+    close_db_executor()
+    chat.conversation_store.close()
+    if LOOP_DIAGNOSTICS:
+        await loop_monitor.stop()
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -0,0 +1,12 @@
+-- Timestamp chat messages so diaries only read the current day's rows.
+-- Rows written before this migration have no real timestamp: park them at the
+-- epoch so they don't all land in the migration day's diary.
+alter table "Chat" add column if not exists created_at timestamptz;
+update "Chat" set created_at = 'epoch' where created_at is null;
+alter table "Chat" alter column created_at set default now();
+alter table "Chat" alter column created_at set not null;
+
+-- Serve the day-bounded fetches keyset-paginated on (created_at, id): per user
+-- in routes/diary.py, across users in batch_diaries.py
+create index if not exists chat_uuid_created_at_id_idx on "Chat" (uuid, created_at, id);
+create index if not exists chat_created_at_id_idx on "Chat" (created_at, id);
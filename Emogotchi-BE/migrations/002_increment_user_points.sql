@@ -0,0 +1,12 @@
+-- Add points to a User row in one statement, so concurrent /chat writers
+-- (other workers, /user/update/points) can't overwrite each other's increments.
+-- Called through PostgREST as /rpc/increment_user_points by utils/write_queue.py.
+create or replace function increment_user_points(user_uuid text, delta integer)
+returns integer
+language sql
+as $$
+    update "User"
+    set points = coalesce(points, 0) + delta
+    where uuid = user_uuid
+    returning points;
+$$;
@@ -46,6 +46,27 @@ class ChatResponse(BaseModel):
     points: Optional[int] = None
     isFifth: bool = False
 
+class CombinedAnalysis(BaseModel):
+    reply: str
+    points: int
+    emotion: EmotionType
+    animal: CharacterType
+
+    @validator('reply')
+    def validate_reply(cls, v):
+        v = v.strip()
+        if not v:
+            raise ValueError("reply is empty")
+        return v
+
+    @validator('points')
+    def clamp_points(cls, v):
+        return max(0, min(v, 5))
+
+    @validator('emotion', 'animal', pre=True)
+    def lowercase(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
+
 class EmotionUpdateResponse(BaseModel):
     success: bool
     new_mood: EmotionType
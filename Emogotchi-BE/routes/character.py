@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Query
 from models.schemas import EmotionSelectionResponse, CharacterType, EmotionType
-from db import supabase
+from config.supabase_client import db_call, supabase
 from fastapi.responses import JSONResponse
 import random
 
@@ -13,7 +13,7 @@ async def select_emotion_and_assign_character(
 ):
     try:
         # Get the user from the database
-        user_response = supabase.table("users").select("*").eq("uuid", user_uuid).execute()
+        user_response = await db_call(lambda: supabase.table("users").select("*").eq("uuid", user_uuid).execute())
         
         if not user_response.data:
             raise HTTPException(status_code=404, detail="User not found")
@@ -27,7 +27,7 @@ async def select_emotion_and_assign_character(
             "current_mood": emotion,
             "character_type": character_type
         }
-        supabase.table("users").update(data).eq("uuid", user_uuid).execute()
+        await db_call(lambda: supabase.table("users").update(data).eq("uuid", user_uuid).execute())
         
         return EmotionSelectionResponse(
             character_type=character_type,
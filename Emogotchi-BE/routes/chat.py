@@ -1,12 +1,23 @@
 from fastapi import APIRouter, HTTPException, Body, Request, Query
-from models.schemas import ChatResponse, ChatRequest, EmotionType, CharacterType
-from config.supabase_client import supabase
-from config.openai_config import get_ai_response
+from models.schemas import ChatResponse, ChatRequest, CombinedAnalysis, EmotionType, CharacterType
+from config.supabase_client import DatabaseTimeout, db_call, supabase
+from config.openai_config import (
+    get_ai_response_async, get_combined_response_async, stream_ai_response, ADMIN_HISTORY_TOKEN_BUDGET,
+    CHAT_MAX_QUEUE_WAIT
+)
+from config.llm_profiles import get_profile
+from fastapi.responses import StreamingResponse
+from utils.chat_stream import PointsSuffixParser, sse_event
+from utils.conversation_store import create_conversation_store
+from utils.timing import StageTimer
+from utils.user_cache import user_cache
+from utils.write_queue import batching_writer
 import logging
 import asyncio  
 from typing import Optional
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+import os
 import random
 import re
 import uuid as uuid_lib
@@ -17,15 +28,204 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Store conversation counts in memory
-conversation_counts = {}
-conversation_history = {}  # Store conversation history for each user
+# Conversation counts and history for each user (backend selected by CONVERSATION_STORE)
+conversation_store = create_conversation_store()
 
 # Maximum number of exchanges before animal assignment
 MAX_EXCHANGES = 4
 
-# Admin prompt for emotion and animal type analysis
-ADMIN_PROMPT = """This is the admin. Based on the conversation you just had with the user, please identify the user's true emotion by selecting one from the following categories: HAPPY, SAD, ANGRY, ANXIOUS, or NEUTRAL. Then, choose one animal that corresponds to that emotion from the following list: tiger, penguin, hamster, pig, or dog. Please respond in the following format: emotion: {emotion}, animal: {animal}."""
+# Get the reply and the emotion/animal analysis of the MAX_EXCHANGES message
+# from one JSON-mode call instead of two sequential calls
+COMBINED_ANALYSIS = os.getenv("CHAT_COMBINED_ANALYSIS", "true").lower() == "true"
+
+def _llm_timeout(profile: str) -> Optional[float]:
+    """
+    Route-level timeout of an LLM call: the chat queue wait plus the profile's
+    own timeout, with a little slack so the profile timeout fires first,
+    inside the circuit breaker.
+    """
+    timeout = get_profile(profile).timeout
+    return None if timeout is None else CHAT_MAX_QUEUE_WAIT + timeout + 0.5
+
+def _validate_emotion(emotion: Optional[str]) -> Optional[str]:
+    """
+    Normalize the optional emotion sent by the client.
+
+    Returns:
+        Optional[str]: A valid lowercase emotion, "neutral" for unknown values,
+        or None when the emotion could not be processed
+    """
+    try:
+        # Convert to lowercase for case-insensitive comparison
+        emotion_str = emotion.lower()
+        valid_emotions = ["happy", "sad", "angry", "anxious", "neutral"]
+
+        if emotion_str in valid_emotions:
+            return emotion_str
+        # Default to a valid emotion if the provided one isn't recognized
+        logger.warning(f"Invalid emotion '{emotion_str}' provided, defaulting to 'neutral'")
+        return "neutral"
+    except Exception as e:
+        logger.error(f"Error processing emotion: {str(e)}")
+        return None
+
+def _parse_analysis(analysis: str) -> tuple[str, str]:
+    """
+    Parse the admin analysis format: emotion: {emotion}, animal: {animal}
+
+    Returns:
+        tuple[str, str]: Validated (emotion, animal)
+    """
+    try:
+        response_parts = analysis.lower().split(',')
+        emotion_part = response_parts[0].strip()
+        animal_part = response_parts[1].strip() if len(response_parts) > 1 else ""
+
+        detected_emotion = emotion_part.split(':')[1].strip() if ':' in emotion_part else "neutral"
+        detected_animal = animal_part.split(':')[1].strip() if ':' in animal_part else "dog"
+
+        # Validate emotion
+        valid_emotions = ["happy", "sad", "angry", "anxious", "neutral"]
+        if detected_emotion not in valid_emotions:
+            detected_emotion = "neutral"
+
+        # Validate animal
+        valid_animals = ["tiger", "penguin", "hamster", "pig", "dog"]
+        if detected_animal not in valid_animals:
+            detected_animal = "dog"
+    except Exception as parse_error:
+        # Default values if parsing fails
+        detected_emotion = "neutral"
+        detected_animal = "dog"
+    return detected_emotion, detected_animal
+
+def _parse_points_response(combined_response: str) -> tuple[str, int]:
+    """
+    Split a "gpt: {reply} points: {int}" completion.
+
+    Returns:
+        tuple[str, int]: The reply text and the points (0-5, 2 if missing)
+    """
+    # Try to extract points from the response
+    points = 2  # Default only if extraction fails completely
+    points_match = re.search(r'points:\s*(\d+)', combined_response, re.IGNORECASE)
+    if points_match:
+        points = int(points_match.group(1))
+        points = max(0, min(points, 5))  # Ensure within valid range
+        logger.info(f"Extracted points from OpenAI response: {points}")
+    else:
+        logger.warning(f"Failed to extract points from OpenAI response, using default: {points}")
+
+    # Extract the actual response (everything before "points:")
+    response_text = combined_response
+    response_parts = combined_response.split("points:", 1)
+    if len(response_parts) > 1:
+        response_text = response_parts[0].strip()
+
+    # If the response starts with "gpt:", remove it
+    if response_text.lower().startswith("gpt:"):
+        response_text = response_text[4:].strip()
+    return response_text, points
+
+async def _fetch_user(user_uuid: str) -> dict:
+    """
+    Load the User row (read-through the User-row cache), raising 404/504 HTTP errors.
+    """
+    user_data = user_cache.get(user_uuid)
+    if user_data is not None:
+        return user_data
+
+    try:
+        user_response = await db_call(
+            lambda: supabase.table("User").select("*").eq("uuid", user_uuid).execute(),
+            timeout=3.0
+        )
+    except DatabaseTimeout:
+        raise HTTPException(status_code=504, detail="Database timeout")
+
+    if not user_response.data:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_cache.put(user_uuid, user_response.data[0])
+    return user_response.data[0]
+
+def _update_user(user_uuid: str, update_data: dict, points_delta: int) -> None:
+    """
+    Write fields to the User row in the background (the User-row cache is
+    updated immediately). Points are sent as a delta, applied atomically in
+    the database, so several messages in one batch window collapse into a
+    single increment.
+    """
+    user_cache.update(user_uuid, update_data)
+    fields = {key: value for key, value in update_data.items() if key != "points"}
+    batching_writer.add_points(user_uuid, points_delta, fields)
+
+def _save_chat(user_uuid: str, message: str, response_text: str) -> None:
+    """
+    Save a chat exchange to the Chat table in the next bulk insert.
+    """
+    batching_writer.add_chat({
+        "uuid": user_uuid,
+        "user_input": message,
+        "chat_output": response_text,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+
+async def _analyze_conversation(user_uuid: str) -> tuple[str, str]:
+    """
+    Run the admin emotion/animal analysis over the user's conversation.
+
+    Returns:
+        tuple[str, str]: Validated (emotion, animal)
+    """
+    # Send the admin prompt to analyze emotion and animal type
+    analysis = await asyncio.wait_for(
+        get_ai_response_async(
+            message="Analyze the conversation",  # This is just a placeholder, the actual prompt is the ADMIN_ANALYSIS template
+            character_type=None,
+            current_mood=None,
+            is_admin_analysis=True,
+            conversation_history=await conversation_store.call(
+                conversation_store.get_window, user_uuid, ADMIN_HISTORY_TOKEN_BUDGET
+            ),
+            use_cache=True  # Identical conversations get the same analysis
+        ),
+        timeout=_llm_timeout("admin_analysis")
+    )
+    return _parse_analysis(analysis)
+
+async def _analyze_and_reply(user_uuid: str, current_mood: Optional[str]) -> Optional[CombinedAnalysis]:
+    """
+    Run the combined reply + emotion/animal analysis call over the user's conversation.
+
+    Returns:
+        Optional[CombinedAnalysis]: The validated result, or None if the call
+        failed or returned invalid output (the caller then uses two calls)
+    """
+    try:
+        return await asyncio.wait_for(
+            get_combined_response_async(
+                await conversation_store.call(conversation_store.get_window, user_uuid, ADMIN_HISTORY_TOKEN_BUDGET),
+                current_mood=current_mood
+            ),
+            timeout=_llm_timeout("combined_analysis")
+        )
+    except Exception as e:
+        logger.warning(f"Combined analysis failed for {user_uuid}, falling back to two calls: {str(e)}")
+        return None
+
+def _regular_update_data(user_data: dict, new_points: int, current_emotion: Optional[str]) -> dict:
+    """
+    Fields written to the User row after a regular (non-assignment) message.
+    """
+    # Only update the emotion after animal assignment (animal_type is not None)
+    update_data = {"points": new_points}
+
+    # If the animal has been assigned, also update the emotion
+    if user_data["animal_type"] is not None:
+        # For simplicity, we'll keep using the existing emotion
+        # In a real app, you might analyze the user's message to determine a new emotion
+        update_data["animal_emotion"] = current_emotion
+    return update_data
 
 # Add a simple test endpoint
 @router.get("/test")
@@ -36,6 +236,8 @@ async def test_endpoint():
              response_model_exclude_unset=False,  # Ensure all fields are in response
              response_description="Chat response with therapeutic message and points")
 async def chat_with_pet(request: Request, chat_request: ChatRequest):
+    timer = StageTimer("chat")
+    early_reply = None
     try:
         # Get user UUID
         user_uuid = chat_request.uuid
@@ -49,58 +251,42 @@ async def chat_with_pet(request: Request, chat_request: ChatRequest):
         
         if emotion_provided:
             # Validate the provided emotion against valid options
-            try:
-                # Convert to lowercase for case-insensitive comparison
-                emotion_str = chat_request.emotion.lower()
-                valid_emotions = ["happy", "sad", "angry", "anxious", "neutral"]
-                
-                if emotion_str in valid_emotions:
-                    validated_emotion = emotion_str
-                else:
-                    # Default to a valid emotion if the provided one isn't recognized
-                    validated_emotion = "neutral"
-                    logger.warning(f"Invalid emotion '{emotion_str}' provided, defaulting to 'neutral'")
-            except Exception as e:
-                logger.error(f"Error processing emotion: {str(e)}")
-                # Continue with emotion_provided = False
-                emotion_provided = False
+            validated_emotion = _validate_emotion(chat_request.emotion)
+            # Continue with emotion_provided = False if it couldn't be processed
+            emotion_provided = validated_emotion is not None
         
         logger.info(f"Chat request from {user_uuid}: message='{message}', emotion_provided={emotion_provided}" +
                    (f", emotion='{validated_emotion}'" if emotion_provided else ""))
         
-        # Initialize conversation count if it doesn't exist
-        if user_uuid not in conversation_counts:
-            conversation_counts[user_uuid] = 0
-            conversation_history[user_uuid] = []
+        # When the client sent the mood, the reply prompt doesn't need the user
+        # row, so start the LLM call while the user is fetched. Peek at the count
+        # without incrementing so a 404 leaves it untouched.
+        if emotion_provided and await conversation_store.call(conversation_store.get_count, user_uuid) + 1 != MAX_EXCHANGES:
+            early_reply = asyncio.create_task(timer.timed("reply", get_ai_response_async(
+                message=message,
+                current_mood=validated_emotion
+            )))
         
         # Get user data from Supabase
-        try:
-            user_response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    lambda: supabase.table("User").select("*").eq("uuid", user_uuid).execute()
-                ),
-                timeout=3.0
-            )
-        except asyncio.TimeoutError:
-            raise HTTPException(status_code=504, detail="Database timeout")
-            
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_data = user_response.data[0]
+        user_data = await timer.timed("user_fetch", _fetch_user(user_uuid))
         
         # Get current points (default to 0 if not set)
         current_points = user_data.get("points", 0) or 0
         
         # Increment conversation count
-        conversation_counts[user_uuid] += 1
-        current_count = conversation_counts[user_uuid]
+        current_count = await conversation_store.call(conversation_store.increment_count, user_uuid)
+        
+        if early_reply is not None and current_count == MAX_EXCHANGES:
+            # A concurrent request moved the count since the peek; this message
+            # gets the assignment flow instead
+            early_reply.cancel()
+            early_reply = None
         
         # Log the conversation count for debugging
         logger.info(f"Conversation count for {user_uuid}: {current_count}/{MAX_EXCHANGES}")
 
         # Store the user message in conversation history
-        conversation_history[user_uuid].append({"role": "user", "content": message})
+        await conversation_store.call(conversation_store.append_message, user_uuid, "user", message)
         
         # Check if we should analyze emotion and assign an animal type
         animal_to_return = None
@@ -114,140 +300,57 @@ async def chat_with_pet(request: Request, chat_request: ChatRequest):
             
             # This is the animal and emotion assignment
             try:
-                # Send the admin prompt to analyze emotion and animal type
-                analysis = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: get_ai_response(
-                            message="Analyze the conversation",  # This is just a placeholder, the actual prompt is passed as admin_prompt
-                            character_type=None,
-                            current_mood=None,
-                            is_admin_analysis=True,
-                            conversation_history=conversation_history[user_uuid],
-                            admin_prompt=ADMIN_PROMPT
-                        )
-                    ),
-                    timeout=5.0
-                )
-                
-                # Parse the response to extract emotion and animal type
-                try:
-                    # Extract emotion and animal from the response format: emotion: {emotion}, animal: {animal}
-                    response_parts = analysis.lower().split(',')
-                    emotion_part = response_parts[0].strip()
-                    animal_part = response_parts[1].strip() if len(response_parts) > 1 else ""
-                    
-                    detected_emotion = emotion_part.split(':')[1].strip() if ':' in emotion_part else "neutral"
-                    detected_animal = animal_part.split(':')[1].strip() if ':' in animal_part else "dog"
+                combined = None
+                if COMBINED_ANALYSIS:
+                    combined = await timer.timed(
+                        "combined_analysis", _analyze_and_reply(user_uuid, validated_emotion if emotion_provided else None)
+                    )
+
+                if combined is not None:
+                    # Reply, points and analysis came back from a single call
+                    detected_emotion, detected_animal = combined.emotion.value, combined.animal.value
+                    final_emotion = validated_emotion if emotion_provided else detected_emotion
+                    response_text, points = combined.reply, combined.points
+                    logger.info(f"Using emotion for animal assignment: {final_emotion} (user provided: {emotion_provided})")
+                else:
+                    detected_emotion, detected_animal = await timer.timed("admin_analysis", _analyze_conversation(user_uuid))
                     
-                    # Validate emotion
-                    valid_emotions = ["happy", "sad", "angry", "anxious", "neutral"]
-                    if detected_emotion not in valid_emotions:
-                        detected_emotion = "neutral"
+                    # Use the validated emotion from the request if provided, otherwise use the detected one
+                    final_emotion = validated_emotion if emotion_provided else detected_emotion
+                    logger.info(f"Using emotion for animal assignment: {final_emotion} (user provided: {emotion_provided})")
                     
-                    # Validate animal
-                    valid_animals = ["tiger", "penguin", "hamster", "pig", "dog"]
-                    if detected_animal not in valid_animals:
-                        detected_animal = "dog"
-                except Exception as parse_error:
-                    # Default values if parsing fails
-                    detected_emotion = "neutral"
-                    detected_animal = "dog"
-                
-                # Use the validated emotion from the request if provided, otherwise use the detected one
-                final_emotion = validated_emotion if emotion_provided else detected_emotion
-                logger.info(f"Using emotion for animal assignment: {final_emotion} (user provided: {emotion_provided})")
-                
-                # Generate therapeutic response and points in the new format
-                from config.openai_config import SCORING_PROMPT
-                chat_response = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: get_ai_response(
+                    # Generate therapeutic response and points in the new format
+                    chat_response = await timer.timed("reply", asyncio.wait_for(
+                        get_ai_response_async(
                             message=message,
                             character_type=detected_animal,
                             current_mood=final_emotion  # Use the selected emotion
-                        )
-                    ),
-                    timeout=5.0
-                )
-                
-                # Try to extract points from the response
-                points = 2  # Default only if extraction fails completely
-                points_match = re.search(r'points:\s*(\d+)', chat_response, re.IGNORECASE)
-                logger.info(f"Points match: {points_match}")
-                if points_match:
-                    points = int(points_match.group(1))
-                    points = max(0, min(points, 5))  # Ensure within valid range
-                    logger.info(f"Extracted points from OpenAI response: {points}")
-                else:
-                    logger.warning(f"Failed to extract points from OpenAI response, using default: {points}")
-                
-                # Extract the actual response (everything before "points:")
-                response_text = chat_response
-                response_parts = chat_response.split("points:", 1)
-                if len(response_parts) > 1:
-                    response_text = response_parts[0].strip()
-                
-                # If the response starts with "gpt:", remove it
-                if response_text.lower().startswith("gpt:"):
-                    response_text = response_text[4:].strip()
+                        ),
+                        timeout=_llm_timeout("chat_reply")
+                    ))
+                    with timer.stage("points_parse"):
+                        response_text, points = _parse_points_response(chat_response)
                 
                 # Update total points for the user
                 new_points = current_points + points
                 
                 # Update user with assigned animal, emotion, and points
-                await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: supabase.table("User")
-                                     .update({
-                                         "animal_type": detected_animal,
-                                         "animal_emotion": final_emotion,  # Use the selected emotion
-                                         "points": new_points
-                                     })
-                                     .eq("uuid", user_uuid)
-                                     .execute()
-                    ),
-                    timeout=3.0
-                )
+                with timer.stage("user_update"):
+                    _update_user(user_uuid, {
+                        "animal_type": detected_animal,
+                        "animal_emotion": final_emotion,  # Use the selected emotion
+                        "points": new_points
+                    }, points)
                 
                 # Reset conversation history but don't reset the counter
-                conversation_history[user_uuid] = []
+                await conversation_store.call(conversation_store.reset_history, user_uuid)
                 
                 # Store the AI response in conversation history
-                conversation_history[user_uuid].append({"role": "assistant", "content": response_text})
+                await conversation_store.call(conversation_store.append_message, user_uuid, "assistant", response_text)
                 
                 # Save chat message to Chat table
-                try:
-                    # Use upsert (update if exists, insert if not) to avoid duplicate key violation
-                    import random
-                    # Generate a random ID that will be consistent for this user's messages
-                    random_suffix = str(random.randint(1, 1000000))
-                    chat_id = f"{user_uuid}-{random_suffix}"
-                    
-                    chat_data = {
-                        "uuid": user_uuid,
-                        "user_input": message,
-                        "chat_output": response_text
-                    }
-                    
-                    await asyncio.wait_for(
-                        asyncio.to_thread(
-                            lambda: supabase.table("Chat").upsert(chat_data).execute()
-                        ),
-                        timeout=3.0
-                    )
-                except Exception as chat_error:
-                    logger.error(f"Error saving chat: {str(chat_error)}")
-                    # Try a different approach if upsert fails
-                    try:
-                        await asyncio.to_thread(
-                            lambda: supabase.table("Chat").delete().eq("uuid", user_uuid).execute()
-                        )
-                        await asyncio.to_thread(
-                            lambda: supabase.table("Chat").insert(chat_data).execute()
-                        )
-                    except Exception as delete_error:
-                        logger.error(f"Error with delete-then-insert approach: {str(delete_error)}")
-                    # Continue even if saving fails
+                with timer.stage("chat_save"):
+                    _save_chat(user_uuid, message, response_text)
                 
                 # Return special animal assignment message with points
                 logger.info(f"Returning animal assignment response with isFifth=True")
@@ -272,111 +375,38 @@ async def chat_with_pet(request: Request, chat_request: ChatRequest):
             current_emotion_for_ai = validated_emotion if emotion_provided else user_data["animal_emotion"]
             logger.info(f"Using emotion for AI response: {current_emotion_for_ai}")
             
-            # Get response and points in a single call
-            combined_response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    lambda: get_ai_response(
+            # Get response and points in a single call (already running if the mood was known)
+            if early_reply is not None:
+                combined_response = await asyncio.wait_for(early_reply, timeout=_llm_timeout("chat_reply"))
+            else:
+                combined_response = await timer.timed("reply", asyncio.wait_for(
+                    get_ai_response_async(
                         message=message,
                         character_type=user_data["animal_type"],
                         current_mood=current_emotion_for_ai  # Use the selected emotion
-                    )
-                ),
-                timeout=5.0
-            )
-            
-            # Try to extract points from the response
-            points = 2  # Default only if extraction fails completely
-            points_match = re.search(r'points:\s*(\d+)', combined_response, re.IGNORECASE)
-            if points_match:
-                points = int(points_match.group(1))
-                points = max(0, min(points, 5))  # Ensure within valid range
-                logger.info(f"Extracted points from OpenAI response: {points}")
-            else:
-                logger.warning(f"Failed to extract points from OpenAI response, using default: {points}")
-            
-            # Extract the actual response (everything before "points:")
-            ai_response = combined_response
-            response_parts = combined_response.split("points:", 1)
-            if len(response_parts) > 1:
-                ai_response = response_parts[0].strip()
-            
-            # If the response starts with "gpt:", remove it
-            if ai_response.lower().startswith("gpt:"):
-                ai_response = ai_response[4:].strip()
+                    ),
+                    timeout=_llm_timeout("chat_reply")
+                ))
+            with timer.stage("points_parse"):
+                ai_response, points = _parse_points_response(combined_response)
                 
             # Update total points for the user
             new_points = current_points + points
             logger.info(f"Awarding {points} points to user {user_uuid}. New total: {new_points}")
             
             # Store the AI response in conversation history
-            conversation_history[user_uuid].append({"role": "assistant", "content": ai_response})
+            await conversation_store.call(conversation_store.append_message, user_uuid, "assistant", ai_response)
             
         except asyncio.TimeoutError:
             raise HTTPException(status_code=504, detail="AI service timeout")
         
-        # Update user's points and emotion in Supabase
-        try:
-            # Only update the emotion after animal assignment (animal_type is not None)
-            update_data = {"points": new_points}
-            
-            # If the animal has been assigned, also update the emotion
-            if user_data["animal_type"] is not None:
-                # For simplicity, we'll keep using the existing emotion
-                # In a real app, you might analyze the user's message to determine a new emotion
-                update_data["animal_emotion"] = current_emotion_for_ai
-            
-            await asyncio.wait_for(
-                asyncio.to_thread(
-                    lambda: supabase.table("User")
-                                 .update(update_data)
-                                 .eq("uuid", user_uuid)
-                                 .execute()
-                ),
-                timeout=3.0
-            )
-        except Exception as update_error:
-            logger.error(f"Error updating user points: {str(update_error)}")
-            # Continue even if the update fails
+        # Update user's points and emotion in Supabase (written in the background)
+        with timer.stage("user_update"):
+            _update_user(user_uuid, _regular_update_data(user_data, new_points, current_emotion_for_ai), points)
         
         # Save chat message to Chat table
-        try:
-            # Use upsert (update if exists, insert if not) to avoid duplicate key violation
-            import random
-            # Generate a random ID that will be consistent for this user's messages
-            random_suffix = str(random.randint(1, 1000000))
-            chat_id = f"{user_uuid}-{random_suffix}"
-            
-            chat_data = {
-                "uuid": user_uuid,
-                "user_input": message,
-                "chat_output": ai_response
-            }
-            
-            try:
-                await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: supabase.table("Chat").upsert(chat_data).execute()
-                    ),
-                    timeout=3.0
-                )
-            except Exception as e:
-                # Log detailed error but continue
-                logger.error(f"Error saving chat: {str(e)}")
-                # Try a different approach if upsert fails
-                try:
-                    await asyncio.to_thread(
-                        lambda: supabase.table("Chat").delete().eq("uuid", user_uuid).execute()
-                    )
-                    await asyncio.to_thread(
-                        lambda: supabase.table("Chat").insert(chat_data).execute()
-                    )
-                except Exception as delete_error:
-                    logger.error(f"Error with delete-then-insert approach: {str(delete_error)}")
-                pass
-                
-        except asyncio.TimeoutError:
-            # Don't fail the request if saving fails
-            pass
+        with timer.stage("chat_save"):
+            _save_chat(user_uuid, message, ai_response)
         
         # Only include the animal in the response if the frontend provided an emotion
         animal_to_return = user_data["animal_type"] if emotion_provided and user_data["animal_type"] is not None else None
@@ -397,6 +427,92 @@ async def chat_with_pet(request: Request, chat_request: ChatRequest):
     except HTTPException as he:
         raise he
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
-    
-    
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if early_reply is not None and not early_reply.done():
+            # The user fetch failed (e.g. 404): drop the reply nobody will see
+            early_reply.cancel()
+        timer.finish()
+
+@router.post("/chat/stream",
+             response_description="Server-sent events: 'token' events with reply text, then a 'done' event with the ChatResponse")
+async def chat_with_pet_stream(chat_request: ChatRequest):
+    """
+    Streaming variant of /chat.
+
+    Forwards the therapeutic reply as 'token' events while it is generated and
+    holds back the trailing points suffix. The closing 'done' event carries the
+    same fields as ChatResponse (response, points, emotion, animal, isFifth).
+    """
+    user_uuid = chat_request.uuid
+    message = chat_request.message
+
+    # Process optional emotion field
+    validated_emotion = _validate_emotion(chat_request.emotion) if chat_request.emotion is not None else None
+    emotion_provided = validated_emotion is not None
+
+    # Errors before the stream starts are returned as regular HTTP errors
+    try:
+        user_data = await _fetch_user(user_uuid)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    current_points = user_data.get("points", 0) or 0
+
+    current_count = await conversation_store.call(conversation_store.increment_count, user_uuid)
+    await conversation_store.call(conversation_store.append_message, user_uuid, "user", message)
+    isFifth = (current_count % MAX_EXCHANGES == 0)
+    logger.info(f"Streaming chat for {user_uuid}: count {current_count}/{MAX_EXCHANGES}")
+
+    is_assignment = current_count == MAX_EXCHANGES
+    if is_assignment:
+        # The analysis has to finish before the reply can be generated
+        try:
+            detected_emotion, detected_animal = await _analyze_conversation(user_uuid)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="AI service timeout")
+        mood = validated_emotion if emotion_provided else detected_emotion
+        animal = detected_animal
+    else:
+        mood = validated_emotion if emotion_provided else user_data["animal_emotion"]
+        animal = user_data["animal_type"]
+
+    async def event_stream():
+        parser = PointsSuffixParser()
+        async for delta in stream_ai_response(message=message, character_type=animal, current_mood=mood):
+            text = parser.feed(delta)
+            if text:
+                yield sse_event("token", {"text": text})
+        tail, points = parser.finish()
+        if tail:
+            yield sse_event("token", {"text": tail})
+        response_text = parser.text
+
+        new_points = current_points + points
+        if is_assignment:
+            update_data = {"animal_type": animal, "animal_emotion": mood, "points": new_points}
+            await conversation_store.call(conversation_store.reset_history, user_uuid)
+        else:
+            update_data = _regular_update_data(user_data, new_points, mood)
+        await conversation_store.call(conversation_store.append_message, user_uuid, "assistant", response_text)
+
+        _update_user(user_uuid, update_data, points)
+        _save_chat(user_uuid, message, response_text)
+
+        # Only include the animal in the response if the frontend provided an emotion
+        animal_to_return = animal if emotion_provided and animal is not None else None
+        final = ChatResponse(
+            response=response_text,
+            emotion=mood,
+            animal=animal_to_return,
+            points=points,
+            isFifth=True if is_assignment else isFifth
+        )
+        yield sse_event("done", final.model_dump(mode="json"))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
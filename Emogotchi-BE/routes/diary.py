@@ -1,11 +1,14 @@
 from fastapi import APIRouter, HTTPException, Path
-from typing import List
-from datetime import date, datetime, timedelta
+from typing import AsyncIterator, List, Optional
+from datetime import date, datetime, time, timedelta
 import logging
-from config.supabase_client import supabase
+from config.supabase_client import db_call, install_transports, supabase
 from models.schemas import DiaryGenerateResponse, DiaryDateEntry
-from config.openai_config import client as openai_client
-import asyncio
+from config.openai_config import create_chat_completion
+from config.prompts import DIARY
+from utils.llm_scheduler import PRIORITY_DIARY
+from utils.metrics import llm_fallbacks
+from utils.timing import StageTimer, stage
 import os
 from supabase import create_client
 from pydantic import BaseModel
@@ -32,6 +35,7 @@ try:
             supabase_url=os.getenv("SUPABASE_URL"),
             supabase_key=service_key
         )
+        install_transports(admin_supabase)
         logger.info("Admin Supabase client initialized with service role key")
     else:
         logger.warning("SUPABASE_SERVICE_KEY not found, falling back to regular key")
@@ -43,45 +47,100 @@ except Exception as e:
 
 router = APIRouter(tags=["Diary"], prefix="/diary")
 
-async def generate_diary(chat_log: str) -> tuple[str, str]:
+# Number of Chat rows fetched per page when building a day's chat log
+CHAT_PAGE_SIZE = int(os.getenv("DIARY_CHAT_PAGE_SIZE", "200"))
+
+def _day_bounds(day: date) -> tuple[str, str]:
+    """
+    Start (inclusive) and end (exclusive) of a local calendar day as ISO timestamps.
+    """
+    start = datetime.combine(day, time.min).astimezone()
+    end = start + timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+def after_cursor(query, start: str, cursor: Optional[tuple[str, int]]):
+    """
+    Continue a Chat scan ordered by (created_at, id) after ``cursor``, the
+    (created_at, id) of the last row seen, or from ``start`` on the first page.
+
+    created_at alone isn't unique (bulk inserts share a timestamp), so id
+    breaks ties.
+    """
+    if cursor is None:
+        return query.gte("created_at", start)
+    created_at, row_id = cursor
+    # postgrest-py 0.11 has no or_(); add the param the way later versions do
+    query.params = query.params.add(
+        "or", f'(created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id}))'
+    )
+    return query
+
+async def iter_chats_for_day(uuid: str, day: date, page_size: int = CHAT_PAGE_SIZE) -> AsyncIterator[dict]:
+    """
+    Yield a user's Chat rows for one day in created_at order.
+
+    Pages are fetched with keyset pagination on (created_at, id), so each
+    query is an index range scan on (uuid, created_at, id) no matter how old
+    the account is.
+    """
+    start, end = _day_bounds(day)
+    cursor = None
+    while True:
+        query = (admin_supabase.table("Chat")
+                 .select("id, user_input, chat_output, created_at")
+                 .eq("uuid", uuid)
+                 .lt("created_at", end))
+        query = after_cursor(query, start, cursor)
+        chat_response = await db_call(
+            lambda: query.order("created_at,id").limit(page_size).execute()
+        )
+        for row in chat_response.data:
+            yield row
+        if len(chat_response.data) < page_size:
+            return
+        cursor = (chat_response.data[-1]["created_at"], chat_response.data[-1]["id"])
+
+async def build_chat_log(uuid: str, day: date) -> tuple[str, int]:
+    """
+    Format a user's chats for one day for summarization.
+
+    Returns:
+        tuple[str, int]: The chat log and the number of messages in it
+    """
+    parts = []
+    async for msg in iter_chats_for_day(uuid, day):
+        parts.append(f"User: {msg['user_input']}\nAI: {msg['chat_output']}\n\n")
+    return "".join(parts), len(parts)
+
+async def generate_diary(
+    chat_log: str,
+    raise_errors: bool = False,
+    use_cache: bool = False,
+    priority: int = PRIORITY_DIARY
+) -> tuple[str, str]:
     """
     Generate a diary summary and emotion from chat logs.
     
     Args:
         chat_log: The chat logs for the day
+        raise_errors: Re-raise errors instead of returning the fallback diary
+        use_cache: Reuse the diary of an identical chat log from the LLM response cache
+        priority: LLM scheduler priority (batch jobs pass PRIORITY_BATCH)
         
     Returns:
         A tuple of (summary, emotion)
     """
     try:
-        # Prompt templates - your teammate can modify these
-        system_prompt = """From now on, you are a writer who writes diaries on behalf of the user. Below is the conversation that took place over one day between the counselor (ChatGPT) and the user. 
-Based on this conversation, please write a diary (in a human-generated style), and by reading the diary, select the dominant emotion that governs the user among HAPPY, SAD, ANGRY, ANXIOUS, CALM, EXCITED, or NEUTRAL. 
-Return the result in the following format: 
-diary: {generate_diary}
-emotion: {emotion}"""
-
-        user_prompt = f"""Here are my conversations with my AI pet companion for today:
-
-{chat_log}
-
-Please write my diary entry based on these conversations and identify my dominant emotion."""
-
-        # Make the API call
-        response = await asyncio.to_thread(
-            lambda: openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
+        # Make the API call (prompt text lives in config/prompts.py)
+        ai_response = await create_chat_completion(
+            messages=DIARY.build(chat_log=chat_log),
+            profile="diary",
+            use_cache=use_cache,
+            priority=priority,
+            template=DIARY.key
         )
         
         # Extract summary and emotion
-        ai_response = response.choices[0].message.content
         logger.info(f"Raw AI response: {ai_response}")
         
         # Parsing the response
@@ -155,9 +214,74 @@ Please write my diary entry based on these conversations and identify my dominan
         
     except Exception as e:
         logger.error(f"Error generating diary: {str(e)}")
+        if raise_errors:
+            raise
+        llm_fallbacks.inc(call_type="diary")
         return "Failed to generate diary summary.", "neutral"
 
 
+async def generate_and_save_diary(
+    uuid: str,
+    day: date,
+    raise_errors: bool = False,
+    priority: int = PRIORITY_DIARY
+) -> tuple[str, str]:
+    """
+    Build the chat log of one day, generate the diary and upsert it.
+    
+    Args:
+        uuid: User UUID
+        day: The day to write the diary for
+        raise_errors: Raise on Chat query or LLM errors instead of saving a fallback diary
+        priority: LLM scheduler priority for the diary call
+        
+    Returns:
+        A tuple of (summary, emotion)
+    """
+    # Fetch the day's chat messages page by page and join them once
+    try:
+        logger.info("Attempting to query Chat table")
+        with stage("chat_fetch"):
+            chat_log, message_count = await build_chat_log(uuid, day)
+        logger.info(f"Chat query successful, found {message_count} messages")
+    except Exception as e:
+        logger.error(f"Error querying Chat table: {e}")
+        if raise_errors:
+            raise
+        chat_log, message_count = "", 0
+    
+    if not message_count:
+        # Instead of raising an error, just generate a generic diary entry
+        logger.warning(f"No chat messages found for user {uuid}, creating generic diary")
+        chat_log = "No chat messages found for today."
+        
+    logger.info("Generating diary summary")
+    # Generate diary entry
+    # The placeholder log is identical for every user, so its diary is cached
+    with stage("generation"):
+        summary, emotion = await generate_diary(
+            chat_log, raise_errors=raise_errors, use_cache=not message_count, priority=priority
+        )
+    logger.info(f"Generated summary with emotion: {emotion}")
+    
+    # Upsert result to the Diary table (update if exists, insert if not)
+    diary_data = {
+        "uuid": uuid,
+        "date": day.isoformat(),
+        "summary": summary,
+        "emotion": emotion
+    }
+    
+    logger.info(f"Saving diary entry to database: {diary_data}")
+    with stage("diary_save"):
+        await db_call(
+            lambda: admin_supabase.table("Diary").upsert(diary_data).execute()
+        )
+    logger.info("Diary entry saved successfully")
+    
+    return summary, emotion
+
+
 @router.post("/generate", response_model=DiaryGenerateResponse)
 async def create_diary_entry_with_body(request: DiaryGenerationRequest):
     """
@@ -173,23 +297,25 @@ async def create_diary_entry(uuid: str = Path(..., description="User UUID")):
     """
     Generate a diary entry for today based on the user's chat messages.
     """
+    timer = StageTimer("diary")
     try:
         logger.info(f"Starting diary generation for user {uuid}")
         # First, check if the user exists (try both User and users tables)
-        try:
-            user_response = await asyncio.to_thread(
-                lambda: admin_supabase.table("User").select("*").eq("uuid", uuid).execute()
-            )
-            if not user_response.data:
-                user_response = await asyncio.to_thread(
+        with timer.stage("user_fetch"):
+            try:
+                user_response = await db_call(
+                    lambda: admin_supabase.table("User").select("*").eq("uuid", uuid).execute()
+                )
+                if not user_response.data:
+                    user_response = await db_call(
+                        lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
+                    )
+                logger.info(f"User lookup successful: {user_response.data is not None and len(user_response.data) > 0}")
+            except Exception as e:
+                logger.warning(f"Error with User table, trying users: {e}")
+                user_response = await db_call(
                     lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
                 )
-            logger.info(f"User lookup successful: {user_response.data is not None and len(user_response.data) > 0}")
-        except Exception as e:
-            logger.warning(f"Error with User table, trying users: {e}")
-            user_response = await asyncio.to_thread(
-                lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
-            )
         
         if not user_response.data:
             raise HTTPException(status_code=404, detail="User not found")
@@ -198,49 +324,7 @@ async def create_diary_entry(uuid: str = Path(..., description="User UUID")):
         today = date.today()
         logger.info(f"Generating diary for date: {today.isoformat()}")
         
-        # Fetch all chat messages for this user (no date filtering since there's no created_at column)
-        try:
-            logger.info("Attempting to query Chat table")
-            chat_response = await asyncio.to_thread(
-                lambda: admin_supabase.table("Chat")
-                    .select("uuid, user_input, chat_output")
-                    .eq("uuid", uuid)
-                    .execute()
-            )
-            logger.info(f"Chat query successful, found {len(chat_response.data)} messages")
-        except Exception as e:
-            logger.error(f"Error querying Chat table: {e}")
-            # Create a default empty response
-            chat_response = type('obj', (object,), {'data': []})
-        
-        if not chat_response.data:
-            # Instead of raising an error, just generate a generic diary entry
-            logger.warning(f"No chat messages found for user {uuid}, creating generic diary")
-            chat_log = "No chat messages found for today."
-        else:
-            # Format chat logs for summarization
-            chat_log = ""
-            for msg in chat_response.data:
-                chat_log += f"User: {msg['user_input']}\nAI: {msg['chat_output']}\n\n"
-            
-        logger.info("Generating diary summary")
-        # Generate diary entry
-        summary, emotion = await generate_diary(chat_log)
-        logger.info(f"Generated summary with emotion: {emotion}")
-        
-        # Upsert result to the Diary table (update if exists, insert if not)
-        diary_data = {
-            "uuid": uuid,
-            "date": today.isoformat(),
-            "summary": summary,
-            "emotion": emotion
-        }
-        
-        logger.info(f"Saving diary entry to database: {diary_data}")
-        await asyncio.to_thread(
-            lambda: admin_supabase.table("Diary").upsert(diary_data).execute()
-        )
-        logger.info("Diary entry saved successfully")
+        summary, emotion = await generate_and_save_diary(uuid, today)
         
         return DiaryGenerateResponse(
             message="Diary generated",
@@ -255,6 +339,8 @@ async def create_diary_entry(uuid: str = Path(..., description="User UUID")):
     except Exception as e:
         logger.error(f"Error creating diary entry: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create diary entry: {str(e)}")
+    finally:
+        timer.finish()
 
 
 @router.post("/generate2/{uuid}", response_model=DiaryGenerateResponse)
@@ -265,16 +351,16 @@ async def create_diary_entry_alt(uuid: str = Path(..., description="User UUID"))
     try:
         # First, check if the user exists (try both User and users tables)
         try:
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("User").select("*").eq("uuid", uuid).execute()
             )
             if not user_response.data:
-                user_response = await asyncio.to_thread(
+                user_response = await db_call(
                     lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
                 )
         except Exception as e:
             logger.warning(f"Error with User table, trying users: {e}")
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
             )
         
@@ -287,8 +373,8 @@ async def create_diary_entry_alt(uuid: str = Path(..., description="User UUID"))
         # Create a generic diary even without chat messages
         chat_log = "This is a demo diary entry."
         
-        # Generate diary entry
-        summary, emotion = await generate_diary(chat_log)
+        # Generate diary entry (always the same demo log, so serve it from the cache)
+        summary, emotion = await generate_diary(chat_log, use_cache=True)
         
         # Upsert result to the Diary table (update if exists, insert if not)
         diary_data = {
@@ -298,7 +384,7 @@ async def create_diary_entry_alt(uuid: str = Path(..., description="User UUID"))
             "emotion": emotion
         }
         
-        await asyncio.to_thread(
+        await db_call(
             lambda: admin_supabase.table("Diary").upsert(diary_data).execute()
         )
         
@@ -324,16 +410,16 @@ async def get_diary_dates(uuid: str = Path(..., description="User UUID")):
     try:
         # First, check if the user exists (try both User and users tables)
         try:
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("User").select("*").eq("uuid", uuid).execute()
             )
             if not user_response.data:
-                user_response = await asyncio.to_thread(
+                user_response = await db_call(
                     lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
                 )
         except Exception as e:
             logger.warning(f"Error with User table, trying users: {e}")
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
             )
         
@@ -341,7 +427,7 @@ async def get_diary_dates(uuid: str = Path(..., description="User UUID")):
             raise HTTPException(status_code=404, detail="User not found")
             
         # Fetch all diary entries for this user
-        diary_response = await asyncio.to_thread(
+        diary_response = await db_call(
             lambda: admin_supabase.table("Diary")
                 .select("date, emotion, summary")
                 .eq("uuid", uuid)
@@ -378,16 +464,16 @@ async def get_diary_dates_by_query(uuid: str):
     try:
         # First, check if the user exists (try both User and users tables)
         try:
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("User").select("*").eq("uuid", uuid).execute()
             )
             if not user_response.data:
-                user_response = await asyncio.to_thread(
+                user_response = await db_call(
                     lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
                 )
         except Exception as e:
             logger.warning(f"Error with User table, trying users: {e}")
-            user_response = await asyncio.to_thread(
+            user_response = await db_call(
                 lambda: admin_supabase.table("users").select("*").eq("uuid", uuid).execute()
             )
         
@@ -395,7 +481,7 @@ async def get_diary_dates_by_query(uuid: str):
             raise HTTPException(status_code=404, detail="User not found")
             
         # Fetch all diary entries for this user
-        diary_response = await asyncio.to_thread(
+        diary_response = await db_call(
             lambda: admin_supabase.table("Diary")
                 .select("date, emotion, summary")
                 .eq("uuid", uuid)
@@ -431,7 +517,7 @@ async def test_diary_api():
     """
     try:
         # Test Chat table structure
-        chat_test = await asyncio.to_thread(
+        chat_test = await db_call(
             lambda: admin_supabase.table("Chat").select("*").limit(1).execute()
         )
         
@@ -440,7 +526,7 @@ async def test_diary_api():
             return {"status": "OK", "message": "Diary API is up", "chat_fields": list(available_keys)}
         else:
             # Try with users table for comparison
-            user_test = await asyncio.to_thread(
+            user_test = await db_call(
                 lambda: admin_supabase.table("User").select("*").limit(1).execute()
             )
             return {"status": "OK", "message": "Diary API is up", "no_chat_data": True, "user_fields": list(user_test.data[0].keys()) if user_test.data else []}
@@ -465,7 +551,7 @@ async def create_simple_diary(uuid: str = Path(..., description="User UUID")):
         
         # Try raw SQL insert
         try:
-            result = await asyncio.to_thread(
+            result = await db_call(
                 lambda: admin_supabase.table("Diary").insert(diary_data, returning="minimal").execute()
             )
             return {"message": "Diary entry created", "result": result}
@@ -490,7 +576,7 @@ async def create_custom_diary(diary_entry: DiaryEntryCreate):
                 "emotion": diary_entry.emotion
             }
             
-            result = await asyncio.to_thread(
+            result = await db_call(
                 lambda: admin_supabase.table("Diary").insert(diary_data, returning="minimal").execute()
             )
             return {"message": "Diary entry created", "result": result}
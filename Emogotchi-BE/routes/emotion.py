@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Query
-from models.schemas import EmotionUpdateRequest, EmotionUpdateResponse, EmotionType
-from db import supabase
+from models.schemas import EmotionUpdateResponse, EmotionType
+from config.supabase_client import db_call, supabase
 from fastapi.responses import JSONResponse
 
 router = APIRouter()
@@ -15,7 +15,7 @@ async def update_emotion(
         data = {
             "current_mood": emotion
         }
-        response = supabase.table("users").update(data).eq("uuid", user_uuid).execute()
+        response = await db_call(lambda: supabase.table("users").update(data).eq("uuid", user_uuid).execute())
         
         if not response.data:
             raise HTTPException(status_code=404, detail="User not found")
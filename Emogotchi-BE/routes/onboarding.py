@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Body
 from models.schemas import OnboardingResponse, UserResponse
-from config.supabase_client import supabase
+from config.supabase_client import db_call, supabase
+from utils.user_cache import user_cache, fetch_user_row
 import logging
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
@@ -26,21 +27,6 @@ async def create_user(request: OnboardingRequest):
         if not request.uuid:
             raise HTTPException(status_code=400, detail="UUID is required")
         
-        # Check if user already exists
-        existing_user = supabase.table("User").select("*").eq("uuid", request.uuid).execute()
-        if existing_user.data:
-            # User already exists, return their info
-            user_data = existing_user.data[0]
-            return UserResponse(
-                uuid=user_data["uuid"],
-                nickname=user_data["nickname"],
-                animal_type=user_data["animal_type"],
-                animal_emotion=user_data["animal_emotion"],
-                animal_level=user_data["animal_level"],
-                is_notified=user_data["is_notified"],
-                created_at=user_data.get("created_at")
-            )
-        
         data = {
             "uuid": request.uuid,
             "nickname": request.nickname,
@@ -51,17 +37,36 @@ async def create_user(request: OnboardingRequest):
             "is_notified": False     # Initialize to False
         }
         
-        logger.info(f"Inserting data into Supabase: {data}")
-        
-        result = supabase.table("User").insert(data).execute()
-        
-        logger.info(f"Supabase response: {result}")
+        # Skip the write entirely for users we already know about
+        if user_cache.get(request.uuid) is None:
+            logger.info(f"Upserting data into Supabase: {data}")
+            
+            # INSERT ... ON CONFLICT (uuid) DO NOTHING: a single round trip that
+            # only returns a row when the user was actually created
+            result = await db_call(
+                lambda: supabase.table("User").upsert(data, on_conflict="uuid", ignore_duplicates=True).execute()
+            )
+            
+            logger.info(f"Supabase response: {result}")
+            
+            if result.data:
+                user_cache.put(request.uuid, result.data[0])
+                return OnboardingResponse(uuid=request.uuid, nickname=request.nickname)
         
-        if not result.data:
+        # User already exists, return their info
+        user_data = await fetch_user_row(request.uuid)
+        if user_data is None:
             logger.error("Failed to create user: No data returned from Supabase")
             raise HTTPException(status_code=500, detail="Failed to create user")
-            
-        return OnboardingResponse(uuid=request.uuid, nickname=request.nickname)
+        return UserResponse(
+            uuid=user_data["uuid"],
+            nickname=user_data["nickname"],
+            animal_type=user_data["animal_type"],
+            animal_emotion=user_data["animal_emotion"],
+            animal_level=user_data["animal_level"],
+            is_notified=user_data["is_notified"],
+            created_at=user_data.get("created_at")
+        )
     except Exception as e:
         logger.error(f"Error creating user: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Query, Body
 from models.schemas import UserResponse, OnboardingResponse, EmotionSelectionResponse, EmotionUpdateResponse, CharacterType, EmotionType
-from config.supabase_client import supabase
+from config.supabase_client import db_call, supabase
+from utils.user_cache import user_cache, fetch_user_row, update_user_row
 from fastapi.responses import JSONResponse, Response
 from typing import List, Optional
 import uuid
@@ -34,23 +35,7 @@ async def create_user(request: OnboardingRequest):
         if not request.uuid:
             raise HTTPException(status_code=400, detail="UUID is required")
         
-        # Check if user already exists
-        existing_user = supabase.table("User").select("*").eq("uuid", request.uuid).execute()
-        if existing_user.data:
-            # User already exists, return their info
-            user_data = existing_user.data[0]
-            return UserResponse(
-                uuid=user_data["uuid"],
-                nickname=user_data["nickname"],
-                animal_type=user_data["animal_type"],
-                animal_emotion=user_data["animal_emotion"],
-                animal_level=user_data["animal_level"],
-                points=user_data.get("points", 0),
-                is_notified=user_data["is_notified"],
-                created_at=user_data.get("created_at")
-            )
-        
-        # Create new user
+        # Create new user; ignore_duplicates makes this INSERT ... ON CONFLICT DO NOTHING
         data = {
             "uuid": request.uuid,
             "nickname": request.nickname,
@@ -60,8 +45,26 @@ async def create_user(request: OnboardingRequest):
             "points": 0,
             "is_notified": False
         }
-        supabase.table("User").insert(data).execute()
-        return OnboardingResponse(uuid=request.uuid, nickname=request.nickname)
+        if user_cache.get(request.uuid) is None:
+            result = await db_call(
+                lambda: supabase.table("User").upsert(data, on_conflict="uuid", ignore_duplicates=True).execute()
+            )
+            if result.data:
+                user_cache.put(request.uuid, result.data[0])
+                return OnboardingResponse(uuid=request.uuid, nickname=request.nickname)
+        
+        # User already exists, return their info
+        user_data = await fetch_user_row(request.uuid)
+        return UserResponse(
+            uuid=user_data["uuid"],
+            nickname=user_data["nickname"],
+            animal_type=user_data["animal_type"],
+            animal_emotion=user_data["animal_emotion"],
+            animal_level=user_data["animal_level"],
+            points=user_data.get("points", 0),
+            is_notified=user_data["is_notified"],
+            created_at=user_data.get("created_at")
+        )
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -78,31 +81,41 @@ async def assign_character(
         # Standardize UUID to uppercase to avoid case sensitivity issues
         user_uuid = user_uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", user_uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
+        # The cached row tells us whether an animal was already assigned
+        user_data = user_cache.get(user_uuid)
         
         # If animal_type is None, assign a random character
-        if not user_response.data[0].get("animal_type"):
+        if user_data is None or not user_data.get("animal_type"):
             animal_type = random.choice(list(CharacterType))
             data = {
                 "animal_emotion": emotion,
                 "animal_type": animal_type
             }
-            supabase.table("User").update(data).eq("uuid", user_uuid).execute()
-            return EmotionSelectionResponse(
-                animal_type=animal_type,
-                animal_emotion=emotion,
-                animal_level=1,
-                points=user_response.data[0].get("points", 0)
+            # Only matches users that don't have an animal yet
+            result = await db_call(
+                lambda: supabase.table("User")
+                .update(data)
+                .eq("uuid", user_uuid)
+                .is_("animal_type", "null")
+                .execute()
             )
-        else:
-            data = {
-                "animal_emotion": emotion
-            }
-            supabase.table("User").update(data).eq("uuid", user_uuid).execute()
-            return EmotionUpdateResponse(success=True, new_mood=emotion)
+            if result.data:
+                user_cache.put(user_uuid, result.data[0])
+                return EmotionSelectionResponse(
+                    animal_type=animal_type,
+                    animal_emotion=emotion,
+                    animal_level=1,
+                    points=result.data[0].get("points", 0)
+                )
+        
+        # Animal already assigned: only update the emotion
+        data = {
+            "animal_emotion": emotion
+        }
+        result = await update_user_row(user_uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
+        return EmotionUpdateResponse(success=True, new_mood=emotion)
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -113,11 +126,10 @@ async def get_user(uuid: str):
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = uuid.upper()
         
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
+        user_data = await fetch_user_row(uuid)
+        if user_data is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user_data = user_response.data[0]
         return UserResponse(
             uuid=user_data["uuid"],
             nickname=user_data["nickname"],
@@ -138,11 +150,10 @@ async def get_user_by_query(uuid: str = Query(..., description="User UUID")):
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = uuid.upper()
         
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
+        user_data = await fetch_user_row(uuid)
+        if user_data is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user_data = user_response.data[0]
         return UserResponse(
             uuid=user_data["uuid"],
             nickname=user_data["nickname"],
@@ -182,16 +193,14 @@ async def update_emotion(
         # Standardize UUID to uppercase to avoid case sensitivity issues
         user_uuid = user_uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", user_uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the emotion
         data = {
             "animal_emotion": emotion
         }
-        supabase.table("User").update(data).eq("uuid", user_uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(user_uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         return EmotionUpdateResponse(success=True, new_mood=emotion)
             
@@ -205,10 +214,11 @@ async def delete_user(uuid: str):
         uuid = uuid.upper()
         
         # Delete the user
-        supabase.table("User").delete().eq("uuid", uuid).execute()
+        await db_call(lambda: supabase.table("User").delete().eq("uuid", uuid).execute())
+        user_cache.invalidate(uuid)
         
         # Delete associated chat messages
-        supabase.table("Chat").delete().eq("uuid", uuid).execute()
+        await db_call(lambda: supabase.table("Chat").delete().eq("uuid", uuid).execute())
         
         return {"message": "User deleted successfully"}
             
@@ -227,16 +237,14 @@ async def update_points_get(
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the points
         data = {
             "points": points
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 204 No Content response
         return Response(status_code=204)
@@ -253,16 +261,14 @@ async def update_points_post(request: UpdatePointsRequest):
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = request.uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the points
         data = {
             "points": request.points
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 200 OK with empty content to match frontend expectations
         return {}
@@ -279,16 +285,14 @@ async def update_level_post(request: UpdateLevelRequest):
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = request.uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the animal level
         data = {
             "animal_level": request.animal_level
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 200 OK with empty content to match frontend expectations
         return {}
@@ -308,16 +312,14 @@ async def update_level_get(
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the animal level
         data = {
             "animal_level": level
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 200 OK with empty content to match frontend expectations
         return {}
@@ -360,16 +362,14 @@ async def update_name_post(request: UpdateNameRequest):
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = request.uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the nickname
         data = {
             "nickname": request.nickname
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 200 OK with empty content to match frontend expectations
         return {}
@@ -389,16 +389,14 @@ async def update_name_get(
         # Standardize UUID to uppercase to avoid case sensitivity issues
         uuid = uuid.upper()
         
-        # Get the user from the database
-        user_response = supabase.table("User").select("*").eq("uuid", uuid).execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Update the nickname
         data = {
             "nickname": nickname
         }
-        supabase.table("User").update(data).eq("uuid", uuid).execute()
+        # Single round trip: the update returns the affected row, if any
+        result = await update_user_row(uuid, data)
+        if not result.data:
+            raise HTTPException(status_code=404, detail="User not found")
         
         # Return a 200 OK with empty content to match frontend expectations
         return {}
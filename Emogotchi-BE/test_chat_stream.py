@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from utils.chat_stream import DEFAULT_POINTS, PointsSuffixParser
+
+
+def _stream(chunks):
+    parser = PointsSuffixParser()
+    forwarded = [parser.feed(chunk) for chunk in chunks]
+    tail, points = parser.finish()
+    forwarded.append(tail)
+    assert "".join(forwarded) == parser.text
+    return forwarded, points
+
+
+def _split(text, rng):
+    chunks = []
+    while text:
+        size = rng.randint(1, 6)
+        chunks.append(text[:size])
+        text = text[size:]
+    return chunks
+
+
+@pytest.mark.parametrize("completion, reply, points", [
+    ("gpt: That sounds hard. How are you coping? points: 2", "That sounds hard. How are you coping?", 2),
+    ("GPT: I'm glad you shared that. Points: 4", "I'm glad you shared that.", 4),
+    ("  gpt:   Leading whitespace is dropped.  points:3", "Leading whitespace is dropped.", 3),
+    ("No tag at all, just a reply. points: 1", "No tag at all, just a reply.", 1),
+    ("gpt: That's a fair point. What happened next? points: 3", "That's a fair point. What happened next?", 3),
+    ("gpt: Take a breath. points: 9", "Take a breath.", 5),
+    ("gpt: The model forgot the suffix.", "The model forgot the suffix.", DEFAULT_POINTS),
+    ("gpt: Unparseable suffix. points: many", "Unparseable suffix.", DEFAULT_POINTS),
+])
+def test_any_chunking_gives_the_same_reply_and_points(completion, reply, points):
+    forwarded, parsed = _stream([completion])
+    assert "".join(forwarded) == reply
+    assert parsed == points
+
+    rng = random.Random(completion)
+    for _ in range(50):
+        forwarded, parsed = _stream(_split(completion, rng))
+        assert "".join(forwarded) == reply
+        assert parsed == points
+
+    forwarded, parsed = _stream(list(completion))
+    assert "".join(forwarded) == reply
+    assert parsed == points
+
+
+def test_partial_points_marker_is_held_back():
+    parser = PointsSuffixParser()
+    assert parser.feed("gpt: Hello there. poi") == "Hello there."
+    # Could still be the marker: nothing forwarded yet
+    assert parser.feed("nt") == ""
+    assert parser.feed("s: 4") == ""
+    assert parser.finish() == ("", 4)
+    assert parser.text == "Hello there."
+
+
+def test_held_back_text_is_released_when_it_is_not_the_marker():
+    parser = PointsSuffixParser()
+    assert parser.feed("gpt: Good poi") == "Good"
+    assert parser.feed("nt, really") == " point, really"
+    assert parser.finish() == ("", DEFAULT_POINTS)
+    assert parser.text == "Good point, really"
+
+
+def test_gpt_tag_split_across_chunks_is_stripped():
+    forwarded, points = _stream(["g", "p", "t", ":", " Hi", " points: 0"])
+    assert "".join(forwarded) == "Hi"
+    assert points == 0
+
+
+def test_text_after_the_points_is_never_forwarded():
+    forwarded, points = _stream(["gpt: Hi. points: 3", " (because you opened up)"])
+    assert "".join(forwarded) == "Hi."
+    assert points == 3
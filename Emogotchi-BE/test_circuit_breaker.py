@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+import config.openai_config as openai_config
+from utils.circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+from utils.llm import LocalBackend
+from utils.llm_scheduler import PRIORITY_DIARY, LLMScheduler
+
+
+async def _hung_upstream():
+    await asyncio.sleep(60)
+
+
+def test_breaker_opens_when_callers_time_out_on_hung_upstream():
+    # Like /chat: the route's wait_for cancels the call inside guard()
+    breaker = CircuitBreaker("test", window_size=20, min_calls=10, slow_call_seconds=0.1, open_seconds=30)
+
+    async def run():
+        calls = [asyncio.wait_for(breaker.call(_hung_upstream), timeout=0.2) for _ in range(12)]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+        assert breaker.state == OPEN
+
+        # The next call fails fast instead of waiting out another timeout
+        start_time = time.monotonic()
+        with pytest.raises(CircuitOpenError):
+            await asyncio.wait_for(breaker.call(_hung_upstream), timeout=0.2)
+        assert time.monotonic() - start_time < 0.05
+
+    asyncio.run(run())
+
+
+def test_early_cancellation_is_not_counted():
+    breaker = CircuitBreaker("test", min_calls=1, slow_call_seconds=1.0)
+
+    async def run():
+        task = asyncio.create_task(breaker.call(_hung_upstream))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.stats()["window_calls"] == 0
+        assert breaker.state != OPEN
+
+    asyncio.run(run())
+
+
+def test_cancelled_half_open_probe_reopens():
+    breaker = CircuitBreaker("test", min_calls=1, slow_call_seconds=0.1, open_seconds=0.0)
+    breaker._open()
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(breaker.call(_hung_upstream), timeout=0.2)
+        assert breaker.state == OPEN
+
+    asyncio.run(run())
+
+
+def test_saturated_scheduler_does_not_trip_breaker(monkeypatch):
+    # One slot and 20 callers: most wait in the queue far longer than the
+    # slow-call threshold, while every upstream call itself is fast
+    scheduler = LLMScheduler(max_concurrency=1)
+    breaker = CircuitBreaker("test", window_size=20, min_calls=5, slow_call_seconds=0.1)
+    monkeypatch.setattr(openai_config, "llm_scheduler", scheduler)
+    monkeypatch.setattr(openai_config, "llm_backend", LocalBackend(latency=0.02, jitter=0))
+    monkeypatch.setattr(openai_config, "get_breaker", lambda call_type: breaker)
+
+    async def run():
+        messages = [{"role": "user", "content": "hello"}]
+        calls = [openai_config.create_chat_completion(messages, priority=PRIORITY_DIARY) for _ in range(20)]
+        results = await asyncio.gather(*calls)
+        assert all(results)
+        assert scheduler.stats()["priorities"]["diary"]["max_wait"] > breaker.slow_call_seconds
+
+    asyncio.run(run())
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 20
+    assert max(breaker._latencies) < breaker.slow_call_seconds
+
+
+def test_open_breaker_rejects_before_queueing(monkeypatch):
+    scheduler = LLMScheduler(max_concurrency=1)
+    breaker = CircuitBreaker("test", open_seconds=30)
+    breaker._open()
+    monkeypatch.setattr(openai_config, "llm_scheduler", scheduler)
+    monkeypatch.setattr(openai_config, "get_breaker", lambda call_type: breaker)
+
+    async def run():
+        with pytest.raises(CircuitOpenError):
+            await openai_config.create_chat_completion([{"role": "user", "content": "hello"}])
+
+    asyncio.run(run())
+    assert scheduler.stats()["priorities"]["chat"]["admitted"] == 0
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.conversation_store import InMemoryConversationStore, SQLiteConversationStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            store = InMemoryConversationStore(**kwargs)
+        else:
+            store = SQLiteConversationStore(path=str(tmp_path / "conversations.db"), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_counts_and_history_per_user(make_store):
+    store = make_store()
+    assert store.get_count("u1") == 0
+    assert [store.increment_count("u1") for _ in range(3)] == [1, 2, 3]
+    assert store.increment_count("u2") == 1
+
+    store.append_message("u1", "user", "hi")
+    store.append_message("u1", "assistant", "hello")
+    assert store.get_history("u1") == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    assert store.get_history("u2") == []
+    assert store.user_count() == 2
+    assert store.message_count() == 2
+
+
+def test_history_keeps_the_newest_messages(make_store):
+    store = make_store(max_messages=3)
+    store.increment_count("u1")
+    for i in range(5):
+        store.append_message("u1", "user", f"message {i}")
+    assert [m["content"] for m in store.get_history("u1")] == ["message 2", "message 3", "message 4"]
+
+
+def test_reset_history_keeps_the_count(make_store):
+    store = make_store()
+    store.increment_count("u1")
+    store.increment_count("u1")
+    store.append_message("u1", "user", "hi")
+    store.reset_history("u1")
+    assert store.get_history("u1") == []
+    assert store.get_count("u1") == 2
+
+
+def test_idle_users_restart_with_empty_history(make_store):
+    store = make_store(ttl_seconds=0.05)
+    store.increment_count("u1")
+    store.increment_count("u1")
+    store.append_message("u1", "user", "stale")
+    time.sleep(0.1)
+    assert store.get_count("u1") == 0
+    assert store.increment_count("u1") == 1
+    assert store.get_history("u1") == []
+
+
+def test_call_runs_store_methods_from_async_code(make_store):
+    store = make_store()
+
+    async def run():
+        assert await store.call(store.increment_count, "u1") == 1
+        await store.call(store.append_message, "u1", "user", "hi")
+        return await store.call(store.get_history, "u1")
+
+    assert asyncio.run(run()) == [{"role": "user", "content": "hi"}]
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemoryConversationStore(max_users=2)
+    store.increment_count("u1")
+    store.increment_count("u2")
+    # Touching u1 makes u2 the least recently used
+    store.get_count("u1")
+    store.increment_count("u3")
+    assert store.user_count() == 2
+    assert store.get_count("u1") == 1
+    assert store.get_count("u2") == 0
+
+
+def test_sqlite_store_is_shared_and_never_repeats_a_count(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    # Two stores on one file, like two uvicorn workers
+    stores = [SQLiteConversationStore(path=path), SQLiteConversationStore(path=path)]
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            counts = list(pool.map(lambda i: stores[i % 2].increment_count("u1"), range(200)))
+        assert sorted(counts) == list(range(1, 201))
+        assert stores[0].get_count("u1") == 200
+
+        stores[0].append_message("u1", "user", "hi")
+        assert stores[1].get_history("u1") == [{"role": "user", "content": "hi"}]
+    finally:
+        for store in stores:
+            store.close()
+
+
+def test_sqlite_store_calls_run_off_the_event_loop(tmp_path):
+    store = SQLiteConversationStore(path=str(tmp_path / "conversations.db"))
+
+    async def run():
+        return await store.call(lambda: threading.current_thread().name)
+
+    try:
+        assert asyncio.run(run()).startswith("conversation-db")
+    finally:
+        store.close()
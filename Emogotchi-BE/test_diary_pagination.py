@@ -0,0 +1,64 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+from batch_diaries import find_users_with_chats
+from config.supabase_client import supabase
+from routes.diary import iter_chats_for_day
+
+
+def _at(day: date, hour: int, minute: int = 0) -> str:
+    return datetime.combine(day, time(hour, minute)).astimezone().isoformat()
+
+
+def _insert(rows):
+    return supabase.table("Chat").insert(rows).execute().data
+
+
+def _chats(uuid: str, day: date, page_size: int):
+    async def run():
+        return [row async for row in iter_chats_for_day(uuid, day, page_size=page_size)]
+    return asyncio.run(run())
+
+
+def test_rows_sharing_a_timestamp_are_not_skipped_across_pages():
+    # A bulk insert gives every row the same created_at; pages must break ties on id
+    day = date(2001, 1, 1)
+    inserted = _insert([
+        {"uuid": f"tie-user-{i % 3}", "user_input": f"message {i}", "chat_output": "reply", "created_at": _at(day, 12)}
+        for i in range(40)
+    ])
+    expected = [row["id"] for row in inserted if row["uuid"] == "tie-user-0"]
+
+    for page_size in (1, 4, 7, 100):
+        rows = _chats("tie-user-0", day, page_size)
+        assert [row["id"] for row in rows] == sorted(expected)
+
+
+def test_only_the_day_is_read_in_created_at_order():
+    day = date(2001, 2, 1)
+    _insert([
+        {"uuid": "day-user", "user_input": "evening", "chat_output": "reply", "created_at": _at(day, 21)},
+        {"uuid": "day-user", "user_input": "yesterday", "chat_output": "reply",
+         "created_at": _at(day - timedelta(days=1), 23, 59)},
+        {"uuid": "day-user", "user_input": "midnight", "chat_output": "reply", "created_at": _at(day, 0)},
+        {"uuid": "day-user", "user_input": "tomorrow", "chat_output": "reply", "created_at": _at(day + timedelta(days=1), 0)},
+        {"uuid": "day-user", "user_input": "noon", "chat_output": "reply", "created_at": _at(day, 12)},
+        {"uuid": "other-user", "user_input": "not mine", "chat_output": "reply", "created_at": _at(day, 12)}
+    ])
+
+    for page_size in (1, 2, 200):
+        rows = _chats("day-user", day, page_size)
+        assert [row["user_input"] for row in rows] == ["midnight", "noon", "evening"]
+
+
+def test_find_users_with_chats_pages_through_ties():
+    day = date(2001, 3, 1)
+    _insert([
+        {"uuid": f"batch-user-{i % 10}", "user_input": "hi", "chat_output": "reply", "created_at": _at(day, 9)}
+        for i in range(60)
+    ])
+    _insert([{"uuid": "late-user", "user_input": "hi", "chat_output": "reply", "created_at": _at(day, 22)}])
+
+    for page_size in (1, 7, 1000):
+        users = asyncio.run(find_users_with_chats(day, page_size=page_size))
+        assert users == [f"batch-user-{i}" for i in range(10)] + ["late-user"]
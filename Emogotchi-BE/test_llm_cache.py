@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from utils.llm_cache import LLMResponseCache
+
+
+def test_identical_inflight_calls_share_one_result():
+    cache = LLMResponseCache()
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_create("key", create) for _ in range(3)])
+
+    assert asyncio.run(run()) == ["reply"] * 3
+    assert len(calls) == 1
+    assert cache.stats()["shared"] == 2
+    assert cache.get("key") == "reply"
+
+
+def test_cancelled_creator_does_not_cancel_waiters():
+    cache = LLMResponseCache()
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def run():
+        # The creator's caller times out before the call finishes
+        creator = asyncio.ensure_future(asyncio.wait_for(cache.get_or_create("key", create), timeout=0.01))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache.get_or_create("key", create)) for _ in range(2)]
+        with pytest.raises(asyncio.TimeoutError):
+            await creator
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(run()) == ["reply", "reply"]
+    # One waiter re-ran the call, the other shared it
+    assert len(calls) == 2
+    assert cache.stats()["shared"] == 1
+    assert cache.get("key") == "reply"
+
+
+def test_creator_error_reaches_waiters():
+    cache = LLMResponseCache()
+
+    async def create():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_create("key", create) for _ in range(2)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get("key") is None
+
+
+def test_expired_entries_are_not_served():
+    cache = LLMResponseCache(ttl_seconds=0)
+    cache.put("key", "reply")
+    assert cache.get("key") is None
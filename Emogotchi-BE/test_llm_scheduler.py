@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from utils.llm_scheduler import (
+    PRIORITY_BATCH, PRIORITY_CHAT, PRIORITY_DIARY, LLMScheduler, SchedulerTimeout, TokenBucket
+)
+
+
+async def _hold(scheduler, priority, order, name, release=None, **kwargs):
+    async with scheduler.slot(priority=priority, **kwargs):
+        order.append(name)
+        if release is not None:
+            await release.wait()
+
+
+def test_higher_priority_is_admitted_first():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        blocker = asyncio.ensure_future(_hold(scheduler, PRIORITY_BATCH, order, "blocker", release))
+        await asyncio.sleep(0)
+        # Queued lowest priority first
+        waiters = [
+            asyncio.ensure_future(_hold(scheduler, PRIORITY_BATCH, order, "batch")),
+            asyncio.ensure_future(_hold(scheduler, PRIORITY_DIARY, order, "diary")),
+            asyncio.ensure_future(_hold(scheduler, PRIORITY_CHAT, order, "chat 1")),
+            asyncio.ensure_future(_hold(scheduler, PRIORITY_CHAT, order, "chat 2"))
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.queued() == {"chat": 2, "diary": 1, "batch": 1}
+        release.set()
+        await asyncio.gather(blocker, *waiters)
+
+    asyncio.run(run())
+    # Chat ahead of diary ahead of batch, first come first served within one priority
+    assert order == ["blocker", "chat 1", "chat 2", "diary", "batch"]
+    assert scheduler.in_flight == 0
+
+
+def test_max_wait_raises_scheduler_timeout():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        blocker = asyncio.ensure_future(_hold(scheduler, PRIORITY_DIARY, order, "blocker", release))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerTimeout):
+            await _hold(scheduler, PRIORITY_CHAT, order, "chat", max_wait=0.05)
+        assert scheduler.queued()["chat"] == 0
+        release.set()
+        await blocker
+        # The slot is free again for the next call
+        await _hold(scheduler, PRIORITY_CHAT, order, "next chat", max_wait=0.05)
+
+    asyncio.run(run())
+    assert order == ["blocker", "next chat"]
+    assert scheduler.stats()["priorities"]["chat"]["timed_out"] == 1
+    assert scheduler.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        blocker = asyncio.ensure_future(_hold(scheduler, PRIORITY_CHAT, order, "blocker", release))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(_hold(scheduler, PRIORITY_CHAT, order, "cancelled"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await blocker
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(_hold(scheduler, PRIORITY_CHAT, order, "next"), timeout=1)
+
+    asyncio.run(run())
+    assert order == ["blocker", "next"]
+    assert scheduler.in_flight == 0
+
+
+def test_unbounded_concurrency_admits_every_call():
+    scheduler = LLMScheduler(max_concurrency=None)
+
+    async def run():
+        release = asyncio.Event()
+        order = []
+        calls = [asyncio.ensure_future(_hold(scheduler, PRIORITY_CHAT, order, i, release)) for i in range(200)]
+        await asyncio.sleep(0.01)
+        assert scheduler.in_flight == 200
+        release.set()
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+
+
+def test_tokens_per_minute_delays_admission():
+    # 6000 tokens a minute refill 100 a second: the second call waits ~0.5s
+    scheduler = LLMScheduler(tokens_per_minute=6000)
+    order = []
+
+    async def run():
+        await _hold(scheduler, PRIORITY_CHAT, order, "first", tokens=6000)
+        with pytest.raises(SchedulerTimeout):
+            await _hold(scheduler, PRIORITY_CHAT, order, "too early", tokens=50, max_wait=0.1)
+        await _hold(scheduler, PRIORITY_CHAT, order, "second", tokens=50, max_wait=1)
+
+    asyncio.run(run())
+    assert order == ["first", "second"]
+
+
+def test_token_bucket_caps_oversized_requests():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(1000) == 0.0
+    bucket.take(1000)
+    # Drained rather than overdrawn, so a refill of one unit takes about a second
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
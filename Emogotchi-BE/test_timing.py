@@ -0,0 +1,39 @@
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from utils.timing import ServerTimingMiddleware, StageTimer
+
+app = FastAPI()
+app.add_middleware(ServerTimingMiddleware)
+
+
+@app.get("/timed/{status}")
+async def timed(status: int):
+    timer = StageTimer("test")
+    try:
+        with timer.stage("lookup"):
+            pass
+        if status != 200:
+            raise HTTPException(status_code=status, detail="failed")
+        return {"ok": True}
+    finally:
+        timer.finish()
+
+
+@app.get("/untimed")
+async def untimed():
+    return {"ok": True}
+
+
+def test_server_timing_on_success_and_http_errors():
+    client = TestClient(app)
+    for status in (200, 404, 500):
+        response = client.get(f"/timed/{status}")
+        assert response.status_code == status
+        header = response.headers["server-timing"]
+        assert header.startswith("lookup;dur=")
+        assert "total;dur=" in header
+
+
+def test_no_server_timing_without_a_timer():
+    assert "server-timing" not in TestClient(app).get("/untimed").headers
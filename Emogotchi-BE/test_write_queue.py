@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+from utils.user_cache import user_cache
+from utils.write_queue import BackgroundWriter, BatchingWriter
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table, op, payload):
+        self.client = client
+        self.call = [table, op, payload, {}]
+
+    def eq(self, column, value):
+        self.call[3][column] = value
+        return self
+
+    def execute(self):
+        time.sleep(self.client.latency)
+        self.client.calls.append(tuple(self.call))
+        return _Result(self.client.rpc_result if self.call[1] == "rpc" else [])
+
+
+class _Table:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def insert(self, payload):
+        return _Query(self.client, self.name, "insert", payload)
+
+    def update(self, payload):
+        return _Query(self.client, self.name, "update", payload)
+
+
+class FakeClient:
+    """
+    Records the writes the BackgroundWriter executes, each taking ``latency`` seconds.
+    """
+
+    def __init__(self, latency: float = 0.0, rpc_result=None):
+        self.latency = latency
+        self.rpc_result = rpc_result
+        self.calls = []
+
+    def table(self, name):
+        return _Table(self, name)
+
+    def rpc(self, name, params):
+        return _Query(self, name, "rpc", params)
+
+
+def test_flush_latency_covers_the_database_write():
+    client = FakeClient(latency=0.05)
+    batching = BatchingWriter(BackgroundWriter(client, workers=1), flush_interval=60)
+
+    async def run():
+        batching.add_chat({"uuid": "u1", "user_input": "hi", "chat_output": "hello"})
+        batching.add_chat({"uuid": "u1", "user_input": "again", "chat_output": "hello again"})
+        batching.flush()
+        await batching.stop()
+        await batching.writer.stop()
+
+    asyncio.run(run())
+    stats = batching.stats()
+    assert len(client.calls) == 1
+    assert stats["flushes"] == 1 and stats["last_batch_size"] == 2
+    # Handed over right away, so the latency is the insert itself
+    assert stats["avg_flush_latency"] >= 0.05
+    assert batching.landed_flushes == 1
+
+
+def test_point_deltas_are_summed_into_one_increment():
+    client = FakeClient(rpc_result=10)
+    batching = BatchingWriter(BackgroundWriter(client, workers=1), flush_interval=60)
+
+    async def run():
+        batching.add_points("u1", 2)
+        batching.add_points("u1", 3, {"animal_emotion": "happy"})
+        batching.add_points("u1", 1, {"animal_emotion": "sad", "is_notified": True})
+        batching.add_points("u2", 4)
+        batching.add_points("u3", 0, {"animal_type": "dog"})
+        assert batching.pending() == 3
+        batching.flush()
+        await batching.stop()
+        await batching.writer.stop()
+
+    asyncio.run(run())
+    rpcs = sorted((call for call in client.calls if call[1] == "rpc"), key=lambda call: call[2]["user_uuid"])
+    updates = sorted((call for call in client.calls if call[1] == "update"), key=lambda call: call[3]["uuid"])
+    assert rpcs == [
+        ("increment_user_points", "rpc", {"user_uuid": "u1", "delta": 6}, {}),
+        ("increment_user_points", "rpc", {"user_uuid": "u2", "delta": 4}, {})
+    ]
+    # Other fields are last-write-wins, and a zero delta sends no increment
+    assert updates == [
+        ("User", "update", {"animal_emotion": "sad", "is_notified": True}, {"uuid": "u1"}),
+        ("User", "update", {"animal_type": "dog"}, {"uuid": "u3"})
+    ]
+
+
+def test_applied_points_refresh_the_cache_with_pending_deltas():
+    client = FakeClient(latency=0.05, rpc_result=105)
+    batching = BatchingWriter(BackgroundWriter(client, workers=1), flush_interval=60)
+    user_cache.put("points-user", {"uuid": "points-user", "points": 0})
+
+    async def run():
+        batching.add_points("points-user", 5)
+        batching.flush()
+        # Arrives while the increment is still running: part of the next flush
+        batching.add_points("points-user", 4)
+        await batching.writer.stop()
+        assert user_cache.get("points-user")["points"] == 109
+        await batching.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        user_cache.invalidate("points-user")
+
+
+def test_failed_increment_invalidates_the_cached_row():
+    client = FakeClient(rpc_result=None)
+    batching = BatchingWriter(BackgroundWriter(client, workers=1), flush_interval=60)
+    user_cache.put("missing-user", {"uuid": "missing-user", "points": 3})
+
+    async def run():
+        batching.add_points("missing-user", 1)
+        batching.flush()
+        await batching.writer.stop()
+
+    asyncio.run(run())
+    assert user_cache.get("missing-user") is None
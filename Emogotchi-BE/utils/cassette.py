@@ -0,0 +1,220 @@
+"""
+Record/replay of outgoing HTTP traffic (OpenAI and Supabase PostgREST).
+
+CASSETTE_MODE=record passes requests through and appends every exchange to a
+gzip-compressed JSON-lines cassette (CASSETTE_PATH). CASSETTE_MODE=replay
+serves responses from the cassette without touching the network, waiting
+either the recorded latency or CASSETTE_LATENCY_MS when set.
+
+Requests are matched on method, path, query and a hash of the body. Bodies
+that change between runs (e.g. timestamps in Chat inserts) fall back to the
+responses recorded for the same method, path and query, in order. Entries
+are reused round-robin, so a short recording can drive a long benchmark.
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Headers that describe the wire encoding of the original body, which is
+# stored decoded
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMiss(Exception):
+    """
+    Raised in replay mode for a request the cassette has no response for.
+    """
+
+
+def _body_hash(content: bytes) -> str:
+    try:
+        # Normalize JSON so key order doesn't change the match
+        content = json.dumps(json.loads(content), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def _route(request: httpx.Request) -> str:
+    query = request.url.query.decode() if isinstance(request.url.query, bytes) else request.url.query
+    return f"{request.method} {request.url.path}?{query}"
+
+
+class Cassette:
+    """
+    An on-disk list of recorded HTTP exchanges.
+    """
+
+    def __init__(self, path: str, mode: str, latency: Optional[float] = None):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._exact: Dict[str, List[dict]] = defaultdict(list)
+        self._loose: Dict[str, List[dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._exact[f"{entry['route']} {entry['body_hash']}"].append(entry)
+                self._loose[entry["route"]].append(entry)
+        logger.info(f"Loaded {sum(len(v) for v in self._loose.values())} exchanges from cassette {self.path}")
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes, elapsed: float) -> None:
+        entry = {
+            "route": _route(request),
+            "body_hash": _body_hash(request.content),
+            "status": response.status_code,
+            "headers": [[k, v] for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS],
+            "latency": round(elapsed, 4)
+        }
+        try:
+            entry["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(content).decode()
+
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Each append is its own gzip member; gzip.open reads them back as one stream
+            with gzip.open(self.path, "at") as f:
+                f.write(line)
+            self.recorded += 1
+
+    def _next(self, key: str, entries: List[dict]) -> dict:
+        position = self._positions[key]
+        self._positions[key] = position + 1
+        return entries[position % len(entries)]
+
+    def match(self, request: httpx.Request) -> dict:
+        route = _route(request)
+        exact_key = f"{route} {_body_hash(request.content)}"
+        with self._lock:
+            if exact_key in self._exact:
+                entry = self._next(exact_key, self._exact[exact_key])
+            elif route in self._loose:
+                entry = self._next(route, self._loose[route])
+            else:
+                self.misses += 1
+                raise CassetteMiss(f"No recorded response for {route}")
+            self.replayed += 1
+        return entry
+
+    def delay(self, entry: dict) -> float:
+        return entry["latency"] if self.latency is None else self.latency
+
+    @staticmethod
+    def build_response(entry: dict, request: httpx.Request) -> httpx.Response:
+        content = base64.b64decode(entry["body_b64"]) if "body_b64" in entry else entry["body"].encode("utf-8")
+        return httpx.Response(entry["status"], headers=entry["headers"], content=content, request=request)
+
+    def stats(self) -> Dict[str, int]:
+        return {"recorded": self.recorded, "replayed": self.replayed, "misses": self.misses}
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    Sync transport that records through ``inner`` or replays from the cassette.
+    """
+
+    def __init__(self, cassette: Cassette, inner: Optional[httpx.BaseTransport] = None):
+        self.cassette = cassette
+        self.inner = inner or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.cassette.mode == "replay":
+            request.read()
+            entry = self.cassette.match(request)
+            time.sleep(self.cassette.delay(entry))
+            return self.cassette.build_response(entry, request)
+
+        start_time = time.perf_counter()
+        response = self.inner.handle_request(request)
+        content = response.read()
+        elapsed = time.perf_counter() - start_time
+        response.close()
+        self.cassette.record(request, response, content, elapsed)
+        return httpx.Response(
+            response.status_code,
+            headers=[(k, v) for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS],
+            content=content,
+            request=request
+        )
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport that records through ``inner`` or replays from the cassette.
+    """
+
+    def __init__(self, cassette: Cassette, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.cassette = cassette
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.cassette.mode == "replay":
+            await request.aread()
+            entry = self.cassette.match(request)
+            await asyncio.sleep(self.cassette.delay(entry))
+            return self.cassette.build_response(entry, request)
+
+        start_time = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        content = await response.aread()
+        elapsed = time.perf_counter() - start_time
+        await response.aclose()
+        # The file write is small; keep it off the loop anyway
+        await asyncio.to_thread(self.cassette.record, request, response, content, elapsed)
+        return httpx.Response(
+            response.status_code,
+            headers=[(k, v) for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS],
+            content=content,
+            request=request
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def create_cassette() -> Optional[Cassette]:
+    """
+    Build the cassette selected by CASSETTE_MODE ("off", "record" or "replay").
+    """
+    mode = os.getenv("CASSETTE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown CASSETTE_MODE: {mode}")
+    latency_ms = os.getenv("CASSETTE_LATENCY_MS")
+    path = os.getenv("CASSETTE_PATH", "cassettes/session.jsonl.gz")
+    logger.info(f"Cassette {mode} mode using {path}")
+    return Cassette(path, mode, latency=float(latency_ms) / 1000 if latency_ms else None)
+
+
+cassette = create_cassette()
@@ -0,0 +1,108 @@
+import json
+import re
+from typing import Optional, Tuple
+
+# Marker that starts the scoring suffix of a "gpt: ... points: N" reply
+POINTS_MARKER = "points:"
+GPT_PREFIX = "gpt:"
+
+# Points awarded when the suffix is missing or unparseable
+DEFAULT_POINTS = 2
+
+
+class PointsSuffixParser:
+    """
+    Incremental parser for streamed ``gpt: {reply} points: {int}`` completions.
+
+    feed() returns the part of the reply that is safe to forward to the client,
+    dropping the leading ``gpt:`` tag and holding back anything that might be the
+    start of the trailing ``points:`` suffix. finish() flushes the rest and
+    returns the parsed points.
+    """
+
+    def __init__(self):
+        self._buffer = ""  # Text received but not yet forwarded
+        self._suffix: Optional[str] = None  # Text after the points marker
+        self._prefix_checked = False
+        self._emitted = []
+
+    @property
+    def text(self) -> str:
+        """The reply text forwarded so far."""
+        return "".join(self._emitted)
+
+    def _emit(self, text: str) -> str:
+        if text:
+            self._emitted.append(text)
+        return text
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a streamed delta.
+
+        Returns:
+            str: Reply text that can be forwarded now (may be empty)
+        """
+        if self._suffix is not None:
+            self._suffix += chunk
+            return ""
+
+        self._buffer += chunk
+
+        # Drop leading whitespace until the first character is forwarded
+        if not self._emitted:
+            self._buffer = self._buffer.lstrip()
+
+        # Strip the "gpt:" tag once enough text has arrived to decide
+        if not self._prefix_checked:
+            if len(self._buffer) < len(GPT_PREFIX) and GPT_PREFIX.startswith(self._buffer.lower()):
+                return ""
+            if self._buffer.lower().startswith(GPT_PREFIX):
+                self._buffer = self._buffer[len(GPT_PREFIX):].lstrip()
+            self._prefix_checked = True
+
+        lower = self._buffer.lower()
+        marker_index = lower.find(POINTS_MARKER)
+        if marker_index != -1:
+            self._suffix = self._buffer[marker_index + len(POINTS_MARKER):]
+            text = self._buffer[:marker_index].rstrip()
+            self._buffer = ""
+            return self._emit(text)
+
+        # Hold back a tail that could still grow into the points marker
+        hold = 0
+        for size in range(min(len(POINTS_MARKER) - 1, len(lower)), 0, -1):
+            if POINTS_MARKER.startswith(lower[-size:]):
+                hold = size
+                break
+        safe = self._buffer[:len(self._buffer) - hold]
+
+        # Hold back trailing whitespace too, the reply is stripped before the suffix
+        text = safe.rstrip()
+        self._buffer = self._buffer[len(text):]
+        return self._emit(text)
+
+    def finish(self) -> Tuple[str, int]:
+        """
+        Flush the stream.
+
+        Returns:
+            Tuple[str, int]: Remaining reply text and the parsed points (0-5)
+        """
+        tail = ""
+        if self._suffix is None:
+            tail = self._emit(self._buffer.strip() if not self._emitted else self._buffer.rstrip())
+            self._buffer = ""
+
+        points = DEFAULT_POINTS
+        points_match = re.match(r'\s*(\d+)', self._suffix or "")
+        if points_match:
+            points = max(0, min(int(points_match.group(1)), 5))
+        return tail, points
+
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Format a server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
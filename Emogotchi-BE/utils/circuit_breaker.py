@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, Type, TypeVar
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling upstream while a circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Error-rate and slow-call circuit breaker with half-open probing and
+    optional hedged requests.
+
+    The breaker looks at the last ``window_size`` calls. Once at least
+    ``min_calls`` are recorded and the share of failures reaches
+    ``failure_rate`` (or the share of calls slower than ``slow_call_seconds``
+    reaches ``slow_call_rate``), it opens and rejects calls for
+    ``open_seconds``. After that it lets ``half_open_probes`` calls through:
+    a success closes it again, a failure re-opens it.
+
+    With ``hedge`` enabled, a call still running after the observed p95
+    latency gets a second identical request, and whichever answers first wins.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 4.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        hedge: bool = False,
+        hedge_min_samples: int = 20,
+        ignored_exceptions: Tuple[Type[BaseException], ...] = ()
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.ignored_exceptions = ignored_exceptions
+        self.state = CLOSED
+        self.rejected = 0
+        self.opened = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        # (failed, slow) per recent call
+        self._outcomes: deque = deque(maxlen=window_size)
+        self._latencies: deque = deque(maxlen=200)
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def check(self) -> None:
+        """
+        Raise CircuitOpenError if a call would be rejected right now, without
+        admitting one. Lets callers fail fast before queueing for an LLM slot.
+        """
+        if self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds:
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        if self.state == HALF_OPEN and self._probes >= self.half_open_probes:
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit {self.name} is half-open and already probing")
+
+    def _acquire(self) -> bool:
+        """
+        Admit a call, returning whether it is a half-open probe.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit {self.name} is open")
+            self.state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit {self.name} half-open, probing upstream")
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit {self.name} is half-open and already probing")
+            self._probes += 1
+            return True
+        return False
+
+    def _release(self, probe: bool) -> None:
+        # The call ended without telling us anything about upstream health
+        if probe and self.state == HALF_OPEN:
+            self._probes -= 1
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        self._outcomes.clear()
+
+    def _record(self, latency: float, failed: bool, probe: bool) -> None:
+        slow = latency >= self.slow_call_seconds
+        if not failed:
+            self._latencies.append(latency)
+
+        if probe:
+            if self.state != HALF_OPEN:
+                return
+            self._probes -= 1
+            if failed or slow:
+                logger.warning(f"Circuit {self.name} probe failed, re-opening")
+                self._open()
+            else:
+                logger.info(f"Circuit {self.name} closed")
+                self.state = CLOSED
+            return
+
+        self._outcomes.append((failed, slow))
+        calls = len(self._outcomes)
+        if self.state != CLOSED or calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, slow in self._outcomes if slow)
+        if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+            logger.warning(
+                f"Circuit {self.name} opened: {failures}/{calls} failed, {slow_calls}/{calls} slow"
+            )
+            self._open()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Run the block as one upstream call, raising CircuitOpenError up front
+        if the circuit doesn't allow it.
+        """
+        probe = self._acquire()
+        start_time = time.monotonic()
+        try:
+            yield
+        except self.ignored_exceptions:
+            self._release(probe)
+            raise
+        except Exception:
+            self._record(time.monotonic() - start_time, True, probe)
+            raise
+        except BaseException:
+            # Cancelled, typically by the caller's own timeout. A call given up
+            # on after the slow-call threshold is what a hung upstream looks
+            # like, so it counts as failed; earlier cancellations say nothing
+            latency = time.monotonic() - start_time
+            if latency >= self.slow_call_seconds:
+                self._record(latency, True, probe)
+            else:
+                self._release(probe)
+            raise
+        else:
+            self._record(time.monotonic() - start_time, False, probe)
+
+    def p95(self) -> Optional[float]:
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    async def call(self, create: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run create() through the breaker, hedging it if enabled.
+        """
+        async with self.guard():
+            if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+                return await create()
+            return await self._hedged(create, self.p95())
+
+    async def _hedged(self, create: Callable[[], Awaitable[T]], hedge_after: float) -> T:
+        first = asyncio.ensure_future(create())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            logger.info(f"Hedging {self.name} call after {hedge_after:.2f} seconds")
+            pending.add(asyncio.ensure_future(create()))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Drop the slower request
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, object]:
+        calls = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "failure_rate": sum(1 for failed, _ in self._outcomes if failed) / calls if calls else 0.0,
+            "p95": self.p95(),
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins
+        }
+
+
+def _setting(call_type: str, key: str, default: str) -> str:
+    # CIRCUIT_<CALL_TYPE>_<KEY> overrides CIRCUIT_<KEY>
+    return os.getenv(f"CIRCUIT_{call_type.upper()}_{key}", os.getenv(f"CIRCUIT_{key}", default))
+
+
+def _create_breaker(call_type: str, slow_call_seconds: float) -> CircuitBreaker:
+    return CircuitBreaker(
+        call_type,
+        window_size=int(_setting(call_type, "WINDOW_SIZE", "20")),
+        min_calls=int(_setting(call_type, "MIN_CALLS", "10")),
+        failure_rate=float(_setting(call_type, "ERROR_RATE", "0.5")),
+        slow_call_seconds=float(_setting(call_type, "SLOW_CALL_SECONDS", str(slow_call_seconds))),
+        slow_call_rate=float(_setting(call_type, "SLOW_CALL_RATE", "0.8")),
+        open_seconds=float(_setting(call_type, "OPEN_SECONDS", "30")),
+        hedge=_setting(call_type, "HEDGE", "false").lower() == "true"
+    )
+
+
+# One breaker per LLM call type, so a slow diary model can't trip chat replies
+breakers: Dict[str, CircuitBreaker] = {
+    "chat_reply": _create_breaker("chat_reply", slow_call_seconds=4.0),
+    "admin_analysis": _create_breaker("admin_analysis", slow_call_seconds=4.0),
+    "animal_selection": _create_breaker("animal_selection", slow_call_seconds=4.0),
+    "diary": _create_breaker("diary", slow_call_seconds=20.0)
+}
+
+
+def get_breaker(call_type: str) -> CircuitBreaker:
+    return breakers[call_type]
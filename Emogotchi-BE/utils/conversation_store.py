@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from utils.history import HistoryWindow, trim_to_token_budget
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class ConversationStore(ABC):
+    """
+    Per-user conversation state for /chat: the exchange counter that drives the
+    4th-message animal assignment and the history sent to the admin analysis.
+
+    Async code goes through ``call`` so stores that do I/O keep it off the
+    event loop, e.g. ``await store.call(store.increment_count, user_uuid)``.
+    """
+
+    async def call(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run one of the store's methods from async code."""
+        return fn(*args)
+
+    def close(self) -> None:
+        """Release the store's resources."""
+
+    @abstractmethod
+    def get_count(self, user_uuid: str) -> int:
+        """Return the number of exchanges recorded for the user."""
+
+    @abstractmethod
+    def increment_count(self, user_uuid: str) -> int:
+        """Atomically add one exchange and return the new count."""
+
+    @abstractmethod
+    def get_history(self, user_uuid: str) -> List[Dict[str, str]]:
+        """Return the user's messages as chat-completion dicts, oldest first."""
+
+    def get_window(self, user_uuid: str, token_budget: int) -> List[Dict[str, str]]:
+        """Return the newest messages that fit in token_budget, oldest first."""
+        return trim_to_token_budget(self.get_history(user_uuid), token_budget)
+
+    @abstractmethod
+    def append_message(self, user_uuid: str, role: str, content: str) -> None:
+        """Add a message to the user's history, dropping the oldest beyond the caps."""
+
+    @abstractmethod
+    def reset_history(self, user_uuid: str) -> None:
+        """Clear the user's history but keep the exchange counter."""
+
+    @abstractmethod
+    def user_count(self) -> int:
+        """Return the number of users with stored state."""
+
+    @abstractmethod
+    def message_count(self) -> int:
+        """Return the number of messages held across all users' histories."""
+
+
+class _ConversationState:
+    __slots__ = ("count", "history", "last_seen")
+
+    def __init__(self, max_messages: int, max_tokens: int):
+        self.count = 0
+        self.history = HistoryWindow(max_messages=max_messages, max_tokens=max_tokens)
+        self.last_seen = time.monotonic()
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Process-local store with LRU eviction and an idle TTL.
+
+    Only safe for a single worker; use SQLiteConversationStore to share state.
+    """
+
+    def __init__(
+        self,
+        max_users: int = 10000,
+        ttl_seconds: float = 604800,
+        max_messages: int = 20,
+        max_tokens: int = 2000
+    ):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._states: "OrderedDict[str, _ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float) -> None:
+        # Entries are kept in access order, so expired ones are at the front
+        while self._states:
+            user_uuid, state = next(iter(self._states.items()))
+            if now - state.last_seen < self.ttl_seconds:
+                break
+            del self._states[user_uuid]
+
+    def _get(self, user_uuid: str, create: bool) -> Optional[_ConversationState]:
+        now = time.monotonic()
+        self._evict_expired(now)
+        state = self._states.get(user_uuid)
+        if state is None:
+            if not create:
+                return None
+            state = _ConversationState(self.max_messages, self.max_tokens)
+            self._states[user_uuid] = state
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(user_uuid)
+        state.last_seen = now
+        return state
+
+    def get_count(self, user_uuid: str) -> int:
+        with self._lock:
+            state = self._get(user_uuid, create=False)
+            return state.count if state else 0
+
+    def increment_count(self, user_uuid: str) -> int:
+        with self._lock:
+            state = self._get(user_uuid, create=True)
+            state.count += 1
+            return state.count
+
+    def get_history(self, user_uuid: str) -> List[Dict[str, str]]:
+        with self._lock:
+            state = self._get(user_uuid, create=False)
+            return state.history.messages() if state else []
+
+    def get_window(self, user_uuid: str, token_budget: int) -> List[Dict[str, str]]:
+        with self._lock:
+            state = self._get(user_uuid, create=False)
+            return state.history.window(token_budget) if state else []
+
+    def append_message(self, user_uuid: str, role: str, content: str) -> None:
+        with self._lock:
+            self._get(user_uuid, create=True).history.append(role, content)
+
+    def reset_history(self, user_uuid: str) -> None:
+        with self._lock:
+            state = self._get(user_uuid, create=False)
+            if state:
+                state.history.clear()
+
+    def user_count(self) -> int:
+        with self._lock:
+            return len(self._states)
+
+    def message_count(self) -> int:
+        with self._lock:
+            return sum(len(state.history) for state in self._states.values())
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite (WAL) store that several uvicorn workers on one host can share and
+    that survives restarts. The counter is incremented with a single
+    INSERT ... ON CONFLICT ... RETURNING statement so concurrent workers never
+    hand out the same count twice.
+
+    Calls made through ``call`` run on the store's own threads: a worker
+    waiting up to busy_timeout for another worker's write lock must not stall
+    the event loop.
+    """
+
+    # Purge idle users every this many increments
+    PURGE_EVERY = 1000
+
+    def __init__(
+        self,
+        path: str = "conversation_state.db",
+        ttl_seconds: float = 604800,
+        max_messages: int = 20,
+        max_tokens: int = 2000,
+        workers: int = 4
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conversation-db")
+        self._increments = 0
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversation_counts (
+                    uuid TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS conversation_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uuid TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_conversation_messages_uuid
+                    ON conversation_messages (uuid, id);
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    async def call(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def get_count(self, user_uuid: str) -> int:
+        row = self._connection().execute(
+            "SELECT count, updated_at FROM conversation_counts WHERE uuid = ?", (user_uuid,)
+        ).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl_seconds:
+            return 0
+        return row[0]
+
+    def increment_count(self, user_uuid: str) -> int:
+        now = time.time()
+        conn = self._connection()
+        # An idle user restarts from 1, the same as an evicted in-memory entry
+        row = conn.execute(
+            """
+            INSERT INTO conversation_counts (uuid, count, updated_at) VALUES (?, 1, ?)
+            ON CONFLICT (uuid) DO UPDATE SET
+                count = CASE WHEN ? - updated_at >= ? THEN 1 ELSE count + 1 END,
+                updated_at = excluded.updated_at
+            RETURNING count
+            """,
+            (user_uuid, now, now, self.ttl_seconds)
+        ).fetchone()
+        if row[0] == 1:
+            # A restarted count drops the history too, which an expired
+            # in-memory entry loses along with its count
+            self.reset_history(user_uuid)
+
+        self._increments += 1
+        if self._increments % self.PURGE_EVERY == 0:
+            self.purge_expired()
+        return row[0]
+
+    def get_history(self, user_uuid: str) -> List[Dict[str, str]]:
+        rows = self._connection().execute(
+            "SELECT role, content FROM conversation_messages WHERE uuid = ? ORDER BY id",
+            (user_uuid,)
+        ).fetchall()
+        # Apply the token cap on read; the message cap is enforced on write
+        messages = [{"role": role, "content": content} for role, content in rows]
+        return trim_to_token_budget(messages, self.max_tokens)
+
+    def append_message(self, user_uuid: str, role: str, content: str) -> None:
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO conversation_messages (uuid, role, content, created_at) VALUES (?, ?, ?, ?)",
+            (user_uuid, role, content, time.time())
+        )
+        # Keep only the newest max_messages rows for the user
+        conn.execute(
+            """
+            DELETE FROM conversation_messages WHERE uuid = ? AND id NOT IN (
+                SELECT id FROM conversation_messages WHERE uuid = ? ORDER BY id DESC LIMIT ?
+            )
+            """,
+            (user_uuid, user_uuid, self.max_messages)
+        )
+
+    def reset_history(self, user_uuid: str) -> None:
+        self._connection().execute(
+            "DELETE FROM conversation_messages WHERE uuid = ?", (user_uuid,)
+        )
+
+    def user_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM conversation_counts").fetchone()[0]
+
+    def message_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM conversation_messages").fetchone()[0]
+
+    def purge_expired(self) -> None:
+        """
+        Delete state for users idle longer than the TTL.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM conversation_messages WHERE uuid IN "
+            "(SELECT uuid FROM conversation_counts WHERE updated_at < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM conversation_counts WHERE updated_at < ?", (cutoff,))
+
+
+def create_conversation_store() -> ConversationStore:
+    """
+    Build the conversation store selected by the CONVERSATION_STORE env var
+    ("memory" or "sqlite").
+    """
+    backend = os.getenv("CONVERSATION_STORE", "memory").lower()
+    ttl_seconds = float(os.getenv("CONVERSATION_TTL_SECONDS", "604800"))
+    max_messages = int(os.getenv("CONVERSATION_MAX_MESSAGES", "20"))
+    max_tokens = int(os.getenv("CONVERSATION_MAX_TOKENS", "2000"))
+
+    if backend == "sqlite":
+        path = os.getenv("CONVERSATION_DB_PATH", "conversation_state.db")
+        logger.info(f"Using SQLite conversation store at {path}")
+        return SQLiteConversationStore(
+            path=path,
+            ttl_seconds=ttl_seconds,
+            max_messages=max_messages,
+            max_tokens=max_tokens,
+            workers=int(os.getenv("CONVERSATION_DB_WORKERS", "4"))
+        )
+
+    if backend != "memory":
+        logger.warning(f"Unknown CONVERSATION_STORE '{backend}', using in-memory store")
+    max_users = int(os.getenv("CONVERSATION_MAX_USERS", "10000"))
+    return InMemoryConversationStore(
+        max_users=max_users,
+        ttl_seconds=ttl_seconds,
+        max_messages=max_messages,
+        max_tokens=max_tokens
+    )
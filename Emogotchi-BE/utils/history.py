@@ -0,0 +1,91 @@
+import sys
+from collections import deque
+from typing import Dict, Iterable, List
+
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English text).
+    """
+    return len(text) // 4 + MESSAGE_TOKEN_OVERHEAD
+
+
+class ChatTurn:
+    """
+    Compact history record. Roles are interned so every turn shares the same
+    "user"/"assistant" string objects.
+    """
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+    def as_message(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class HistoryWindow:
+    """
+    Per-user ring buffer capped by message count and estimated token count.
+    Oldest turns are dropped first.
+    """
+
+    __slots__ = ("_turns", "max_tokens", "total_tokens")
+
+    def __init__(self, max_messages: int = 20, max_tokens: int = 2000):
+        self._turns = deque(maxlen=max_messages)
+        self.max_tokens = max_tokens
+        self.total_tokens = 0
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def append(self, role: str, content: str) -> None:
+        if len(self._turns) == self._turns.maxlen:
+            # deque drops the oldest turn itself, keep the token total in step
+            self.total_tokens -= self._turns[0].tokens
+        turn = ChatTurn(role, content)
+        self._turns.append(turn)
+        self.total_tokens += turn.tokens
+
+        # Always keep the newest turn even if it alone exceeds the cap
+        while self.total_tokens > self.max_tokens and len(self._turns) > 1:
+            self.total_tokens -= self._turns.popleft().tokens
+
+    def clear(self) -> None:
+        self._turns.clear()
+        self.total_tokens = 0
+
+    def messages(self) -> List[Dict[str, str]]:
+        return [turn.as_message() for turn in self._turns]
+
+    def window(self, token_budget: int) -> List[Dict[str, str]]:
+        """
+        Return the newest turns that fit in token_budget, oldest first.
+        """
+        return trim_to_token_budget(self.messages(), token_budget)
+
+
+def trim_to_token_budget(messages: Iterable[Dict[str, str]], token_budget: int) -> List[Dict[str, str]]:
+    """
+    Keep the most recent messages whose estimated tokens fit in token_budget.
+
+    Returns:
+        List[Dict]: The kept messages, oldest first
+    """
+    kept = []
+    used = 0
+    for message in reversed(list(messages)):
+        tokens = estimate_tokens(message["content"])
+        if used + tokens > token_budget:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return kept
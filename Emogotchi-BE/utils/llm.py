@@ -1,5 +1,265 @@
-async def get_llm_response(message: str) -> str:
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from config.llm_profiles import LLMProfile
+from utils.history import estimate_tokens
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Usage:
     """
-    Mock LLM response function. In a real implementation, this would call OpenAI or Anthropic.
+    Token usage of a completion, shaped like the OpenAI ``usage`` block.
     """
-    return f"Mock response to: {message}" 
\ No newline at end of file
+
+    __slots__ = ("prompt_tokens", "completion_tokens", "prompt_tokens_details")
+
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.prompt_tokens_details = None
+
+
+class Completion:
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text: str, usage: Any = None):
+        self.text = text
+        self.usage = usage
+
+
+class LLMBackend(ABC):
+    """
+    Where chat completions come from. Callers pass an LLM profile (model,
+    token cap, temperature, stop sequences, timeout) and the messages.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def complete(
+        self,
+        profile: LLMProfile,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]] = None
+    ) -> Completion:
+        """Return the full completion."""
+
+    @abstractmethod
+    def stream(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Yield content deltas as they are generated."""
+
+    @abstractmethod
+    def complete_sync(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> Completion:
+        """Blocking variant of complete() for the legacy sync helpers."""
+
+    async def close(self) -> None:
+        """Release pooled connections."""
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Chat completions from the OpenAI API through the shared clients.
+    """
+
+    name = "openai"
+
+    def __init__(self, client, async_client):
+        self.client = client
+        self.async_client = async_client
+
+    @staticmethod
+    def _options(profile: LLMProfile, response_format: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        # Only send optional parameters when set, so plain calls stay unchanged
+        options = {
+            "model": profile.model,
+            "max_tokens": profile.max_tokens,
+            "temperature": profile.temperature,
+            "timeout": profile.timeout
+        }
+        if profile.stop:
+            options["stop"] = profile.stop
+        if response_format:
+            options["response_format"] = response_format
+        return options
+
+    async def complete(
+        self,
+        profile: LLMProfile,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]] = None
+    ) -> Completion:
+        response = await self.async_client.chat.completions.create(
+            messages=messages, **self._options(profile, response_format)
+        )
+        return Completion(response.choices[0].message.content, response.usage)
+
+    async def stream(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        stream = await self.async_client.chat.completions.create(
+            messages=messages, stream=True, **self._options(profile)
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    def complete_sync(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> Completion:
+        response = self.client.chat.completions.create(messages=messages, **self._options(profile))
+        return Completion(response.choices[0].message.content, response.usage)
+
+    async def close(self) -> None:
+        await self.async_client.close()
+
+
+class LocalLLMError(Exception):
+    """
+    Error injected by the local backend.
+    """
+
+
+EMOTIONS = ["happy", "sad", "angry", "anxious", "neutral"]
+ANIMAL_FOR_EMOTION = {"happy": "hamster", "sad": "penguin", "angry": "tiger", "anxious": "pig", "neutral": "dog"}
+REPLIES = [
+    "That sounds like a lot to carry. What part of it weighs on you the most?",
+    "Thank you for telling me. How did you feel when that happened?",
+    "It makes sense that you feel this way. What would help you right now?",
+    "I'm glad you shared that with me. What do you think is behind that feeling?",
+    "That must have been hard. Have you been able to talk to anyone about it?"
+]
+
+
+class LocalBackend(LLMBackend):
+    """
+    Offline stand-in for the OpenAI API.
+
+    Answers are deterministic for the same messages and follow the format
+    each profile's parser expects: ``gpt: ... points: N`` for chat replies,
+    ``emotion: X, animal: Y`` for the admin analysis, a bare animal for
+    animal selection, a JSON object for the combined analysis and
+    ``diary: ...`` / ``emotion: ...`` for diaries.
+
+    Latency is ``latency`` seconds plus up to ``jitter`` seconds, capped by the
+    profile's timeout (which then raises TimeoutError), and a share
+    ``error_rate`` of calls raises LocalLLMError.
+    """
+
+    name = "local"
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seed(messages: List[Dict[str, str]]) -> int:
+        raw = json.dumps([[m["role"], m["content"]] for m in messages], separators=(",", ":"))
+        return int(hashlib.sha256(raw.encode()).hexdigest()[:12], 16)
+
+    def _plan(self) -> tuple[float, bool]:
+        # Injected latency and failure come from the backend's own RNG so
+        # identical requests don't all fail together
+        with self._lock:
+            latency = self.latency + self._random.random() * self.jitter
+            failed = self._random.random() < self.error_rate
+        return latency, failed
+
+    def _text(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> str:
+        seed = self._seed(messages)
+        emotion = EMOTIONS[seed % len(EMOTIONS)]
+        animal = ANIMAL_FOR_EMOTION[emotion]
+        reply = REPLIES[(seed >> 8) % len(REPLIES)]
+        points = (seed >> 16) % 6
+
+        if profile.name == "chat_reply":
+            return f"gpt: {reply} points: {points}"
+        if profile.name == "admin_analysis":
+            return f"emotion: {emotion}, animal: {animal}"
+        if profile.name == "animal_selection":
+            return animal
+        if profile.name == "combined_analysis":
+            return json.dumps({"reply": reply, "points": points, "emotion": emotion, "animal": animal})
+        if profile.name == "diary":
+            return (f"diary: Today I talked with my pet about how my day went. {reply.split('.')[0]}.\n"
+                    f"emotion: {emotion}")
+        return reply
+
+    def _usage(self, messages: List[Dict[str, str]], text: str) -> Usage:
+        return Usage(sum(estimate_tokens(m["content"] or "") for m in messages), estimate_tokens(text))
+
+    async def _wait(self, profile: LLMProfile, latency: float) -> None:
+        if profile.timeout is not None and latency > profile.timeout:
+            await asyncio.sleep(profile.timeout)
+            raise asyncio.TimeoutError(f"Local LLM call exceeded {profile.timeout} seconds")
+        await asyncio.sleep(latency)
+
+    async def complete(
+        self,
+        profile: LLMProfile,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]] = None
+    ) -> Completion:
+        latency, failed = self._plan()
+        await self._wait(profile, latency)
+        if failed:
+            raise LocalLLMError("Injected local LLM error")
+        text = self._text(profile, messages)
+        return Completion(text, self._usage(messages, text))
+
+    async def stream(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        latency, failed = self._plan()
+        # Spend a third of the latency before the first token, the rest across the tokens
+        await self._wait(profile, latency / 3)
+        if failed:
+            raise LocalLLMError("Injected local LLM error")
+        words = self._text(profile, messages).split(" ")
+        delay = latency * 2 / 3 / len(words)
+        for i, word in enumerate(words):
+            yield word if i == 0 else " " + word
+            await asyncio.sleep(delay)
+
+    def complete_sync(self, profile: LLMProfile, messages: List[Dict[str, str]]) -> Completion:
+        latency, failed = self._plan()
+        if profile.timeout is not None and latency > profile.timeout:
+            time.sleep(profile.timeout)
+            raise TimeoutError(f"Local LLM call exceeded {profile.timeout} seconds")
+        time.sleep(latency)
+        if failed:
+            raise LocalLLMError("Injected local LLM error")
+        text = self._text(profile, messages)
+        return Completion(text, self._usage(messages, text))
+
+
+def create_llm_backend(client=None, async_client=None) -> LLMBackend:
+    """
+    Build the backend selected by LLM_BACKEND ("openai" or "local").
+
+    Args:
+        client: Sync OpenAI client for the openai backend
+        async_client: Async OpenAI client for the openai backend
+    """
+    backend = os.getenv("LLM_BACKEND", "openai").lower()
+    if backend == "local":
+        logger.info("Using the local LLM backend")
+        return LocalBackend(
+            latency=float(os.getenv("LOCAL_LLM_LATENCY_MS", "200")) / 1000,
+            jitter=float(os.getenv("LOCAL_LLM_JITTER_MS", "50")) / 1000,
+            error_rate=float(os.getenv("LOCAL_LLM_ERROR_RATE", "0")),
+            seed=int(os.getenv("LOCAL_LLM_SEED", "0"))
+        )
+    if backend != "openai":
+        raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+    return OpenAIBackend(client, async_client)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+def temperature_class(temperature: float) -> str:
+    """
+    Bucket a sampling temperature so near-identical settings share cache entries.
+    """
+    if temperature <= 0:
+        return "greedy"
+    if temperature <= 0.5:
+        return "low"
+    return "high"
+
+
+# Result of an in-flight call whose caller was cancelled before it finished
+_ABANDONED = object()
+
+
+def _normalize(text: str) -> str:
+    # Collapse runs of whitespace so formatting-only differences still hit
+    return " ".join(text.split())
+
+
+class LLMResponseCache:
+    """
+    Exact-match cache of chat completion texts with LRU eviction and a TTL.
+
+    Keys are the normalized (model, messages, max_tokens, temperature class)
+    tuple. Identical requests that arrive while the first one is still in
+    flight wait for its result instead of calling the API again. If the
+    caller running the call is cancelled, the waiters run it again themselves.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        # Calls that joined an identical in-flight call instead of hitting the cache
+        self.shared = 0
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        normalized = [[message["role"], _normalize(message["content"] or "")] for message in messages]
+        raw = json.dumps([model, normalized, max_tokens, temperature_class(temperature)], separators=(",", ":"))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[str]]) -> str:
+        """
+        Return the cached text for key, or run create() once and cache its result.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # An identical call is already running; share its result
+            value = await asyncio.shield(inflight)
+            if value is not _ABANDONED:
+                self.shared += 1
+                return value
+            # Its caller was cancelled; look again, and run the call ourselves
+            # if no other waiter has started it
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await create()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled, e.g. by the caller's timeout. Waiters retry rather
+            # than inheriting a cancellation that wasn't theirs
+            future.set_result(_ABANDONED)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        self.put(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.shared + self.misses
+        return {
+            "hits": self.hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "size": len(self._entries),
+            # Share of lookups that didn't call the API
+            "hit_rate": (self.hits + self.shared) / total if total else 0.0
+        }
+
+
+llm_cache = LLMResponseCache(
+    max_size=int(os.getenv("LLM_CACHE_MAX_SIZE", "1000")),
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+)
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from utils.metrics import llm_scheduler_wait
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_CHAT = 0
+PRIORITY_DIARY = 1
+PRIORITY_BATCH = 2
+
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_DIARY: "diary", PRIORITY_BATCH: "batch"}
+
+
+class SchedulerTimeout(Exception):
+    """
+    Raised when a call waited longer than its max_wait for an LLM slot.
+    """
+
+
+class TokenBucket:
+    """
+    Refills continuously at ``per_minute`` units per minute, holding at most
+    one minute's worth.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until ``amount`` units are available (0 if they are now).
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        # Requests bigger than the bucket would never fit; let them drain it instead
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "future", "enqueued")
+
+    def __init__(self, priority: int, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Admission control for OpenAI calls shared by every call site.
+
+    Calls wait in one priority queue (chat ahead of diary ahead of batch) and
+    are admitted in order once the requests-per-minute and tokens-per-minute
+    buckets allow it and fewer than ``max_concurrency`` calls are in flight
+    (unbounded when None, leaving the cap to the HTTP connection pool).
+    A call that can't get a slot within its ``max_wait`` gets SchedulerTimeout,
+    so interactive callers fall back quickly instead of piling up behind a
+    rate limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 3500,
+        tokens_per_minute: float = 90000,
+        max_concurrency: Optional[int] = None
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {
+            priority: {"admitted": 0, "timed_out": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: int = PRIORITY_CHAT,
+        tokens: int = 0,
+        max_wait: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """
+        Hold an LLM slot for the duration of the block.
+
+        Args:
+            priority (int): PRIORITY_CHAT, PRIORITY_DIARY or PRIORITY_BATCH
+            tokens (int): Estimated prompt plus completion tokens of the call
+            max_wait (float, optional): Longest time to queue before giving up
+        """
+        await self._acquire(priority, tokens, max_wait)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def _acquire(self, priority: int, tokens: int, max_wait: Optional[float]) -> None:
+        waiter = _Waiter(priority, tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._stats[priority]["timed_out"] += 1
+                logger.warning(
+                    f"LLM call ({PRIORITY_NAMES.get(priority, priority)}) gave up after waiting {max_wait:.1f} seconds"
+                )
+                raise SchedulerTimeout(f"No LLM slot within {max_wait:.1f} seconds")
+        except BaseException:
+            # Cancelled while queued: drop the waiter, or hand back a slot
+            # that was granted in the meantime
+            if not waiter.future.done():
+                waiter.future.cancel()
+            elif not waiter.future.cancelled():
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+        wait = time.monotonic() - waiter.enqueued
+        llm_scheduler_wait.observe(wait, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        stats = self._stats[priority]
+        stats["admitted"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        if wait >= 0.5:
+            logger.info(f"LLM call ({PRIORITY_NAMES.get(priority, priority)}) queued for {wait:.2f} seconds")
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queue and (self.max_concurrency is None or self.in_flight < self.max_concurrency):
+            waiter = self._queue[0][2]
+            if waiter.future.done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._queue)
+                continue
+
+            delay = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if delay > 0:
+                # The head of the queue blocks everything behind it, so lower
+                # priorities never overtake a waiting chat call
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+    def queued(self) -> Dict[str, int]:
+        counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, waiter in self._queue:
+            if not waiter.future.done():
+                counts[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return counts
+
+    def stats(self) -> Dict[str, object]:
+        queued = self.queued()
+        per_priority = {}
+        for priority, stats in self._stats.items():
+            name = PRIORITY_NAMES[priority]
+            per_priority[name] = {
+                "queued": queued[name],
+                "admitted": stats["admitted"],
+                "timed_out": stats["timed_out"],
+                "avg_wait": stats["total_wait"] / stats["admitted"] if stats["admitted"] else 0.0,
+                "max_wait": stats["max_wait"]
+            }
+        return {
+            "in_flight": self.in_flight,
+            "request_tokens": self.requests.tokens,
+            "tpm_tokens": self.tokens.tokens,
+            "priorities": per_priority
+        }
+
+
+def _max_concurrency() -> Optional[int]:
+    # Defaults to the OpenAI connection pool size so the scheduler never caps
+    # below it; 0 turns the cap off entirely
+    value = int(os.getenv("LLM_MAX_CONCURRENCY") or os.getenv("OPENAI_MAX_CONNECTIONS", "500"))
+    return value if value > 0 else None
+
+
+llm_scheduler = LLMScheduler(
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "3500")),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "90000")),
+    max_concurrency=_max_concurrency()
+)
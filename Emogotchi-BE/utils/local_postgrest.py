@@ -0,0 +1,279 @@
+"""
+In-memory stand-in for the Supabase PostgREST API.
+
+SUPABASE_BACKEND=local mounts LocalPostgrestTransport on the Supabase
+clients, so the app, the batch job and the benchmarks run without a database.
+It covers what the routes use: select with column lists, the eq/neq/gt/gte/
+lt/lte/is/in filters and or/and groups of them, order, limit/offset, insert, upsert (merge or ignore
+duplicates on ``on_conflict`` or the table's primary key), update and
+delete, plus ``Prefer: return=minimal`` and ``count=exact``, and the SQL
+functions in migrations/ that the app calls through ``/rpc``.
+
+Every request waits SUPABASE_LOCAL_LATENCY_MS, like a round trip to the
+database would.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Primary keys used for upserts without on_conflict; other tables get an id
+PRIMARY_KEYS = {
+    "User": ("uuid",),
+    "users": ("uuid",),
+    "Diary": ("uuid", "date")
+}
+
+# Query parameters that aren't column filters
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns", "or", "and"}
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _coerce(value: str) -> Any:
+    """
+    Parse a value for ordering comparisons: numbers, then ISO timestamps.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return value
+
+
+def _compare(left: Any, op: str, right: str) -> bool:
+    if left is None:
+        return False
+    a, b = _coerce(_text(left)), _coerce(right)
+    if type(a) is not type(b):
+        a, b = _text(left), right
+    if op == "gt":
+        return a > b
+    if op == "gte":
+        return a >= b
+    if op == "lt":
+        return a < b
+    return a <= b
+
+
+def _split_terms(text: str) -> List[str]:
+    """
+    Split a logic group's body on the commas that aren't nested or quoted.
+    """
+    terms, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            terms.append(current)
+            current = ""
+            continue
+        current += char
+    terms.append(current)
+    return terms
+
+
+def _parse_group(kind: str, body: str) -> Tuple[str, list]:
+    """
+    Parse ``(col.op.value,and(...),...)`` into (kind, conditions).
+    """
+    conditions = []
+    for term in _split_terms(body.strip()[1:-1]):
+        nested = term.partition("(")[0]
+        if nested in ("and", "or"):
+            conditions.append(_parse_group(nested, term[len(nested):]))
+            continue
+        column, op, value = term.split(".", 2)
+        if op == "not":
+            real_op, _, value = value.partition(".")
+            op = "not." + real_op
+        conditions.append((column, op, value.strip('"')))
+    return kind, conditions
+
+
+def _matches(row: Dict[str, Any], filters: list) -> bool:
+    for condition in filters:
+        if len(condition) == 2:
+            kind, conditions = condition
+            results = (_matches(row, [nested]) for nested in conditions)
+            if not (any(results) if kind == "or" else all(results)):
+                return False
+            continue
+        column, op, value = condition
+        negate = op.startswith("not.")
+        if negate:
+            op = op[4:]
+        current = row.get(column)
+        if op == "eq":
+            result = current is not None and _text(current) == value
+        elif op == "neq":
+            result = current is not None and _text(current) != value
+        elif op == "is":
+            result = _text(current) == value if current is not None else value == "null"
+        elif op == "in":
+            result = current is not None and _text(current) in [v.strip('"') for v in value.strip("()").split(",")]
+        elif op in ("gt", "gte", "lt", "lte"):
+            result = _compare(current, op, value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if result == negate:
+            return False
+    return True
+
+
+class LocalPostgrestTransport(httpx.BaseTransport):
+    """
+    httpx transport answering PostgREST requests from in-memory tables.
+    """
+
+    def __init__(self, latency: float = 0.005, tables: Optional[Dict[str, List[dict]]] = None):
+        self.latency = latency
+        self.tables: Dict[str, List[dict]] = tables if tables is not None else {}
+        self._next_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        request.read()
+        table = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+        if "/rpc/" in request.url.path:
+            return self._rpc(table, json.loads(request.content or b"{}"))
+        params = request.url.params
+        filters = []
+        for key, value in params.multi_items():
+            if key in ("or", "and"):
+                filters.append(_parse_group(key, value))
+            elif key not in _RESERVED_PARAMS:
+                negate = value.startswith("not.")
+                op, _, operand = value[4:].partition(".") if negate else value.partition(".")
+                filters.append((key, "not." + op if negate else op, operand))
+        prefer = request.headers.get("prefer", "")
+
+        try:
+            with self._lock:
+                rows = self.tables.setdefault(table, [])
+                if request.method == "GET":
+                    status, result = 200, self._select(rows, filters, params)
+                elif request.method == "POST":
+                    body = json.loads(request.content or b"[]")
+                    status, result = 201, self._insert(table, rows, body, params.get("on_conflict"), prefer)
+                elif request.method == "PATCH":
+                    body = json.loads(request.content or b"{}")
+                    status, result = 200, self._update(rows, filters, body)
+                elif request.method == "DELETE":
+                    status, result = 200, self._delete(rows, filters)
+                else:
+                    return self._error(405, f"Unsupported method {request.method}")
+        except ValueError as e:
+            return self._error(400, str(e))
+
+        headers = {"content-type": "application/json"}
+        if "count=exact" in prefer:
+            headers["content-range"] = f"0-{max(len(result) - 1, 0)}/{len(result)}"
+        if "return=minimal" in prefer:
+            return httpx.Response(201 if request.method == "POST" else 204, headers=headers, request=request)
+        if request.method == "GET" and "select" in params:
+            result = self._project(result, params["select"])
+        return httpx.Response(status, headers=headers, content=json.dumps(result).encode(), request=request)
+
+    def _rpc(self, function: str, params: dict) -> httpx.Response:
+        if function != "increment_user_points":
+            return self._error(404, f"Unknown function {function}")
+        # migrations/002_increment_user_points.sql
+        with self._lock:
+            row = next((row for row in self.tables.get("User", []) if row.get("uuid") == params["user_uuid"]), None)
+            points = None
+            if row is not None:
+                row["points"] = (row.get("points") or 0) + params["delta"]
+                points = row["points"]
+        return httpx.Response(200, headers={"content-type": "application/json"}, content=json.dumps(points).encode())
+
+    @staticmethod
+    def _error(status: int, message: str) -> httpx.Response:
+        body = {"message": message, "code": str(status), "hint": None, "details": None}
+        return httpx.Response(status, json=body)
+
+    @staticmethod
+    def _project(rows: List[dict], select: str) -> List[dict]:
+        columns = [column.strip() for column in select.split(",")]
+        if "*" in columns:
+            return rows
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def _select(self, rows: List[dict], filters, params) -> List[dict]:
+        result = [dict(row) for row in rows if _matches(row, filters)]
+        order = params.get("order")
+        if order:
+            # Apply the sort keys right to left so the first one wins
+            for term in reversed(order.split(",")):
+                column, _, direction = term.partition(".")
+                present = [row for row in result if row.get(column) is not None]
+                missing = [row for row in result if row.get(column) is None]
+                present.sort(key=lambda row: _coerce(_text(row[column])), reverse=direction.startswith("desc"))
+                result = present + missing
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        return result[offset:offset + int(limit)] if limit else result[offset:]
+
+    def _insert(self, table: str, rows: List[dict], body, on_conflict: Optional[str], prefer: str) -> List[dict]:
+        items = body if isinstance(body, list) else [body]
+        upsert = "resolution=" in prefer
+        keys = tuple(on_conflict.split(",")) if on_conflict else PRIMARY_KEYS.get(table, ("id",))
+        result = []
+        for item in items:
+            if upsert:
+                existing = next((row for row in rows if all(row.get(k) == item.get(k) for k in keys)), None)
+                if existing is not None:
+                    if "ignore-duplicates" not in prefer:
+                        existing.update(item)
+                        result.append(dict(existing))
+                    continue
+            row = dict(item)
+            if "id" not in row:
+                self._next_ids[table] = self._next_ids.get(table, 0) + 1
+                row["id"] = self._next_ids[table]
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            rows.append(row)
+            result.append(dict(row))
+        return result
+
+    @staticmethod
+    def _update(rows: List[dict], filters, body: dict) -> List[dict]:
+        result = []
+        for row in rows:
+            if _matches(row, filters):
+                row.update(body)
+                result.append(dict(row))
+        return result
+
+    @staticmethod
+    def _delete(rows: List[dict], filters) -> List[dict]:
+        deleted = [row for row in rows if _matches(row, filters)]
+        rows[:] = [row for row in rows if not _matches(row, filters)]
+        return deleted
+
+
+# One database shared by every Supabase client in the process
+local_postgrest = LocalPostgrestTransport(latency=float(os.getenv("SUPABASE_LOCAL_LATENCY_MS", "5")) / 1000)
@@ -0,0 +1,209 @@
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A heartbeat task sleeps for ``interval`` seconds in a loop; how late each
+wake-up is gives the loop lag, kept over a sliding window for percentiles.
+A watchdog thread checks the heartbeat: when the loop hasn't come back for
+``threshold`` seconds it logs the loop thread's stack (which shows the
+blocking call) with the running task and the route it is serving.
+
+Routes are known through LoopDiagnosticsMiddleware, a pure ASGI middleware
+that maps each request's task to "METHOD /path" while it runs.
+
+Enabled with LOOP_DIAGNOSTICS=true (see main.py).
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class LoopMonitor:
+    """
+    Loop-lag percentiles plus stack dumps of callbacks that block the loop.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, window: int = 10000, max_reports: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0
+        self._lags: Deque[float] = deque(maxlen=window)
+        self._reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        self._routes: Dict[asyncio.Task, str] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    # Route tracking, called from the middleware on the loop thread
+
+    def enter_route(self, route: str) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._routes[task] = route
+
+    def exit_route(self) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._routes.pop(task, None)
+
+    # Lifecycle
+
+    def start(self) -> None:
+        if self._heartbeat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Loop monitor started (interval {self.interval}s, blocking threshold {self.threshold}s)")
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+        stats = self.stats()
+        logger.info(
+            f"Loop lag p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms, "
+            f"max {stats['max_ms']}ms; {stats['blocked']} blocking calls"
+        )
+
+    async def _heartbeat(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                self._lags.append(max(0.0, now - start - self.interval))
+                self._last_beat = now
+
+    # Watchdog thread
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 2):
+            with self._lock:
+                last_beat = self._last_beat
+            # Allow one heartbeat interval before counting the loop as blocked
+            if time.monotonic() - last_beat < self.interval + self.threshold or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+            self._report(time.monotonic() - last_beat - self.interval)
+
+    def _current_task(self) -> Optional[asyncio.Task]:
+        # asyncio.current_task() only works on the loop thread; read the
+        # loop's entry in asyncio's private table of running tasks instead
+        try:
+            return asyncio.tasks._current_tasks.get(self._loop)
+        except AttributeError:
+            return None
+
+    @staticmethod
+    def _callback_stack(frame) -> List[str]:
+        # Drop the event loop's own frames, up to the callback it is running
+        entries = traceback.format_stack(frame)
+        for i in range(len(entries) - 1, -1, -1):
+            if "asyncio" in entries[i] and "in _run\n" in entries[i]:
+                return entries[i + 1:]
+        return entries
+
+    def _report(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(self._callback_stack(frame)) if frame is not None else "<no frame>"
+        task = self._current_task()
+        route = self._routes.get(task, "<no route>") if task is not None else "<no task>"
+        task_name = task.get_name() if task is not None else None
+        report = {
+            "time": time.time(),
+            "blocked_ms": round(blocked_for * 1000, 1),
+            "route": route,
+            "task": task_name,
+            "stack": stack
+        }
+        with self._lock:
+            self.blocked += 1
+            self._reports.append(report)
+        logger.warning(
+            f"Event loop blocked for {report['blocked_ms']}ms+ while serving {route} (task {task_name}):\n{stack}"
+        )
+
+    # Export
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lags = sorted(self._lags)
+            blocked = self.blocked
+        return {
+            "samples": len(lags),
+            "p50_ms": round(_percentile(lags, 50) * 1000, 2),
+            "p95_ms": round(_percentile(lags, 95) * 1000, 2),
+            "p99_ms": round(_percentile(lags, 99) * 1000, 2),
+            "max_ms": round((lags[-1] if lags else 0.0) * 1000, 2),
+            "blocked": blocked
+        }
+
+    def reports(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._reports)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._lags.clear()
+            self._reports.clear()
+            self.blocked = 0
+
+
+class LoopDiagnosticsMiddleware:
+    """
+    Pure ASGI middleware recording which route each request task serves.
+
+    Pure ASGI (not BaseHTTPMiddleware) so the endpoint runs in the same task.
+    """
+
+    def __init__(self, app, monitor: LoopMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.monitor.enter_route(f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.exit_route()
+
+
+LOOP_DIAGNOSTICS = os.getenv("LOOP_DIAGNOSTICS", "false").lower() == "true"
+
+loop_monitor = LoopMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50")) / 1000,
+    threshold=float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+)
@@ -0,0 +1,348 @@
+"""
+Prometheus-style metrics served at /metrics.
+
+A small registry of counters, histograms and gauges rendered in the
+Prometheus text exposition format (version 0.0.4). Gauges of in-process
+state are callbacks read at scrape time.
+
+Label values must stay low-cardinality: routes are recorded by their
+template (``/user/{uuid}``), never the raw path.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Up to 30s so diary generations land in a finite bucket
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: bucket counts (non-cumulative), sum, count
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels: str) -> "_HistogramTimer":
+        return _HistogramTimer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = {key: (list(state[0]), state[1], state[2]) for key, state in self._values.items()}
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class _HistogramTimer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_HistogramTimer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+
+
+class Gauge(_Metric):
+    """
+    A gauge read from ``callback`` at scrape time. The callback returns a
+    number, or a dict of label-value tuples to numbers for labelled gauges.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object], labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        value = self.callback()
+        if isinstance(value, dict):
+            for key, number in value.items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(number)}"
+        else:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class CallbackCounter(Gauge):
+    """
+    A counter whose running total is kept elsewhere (an existing stats()
+    method) and read from ``callback`` at scrape time.
+    """
+
+    type_name = "counter"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], object],
+        labels: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, callback, labels))
+
+    def counter_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], object],
+        labels: Sequence[str] = ()
+    ) -> CallbackCounter:
+        return self._register(CallbackCounter(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # A failing state callback shouldn't take the whole scrape down
+                lines.append(f"# {metric.name} unavailable: {_escape(str(e))}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+
+# Stages of timed requests (utils/timing.py), e.g. request="chat", stage="reply"
+request_stage_duration = registry.histogram(
+    "request_stage_duration_seconds", "Duration of each timed stage of a request, including its total", ("request", "stage")
+)
+
+# LLM calls, labelled by call type (chat_reply, admin_analysis, animal_selection, diary)
+llm_request_duration = registry.histogram(
+    "llm_request_duration_seconds", "LLM completion latency by call type", ("call_type",)
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "LLM tokens by call type and kind (prompt or completion)", ("call_type", "kind")
+)
+llm_timeouts = registry.counter("llm_timeouts_total", "LLM calls that timed out, by call type", ("call_type",))
+llm_errors = registry.counter("llm_errors_total", "LLM calls that failed otherwise, by call type", ("call_type",))
+llm_fallbacks = registry.counter(
+    "llm_fallbacks_total", "Canned responses served instead of an LLM answer, by call type", ("call_type",)
+)
+
+llm_scheduler_wait = registry.histogram(
+    "llm_scheduler_wait_seconds", "Time LLM calls queued for a scheduler slot, by priority", ("priority",)
+)
+
+# Batched /chat writes
+batching_writer_flush_latency = registry.histogram(
+    "batching_writer_flush_latency_seconds", "Time from a batched flush until all of its writes landed in Supabase"
+)
+batching_writer_batch_size = registry.histogram(
+    "batching_writer_batch_size", "Chat rows plus user updates per batched flush",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+# Supabase PostgREST calls
+supabase_requests = registry.counter(
+    "supabase_requests_total", "Supabase requests by table, operation and status", ("table", "operation", "status")
+)
+supabase_request_duration = registry.histogram(
+    "supabase_request_duration_seconds", "Supabase request latency by table and operation", ("table", "operation")
+)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request counts and latency per route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; unmatched paths
+            # are pooled so random URLs can't grow the label set
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            http_request_duration.observe(time.perf_counter() - start_time, method=scope["method"], route=route_path)
+            http_requests.inc(method=scope["method"], route=route_path, status=str(status["code"]))
+
+
+def _postgrest_operation(request) -> str:
+    if "/rpc/" in request.url.path:
+        return "rpc"
+    if request.method == "GET":
+        return "select"
+    if request.method == "POST":
+        return "upsert" if "resolution=" in request.headers.get("prefer", "") else "insert"
+    if request.method == "PATCH":
+        return "update"
+    if request.method == "DELETE":
+        return "delete"
+    return request.method.lower()
+
+
+def _on_postgrest_request(request) -> None:
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+def _on_postgrest_response(response) -> None:
+    # Runs once the response headers are in; PostgREST bodies are small, so
+    # this is close to the full round trip
+    request = response.request
+    start_time = request.extensions.get("metrics_start")
+    table = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+    operation = _postgrest_operation(request)
+    if start_time is not None:
+        supabase_request_duration.observe(time.perf_counter() - start_time, table=table, operation=operation)
+    supabase_requests.inc(table=table, operation=operation, status=str(response.status_code))
+
+
+def instrument_postgrest_session(session) -> None:
+    """
+    Add the Supabase metrics event hooks to a PostgREST httpx session.
+    """
+    session.event_hooks = {
+        "request": [*session.event_hooks["request"], _on_postgrest_request],
+        "response": [*session.event_hooks["response"], _on_postgrest_response]
+    }
@@ -0,0 +1,211 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A request carrying ``X-Profile: <PROFILE_SECRET>`` (or ``?profile=<secret>``)
+runs under a sampler thread that reads the event-loop thread's stack every
+PROFILE_SAMPLE_INTERVAL_MS while the request's task is the one running, and
+counts the samples taken while the task is suspended (waiting on OpenAI or
+Supabase) as ``<await>``. The samples are written as collapsed stacks
+(``frame;frame;frame count``), the input of flamegraph.pl and speedscope, to
+PROFILE_DIR; only the newest PROFILE_MAX_FILES dumps are kept. The response
+carries the dump's file name in ``X-Profile-Dump``.
+
+While the loop is busy the sampler only gets the GIL every
+sys.getswitchinterval() (5ms by default), which caps the effective rate.
+
+One request is profiled at a time; a flagged request arriving meanwhile is
+served unprofiled. Without PROFILE_SECRET the middleware isn't installed at
+all (see main.py), and unflagged requests only pay a header scan.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_EVENTS_FILE = os.path.join("asyncio", "events.py")
+
+
+def _fold(frame) -> str:
+    """
+    Collapse a stack into ``outer;...;inner``, dropping the event loop's own
+    frames up to the callback it is running.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename.endswith(_EVENTS_FILE):
+            break
+        name = getattr(code, "co_qualname", code.co_name)
+        names.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names)) or "<loop>"
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the loop thread on behalf of one request task.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float, max_seconds: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.task = task
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stopped.wait(self.interval) and time.monotonic() < deadline:
+            # Same private table LoopMonitor reads: the task running on the loop right now
+            if asyncio.tasks._current_tasks.get(self._loop) is not self.task:
+                self.stacks["<await>"] += 1
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join(timeout=1)
+        return self.stacks
+
+
+class RequestProfiler:
+    """
+    Writes per-request profiles to a directory capped at ``max_files`` dumps.
+    """
+
+    def __init__(self, directory: str, max_files: int = 100, interval: float = 0.002, max_seconds: float = 60.0):
+        self.directory = directory
+        self.max_files = max_files
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._busy = threading.Lock()
+
+    def start(self) -> Optional[_Sampler]:
+        """
+        Start sampling the current task, or return None if a profile is already running.
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+        sampler = _Sampler(asyncio.current_task(), self.interval, self.max_seconds)
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler: _Sampler) -> Counter:
+        try:
+            return sampler.stop()
+        finally:
+            self._busy.release()
+
+    @staticmethod
+    def dump_name(method: str, path: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", path.strip("/"))[:60] or "root"
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        return f"{stamp}-{int(time.time() * 1000) % 1000:03d}-{method}-{slug}.folded"
+
+    def write(self, name: str, stacks: Counter) -> str:
+        """
+        Write a dump, then delete the oldest ones beyond ``max_files``.
+
+        Returns:
+            str: Path of the written dump
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        dumps = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".folded")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in dumps[:max(0, len(dumps) - self.max_files)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        return path
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling requests flagged with the profiling secret.
+
+    Pure ASGI (not BaseHTTPMiddleware) so the endpoint runs in the same task
+    the sampler watches.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler, secret: str):
+        self.app = app
+        self.profiler = profiler
+        self.secret = secret.encode()
+
+    def _flagged(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return hmac.compare_digest(value, self.secret)
+        query = scope.get("query_string", b"")
+        if b"profile=" in query:
+            values = parse_qs(query.decode("latin-1")).get("profile", [])
+            return any(hmac.compare_digest(value.encode("latin-1"), self.secret) for value in values)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._flagged(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = self.profiler.start()
+        if sampler is None:
+            logger.warning(f"Profile already running; serving {scope['method']} {scope['path']} unprofiled")
+            await self.app(scope, receive, send)
+            return
+
+        name = self.profiler.dump_name(scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-dump", name.encode())]
+            await send(message)
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stacks = self.profiler.finish(sampler)
+            elapsed = time.perf_counter() - start_time
+            try:
+                path = await asyncio.to_thread(self.profiler.write, name, stacks)
+                waiting = stacks.get("<await>", 0)
+                logger.info(
+                    f"Profiled {scope['method']} {scope['path']} in {elapsed:.3f}s: "
+                    f"{sum(stacks.values()) - waiting} on-loop samples, {waiting} waiting; wrote {path}"
+                )
+            except OSError as e:
+                logger.error(f"Error writing profile {name}: {str(e)}")
+
+
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+
+request_profiler = RequestProfiler(
+    directory=os.getenv("PROFILE_DIR", "profiles"),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "100")),
+    interval=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "2")) / 1000,
+    max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+)
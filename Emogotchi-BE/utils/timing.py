@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+from utils.metrics import request_stage_duration
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StageStats:
+    """
+    Process-wide count/total/max duration per ``<request>.<stage>`` key.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stages.get(key)
+            if stats is None:
+                stats = [0, 0.0, 0.0]
+                self._stages[key] = stats
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                key: {"count": count, "avg": total / count, "max": max_seconds}
+                for key, (count, total, max_seconds) in self._stages.items()
+            }
+
+
+stage_stats = StageStats()
+
+
+class SpanExporter:
+    """
+    In-process exporter keeping the most recent finished request traces.
+
+    A trace is a dict with ``trace_id``, ``name``, ``start`` (epoch seconds),
+    ``duration_ms`` and ``spans`` (each ``name``, ``start_ms`` from the start
+    of the request, ``duration_ms``). Listeners added with ``subscribe`` get
+    every trace as it finishes, e.g. to forward them elsewhere.
+    """
+
+    def __init__(self, max_traces: int = 1000):
+        self._traces: Deque[Dict[str, Any]] = deque(maxlen=max_traces)
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        self._listeners.append(listener)
+
+    def export(self, trace: Dict[str, Any]) -> None:
+        with self._lock:
+            self._traces.append(trace)
+        for listener in self._listeners:
+            try:
+                listener(trace)
+            except Exception as e:
+                logger.warning(f"Span listener failed: {str(e)}")
+
+    def traces(self, name: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Return the recent traces, oldest first, optionally only those of one request name.
+        """
+        with self._lock:
+            traces = [trace for trace in self._traces if name is None or trace["name"] == name]
+        return traces[-limit:] if limit else traces
+
+    def clear(self) -> None:
+        with self._lock:
+            self._traces.clear()
+
+
+span_exporter = SpanExporter(max_traces=int(os.getenv("SPAN_EXPORTER_MAX_TRACES", "1000")))
+
+# The StageTimer of the request being handled, for helpers shared with
+# callers that don't time anything (e.g. the batch diary job)
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("current_timer", default=None)
+
+# Timers started while ServerTimingMiddleware handles a request. A mutable
+# list, so timers started in tasks with a copied context still land in it
+_request_timers: ContextVar[Optional[List["StageTimer"]]] = ContextVar("request_timers", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of the current request's StageTimer; a no-op outside one.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+class StageTimer:
+    """
+    Records how long each stage of one request took. Stages may overlap (a
+    stage running as a task alongside another), so their sum can exceed the
+    request's total time; the difference is the time saved by running them
+    concurrently.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.stages: Dict[str, float] = {}
+        self.spans: List[Dict[str, float]] = []
+        self.total: Optional[float] = None
+        self._start = time.perf_counter()
+        self._start_time = time.time()
+        # Make this the current timer of the request's task (and tasks it starts)
+        self._token = _current_timer.set(self)
+        request_timers = _request_timers.get()
+        if request_timers is not None:
+            request_timers.append(self)
+
+    def record(self, stage: str, seconds: float, start: Optional[float] = None) -> None:
+        """
+        Record a stage that took ``seconds``, started at perf_counter ``start`` (default: just now).
+        """
+        start = time.perf_counter() - seconds if start is None else start
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.spans.append({
+            "name": stage,
+            "start_ms": round((start - self._start) * 1000, 2),
+            "duration_ms": round(seconds * 1000, 2)
+        })
+        stage_stats.observe(f"{self.name}.{stage}", seconds)
+        request_stage_duration.observe(seconds, request=self.name, stage=stage)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time, start_time)
+
+    async def timed(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """
+        Await ``awaitable`` as the named stage.
+        """
+        with self.stage(stage):
+            return await awaitable
+
+    def finish(self) -> Dict[str, float]:
+        """
+        Record the total time of the request, log the stage breakdown and
+        export the trace.
+        """
+        total = time.perf_counter() - self._start
+        self.total = total
+        stage_stats.observe(f"{self.name}.total", total)
+        request_stage_duration.observe(total, request=self.name, stage="total")
+        breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stages.items())
+        logger.info(f"{self.name} timing: total={total * 1000:.0f}ms ({breakdown})")
+        span_exporter.export({
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self._start_time,
+            "duration_ms": round(total * 1000, 2),
+            "spans": list(self.spans)
+        })
+        try:
+            _current_timer.reset(self._token)
+        except ValueError:
+            # Finished from another context; that context's copy ends with it
+            pass
+        return {**self.stages, "total": total}
+
+    def server_timing(self) -> str:
+        """
+        The stage totals as a Server-Timing header value, e.g.
+        ``user_fetch;dur=12.1, reply;dur=230.4, total;dur=240.9``.
+        """
+        metrics = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        if self.total is not None:
+            metrics.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Pure ASGI middleware adding the Server-Timing header of the request's
+    StageTimer to its response.
+
+    Set here rather than on the endpoint's Response, which FastAPI discards
+    when the endpoint raises HTTPException, so 404/500/504 responses keep
+    their timing too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timers: List[StageTimer] = []
+        token = _request_timers.set(timers)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and timers:
+                header = timers[0].server_timing()
+                if header:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timers.reset(token)
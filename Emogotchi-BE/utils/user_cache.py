@@ -0,0 +1,120 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config.supabase_client import db_call, supabase
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Per-process cache of User rows keyed by uuid, with a TTL and LRU eviction.
+
+    Each worker has its own copy, so the TTL bounds how long a write made by
+    another worker can go unseen.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 30):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._rows: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_uuid: str) -> Optional[dict]:
+        """
+        Return a copy of the cached row, or None on a miss.
+        """
+        with self._lock:
+            entry = self._rows.get(user_uuid)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+                if entry is not None:
+                    del self._rows[user_uuid]
+                self.misses += 1
+                return None
+            self._rows.move_to_end(user_uuid)
+            self.hits += 1
+            return copy.copy(entry[1])
+
+    def put(self, user_uuid: str, row: dict) -> None:
+        with self._lock:
+            self._rows[user_uuid] = (time.monotonic(), copy.copy(row))
+            self._rows.move_to_end(user_uuid)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def update(self, user_uuid: str, fields: dict) -> None:
+        """
+        Merge written fields into a cached row (no-op if the row isn't cached).
+        """
+        with self._lock:
+            entry = self._rows.get(user_uuid)
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, user_uuid: str) -> None:
+        with self._lock:
+            self._rows.pop(user_uuid, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._rows),
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+user_cache = UserCache(
+    max_size=int(os.getenv("USER_CACHE_MAX_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+)
+
+
+async def fetch_user_row(user_uuid: str) -> Optional[dict]:
+    """
+    Read-through lookup of a User row.
+
+    Returns:
+        Optional[dict]: The row, or None if the user doesn't exist
+    """
+    row = user_cache.get(user_uuid)
+    if row is not None:
+        return row
+
+    user_response = await db_call(
+        lambda: supabase.table("User").select("*").eq("uuid", user_uuid).execute()
+    )
+    if not user_response.data:
+        return None
+    row = user_response.data[0]
+    user_cache.put(user_uuid, row)
+    return row
+
+
+async def update_user_row(user_uuid: str, fields: dict):
+    """
+    Write-through update of a User row in a single round trip.
+
+    Returns:
+        The Supabase response of the update; ``data`` holds the updated row,
+        or is empty if no user matched
+    """
+    result = await db_call(
+        lambda: supabase.table("User").update(fields).eq("uuid", user_uuid).execute()
+    )
+    if result.data:
+        user_cache.put(user_uuid, result.data[0])
+    else:
+        user_cache.invalidate(user_uuid)
+    return result
@@ -0,0 +1,376 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from config.supabase_client import db_call, supabase
+from utils.metrics import batching_writer_batch_size, batching_writer_flush_latency
+from utils.user_cache import user_cache
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class WriteJob:
+    """
+    A single Supabase write: ``op`` ("insert", "upsert", "update" or "delete")
+    on ``table`` with ``payload``, filtered by the equality filters in ``match``.
+    For ``op="rpc"``, ``table`` is the SQL function and ``payload`` its arguments.
+    ``on_success`` is called on the loop with the response once the write lands.
+    """
+
+    __slots__ = ("table", "op", "payload", "match", "on_success", "attempts")
+
+    def __init__(
+        self,
+        table: str,
+        op: str,
+        payload: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None,
+        match: Optional[Dict[str, Any]] = None,
+        on_success: Optional[Callable[[Any], None]] = None
+    ):
+        self.table = table
+        self.op = op
+        self.payload = payload
+        self.match = match or {}
+        self.on_success = on_success
+        self.attempts = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"table": self.table, "op": self.op, "payload": self.payload, "match": self.match}
+
+
+class BackgroundWriter:
+    """
+    Runs Supabase writes off the request path: an asyncio queue drained by a
+    pool of workers, with bounded retries and a JSON-lines dead-letter log for
+    writes that still fail.
+    """
+
+    def __init__(
+        self,
+        client=supabase,
+        workers: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        timeout: float = 3.0,
+        max_queue: int = 10000,
+        dead_letter_path: str = "dead_letter.jsonl"
+    ):
+        self.client = client
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.dead_letter_path = dead_letter_path
+        self.completed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """
+        Start the worker pool on the running event loop (idempotent).
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Background writer started with {self.workers} workers")
+
+    def submit(self, job: WriteJob) -> None:
+        """
+        Queue a write without waiting for it.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._dead_letter(job, "write queue full")
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Flush queued writes and stop the workers. Writes that can't be flushed
+        within the timeout are dead-lettered.
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out flushing background writes")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._queue.empty():
+            self._dead_letter(self._queue.get_nowait(), "not flushed before shutdown")
+        logger.info("Background writer stopped")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: WriteJob) -> None:
+        while True:
+            job.attempts += 1
+            try:
+                result = await db_call(self._execute, job, timeout=self.timeout)
+                self.completed += 1
+                if job.on_success is not None:
+                    job.on_success(result)
+                return
+            except asyncio.CancelledError:
+                self._dead_letter(job, "cancelled during shutdown")
+                raise
+            except Exception as e:
+                if job.attempts > self.max_retries:
+                    self._dead_letter(job, str(e) or type(e).__name__)
+                    return
+                self.retried += 1
+                logger.warning(f"Retrying {job.op} on {job.table} (attempt {job.attempts}): {str(e)}")
+                await asyncio.sleep(self.retry_backoff * (2 ** (job.attempts - 1)))
+
+    def _execute(self, job: WriteJob):
+        if job.op == "rpc":
+            return self.client.rpc(job.table, job.payload).execute()
+        table = self.client.table(job.table)
+        if job.op == "insert":
+            query = table.insert(job.payload)
+        elif job.op == "upsert":
+            query = table.upsert(job.payload)
+        elif job.op == "update":
+            query = table.update(job.payload)
+        elif job.op == "delete":
+            query = table.delete()
+        else:
+            raise ValueError(f"Unknown write op: {job.op}")
+        for column, value in job.match.items():
+            query = query.eq(column, value)
+        return query.execute()
+
+    def _dead_letter(self, job: WriteJob, error: str) -> None:
+        self.dead_lettered += 1
+        record = {"time": time.time(), "error": error, "attempts": job.attempts, **job.to_dict()}
+        logger.error(f"Dead-lettering {job.op} on {job.table}: {error}")
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except Exception as e:
+            logger.error(f"Failed to write dead letter: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.depth(),
+            "completed": self.completed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered
+        }
+
+
+class BatchingWriter:
+    """
+    Coalesces high-volume /chat writes before they reach the BackgroundWriter.
+
+    Chat rows collected over ``flush_interval`` seconds (or until ``batch_size``
+    items are pending) are flushed as one bulk insert, and point deltas are
+    summed so each user gets a single update per flush.
+
+    Points are applied in the database with the increment_user_points function
+    (migrations/002_increment_user_points.sql) rather than written as an
+    absolute value, so increments from other workers or /user/update/points
+    aren't overwritten by a stale cached total.
+    """
+
+    def __init__(self, writer: BackgroundWriter, flush_interval: float = 0.25, batch_size: int = 100):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flushes = 0
+        self.flushed_items = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        # Flush latency: from handing a batch to the BackgroundWriter until
+        # all of its writes landed (batches with a dead-lettered write never do)
+        self.landed_flushes = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._chat_rows: List[Dict[str, Any]] = []
+        # uuid -> [summed points delta, other fields]
+        self._user_updates: Dict[str, list] = {}
+        self._oldest: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start the periodic flush loop on the running event loop (idempotent).
+        """
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def pending(self) -> int:
+        return len(self._chat_rows) + len(self._user_updates)
+
+    def oldest_pending_age(self) -> float:
+        """
+        Seconds the oldest write waiting for the next flush has been pending.
+        """
+        return time.monotonic() - self._oldest if self._oldest is not None else 0.0
+
+    def _added(self) -> None:
+        self.start()
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self.pending() >= self.batch_size:
+            self._wakeup.set()
+
+    def add_chat(self, row: Dict[str, Any]) -> None:
+        """
+        Queue a Chat row for the next bulk insert.
+        """
+        self._chat_rows.append(row)
+        self._added()
+
+    def add_points(self, user_uuid: str, delta: int, fields: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Queue a points change for a user. Deltas within one flush window are
+        summed into one increment; other fields are last-write-wins.
+        """
+        update = self._user_updates.get(user_uuid)
+        if update is None:
+            update = [0, {}]
+            self._user_updates[user_uuid] = update
+        update[0] += delta
+        if fields:
+            update[1].update(fields)
+        self._added()
+
+    def _points_applied(self, user_uuid: str):
+        def refresh(result) -> None:
+            # The function returns the stored total; add what is still pending
+            # here so the cached row matches what the user will see after the
+            # next flush
+            if result.data is None:
+                user_cache.invalidate(user_uuid)
+                return
+            pending = self._user_updates.get(user_uuid)
+            user_cache.update(user_uuid, {"points": result.data + (pending[0] if pending else 0)})
+        return refresh
+
+    def flush(self) -> None:
+        """
+        Hand the pending batch to the BackgroundWriter.
+        """
+        if self._oldest is None:
+            return
+        chat_rows, self._chat_rows = self._chat_rows, []
+        user_updates, self._user_updates = self._user_updates, {}
+        self._oldest = None
+
+        jobs = []
+        if chat_rows:
+            jobs.append(WriteJob("Chat", "insert", chat_rows))
+        for user_uuid, (delta, fields) in user_updates.items():
+            if fields:
+                jobs.append(WriteJob("User", "update", fields, match={"uuid": user_uuid}))
+            if delta:
+                jobs.append(WriteJob(
+                    "increment_user_points",
+                    "rpc",
+                    {"user_uuid": user_uuid, "delta": delta},
+                    on_success=self._points_applied(user_uuid)
+                ))
+        self._track_landing(jobs)
+        for job in jobs:
+            self.writer.submit(job)
+
+        batch_size = len(chat_rows) + len(user_updates)
+        self.flushes += 1
+        self.flushed_items += batch_size
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        batching_writer_batch_size.observe(batch_size)
+
+    def _track_landing(self, jobs: List[WriteJob]) -> None:
+        # Chain onto each job's on_success and record the flush latency when
+        # the last write of the batch has landed
+        start_time = time.monotonic()
+        remaining = [len(jobs)]
+
+        def landed(callback: Optional[Callable[[Any], None]]) -> Callable[[Any], None]:
+            def on_success(result) -> None:
+                if callback is not None:
+                    callback(result)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    latency = time.monotonic() - start_time
+                    self.landed_flushes += 1
+                    self.total_flush_latency += latency
+                    self.max_flush_latency = max(self.max_flush_latency, latency)
+                    batching_writer_flush_latency.observe(latency)
+            return on_success
+
+        for job in jobs:
+            job.on_success = landed(job.on_success)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.flush()
+
+    async def stop(self) -> None:
+        """
+        Stop the flush loop and flush what is pending.
+        """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": self.pending(),
+            "flushes": self.flushes,
+            "flushed_items": self.flushed_items,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.flushed_items / self.flushes if self.flushes else 0.0,
+            "avg_flush_latency": self.total_flush_latency / self.landed_flushes if self.landed_flushes else 0.0,
+            "max_flush_latency": self.max_flush_latency
+        }
+
+
+background_writer = BackgroundWriter(
+    workers=int(os.getenv("WRITE_WORKERS", "4")),
+    max_retries=int(os.getenv("WRITE_MAX_RETRIES", "3")),
+    timeout=float(os.getenv("WRITE_TIMEOUT_SECONDS", "3")),
+    max_queue=int(os.getenv("WRITE_QUEUE_SIZE", "10000")),
+    dead_letter_path=os.getenv("DEAD_LETTER_PATH", "dead_letter.jsonl")
+)
+
+batching_writer = BatchingWriter(
+    background_writer,
+    flush_interval=float(os.getenv("WRITE_BATCH_INTERVAL_MS", "250")) / 1000,
+    batch_size=int(os.getenv("WRITE_BATCH_SIZE", "100"))
+)